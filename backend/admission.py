@@ -0,0 +1,210 @@
+"""
+Memory-aware admission control for conversions.
+
+Memory use per conversion is driven by the decoded pixel count, not by the
+upload size, so each job's peak is estimated from the HEIF header and the
+planned transforms before anything is decoded. A job only starts when the
+estimate fits in a global budget; others wait their turn, and give up with
+a busy error when the wait gets too long.
+
+The CPU cost of each job is estimated from the same header and plan, for
+ordering jobs in the scheduler (see scheduler.py).
+"""
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Optional, Sequence, Tuple
+
+from executor import ExecutorBusyError
+from formats import FORMATS
+from heif_container import HeifHeader
+from transforms import TransformPlan
+
+# Interpreter, libraries and codec state of a worker, on top of pixel buffers
+BASE_OVERHEAD_BYTES = 16 * 1024 * 1024
+
+# Time per output pixel of a resize, rotate or transpose, relative to decoding a pixel
+TRANSFORM_COST = 0.1
+
+# Encodes a max_bytes search typically needs
+SIZE_SEARCH_PASSES = 3
+
+
+class MemoryBudgetExceededError(ExecutorBusyError):
+    """Raised when a job could not be admitted within the wait limit"""
+
+
+def estimate_peak_bytes(header: HeifHeader, plan: TransformPlan) -> int:
+    """
+    Estimate the peak memory of converting an image
+
+    Decoding holds libheif's output buffer and the PIL image built from it
+    at the same time (plus an RGB copy when there is alpha to drop). Each
+    transform step then holds its input and output images at once.
+
+    Args:
+        header: Parsed header of the input file
+        plan: Transforms planned for the full-resolution image
+    """
+    width, height = header.size
+    pixels = width * height
+    channels = 4 if header.has_alpha else 3
+
+    decode_peak = 2 * pixels * channels
+    if channels == 4:
+        decode_peak = max(decode_peak, pixels * (channels + 3))
+
+    peak = decode_peak
+    current = pixels * 3
+    for step_width, step_height in plan.step_sizes():
+        produced = step_width * step_height * 3
+        peak = max(peak, current + produced)
+        current = produced
+
+    # The encoded JPEG is held next to the final image
+    return BASE_OVERHEAD_BYTES + max(peak, current + current // 4)
+
+
+def estimate_cost(
+    header: HeifHeader,
+    plan: TransformPlan,
+    formats: Sequence[str] = ("jpeg",),
+    max_bytes: Optional[int] = None,
+) -> float:
+    """
+    Estimate the CPU time of a conversion, in megapixels of HEIC decoding
+
+    Decoding dominates for JPEG output; each transform step and each output
+    format adds work in proportion to the pixels it produces.
+
+    Args:
+        header: Parsed header of the input file
+        plan: Transforms planned for the full-resolution image
+        formats: Names of the output formats from formats.FORMATS
+        max_bytes: Output size limit; fitting it takes several encodes
+    """
+    cost = float(header.pixel_count)
+    for width, height in plan.step_sizes():
+        cost += TRANSFORM_COST * width * height
+
+    output_pixels = plan.output_size[0] * plan.output_size[1]
+    for name in formats:
+        fmt = FORMATS[name]
+        passes = SIZE_SEARCH_PASSES if max_bytes is not None and fmt.lossy else 1
+        cost += fmt.encode_cost * passes * output_pixels
+    return cost / 1_000_000
+
+
+def estimate_streaming_peak_bytes(header: HeifHeader, band_height: int) -> int:
+    """
+    Estimate the peak memory of converting a grid image a tile row at a time
+
+    A composed tile row, a band cut from it and the tile being decoded (with
+    its libheif buffer) are held at once, plus the encoded band.
+
+    Args:
+        header: Parsed header of the input file, whose primary image is a grid
+        band_height: Rows per encoded band, from streaming.band_height()
+    """
+    width, _ = header.size
+    tile_width, tile_height = header.items[header.primary_item.references["dimg"][0]].size
+    channels = 4 if header.has_alpha else 3
+
+    tile_row = width * max(tile_height, band_height) * 3
+    band = width * band_height * 3
+    tile = 2 * tile_width * tile_height * channels
+    return BASE_OVERHEAD_BYTES + tile_row + band + tile + band // 4
+
+
+class MemoryBudget:
+    """
+    First-come, first-served reservations against a byte budget
+
+    A job larger than the whole budget is clamped to it, so it still runs,
+    alone. Waiters are admitted in arrival order so large jobs are not
+    starved by a stream of small ones.
+
+    Args:
+        limit_bytes: Total bytes that running jobs may reserve; 0 disables the budget
+        max_wait_seconds: How long a job may wait before it is rejected
+    """
+
+    def __init__(self, limit_bytes: int, max_wait_seconds: float):
+        self.limit_bytes = limit_bytes
+        self.max_wait_seconds = max_wait_seconds
+        self._reserved = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit_bytes > 0
+
+    @property
+    def reserved_bytes(self) -> int:
+        return self._reserved
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _fits(self, nbytes: int) -> bool:
+        return self._reserved + nbytes <= self.limit_bytes
+
+    def _wake(self) -> None:
+        while self._waiters:
+            nbytes, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(nbytes):
+                break
+            self._waiters.popleft()
+            self._reserved += nbytes
+            future.set_result(None)
+
+    def _release(self, nbytes: int) -> None:
+        self._reserved -= nbytes
+        self._wake()
+
+    async def _acquire(self, nbytes: int) -> None:
+        if not self._waiters and self._fits(nbytes):
+            self._reserved += nbytes
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((nbytes, future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait_seconds)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Admitted just as the wait ran out
+                return
+            future.cancel()
+            self.rejected += 1
+            self._wake()
+            raise MemoryBudgetExceededError(
+                f"Not enough memory to start the conversion within {self.max_wait_seconds} seconds"
+            )
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(nbytes)
+            else:
+                future.cancel()
+                self._wake()
+            raise
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int) -> AsyncIterator[None]:
+        """Hold a reservation of nbytes while the block runs"""
+        if not self.enabled or nbytes <= 0:
+            yield
+            return
+
+        nbytes = min(nbytes, self.limit_bytes)
+        await self._acquire(nbytes)
+        try:
+            yield
+        finally:
+            self._release(nbytes)
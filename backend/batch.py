@@ -0,0 +1,62 @@
+"""
+Helpers for streaming the results of a batch conversion.
+"""
+
+import json
+import zipfile
+from typing import Any, Dict, List, Set
+
+
+class ZipStream:
+    """
+    Build a ZIP archive incrementally, handing out its bytes as entries are added
+
+    The archive is written to an unseekable sink, so zipfile uses data
+    descriptors and nothing but the current entry is held in memory.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._zip = zipfile.ZipFile(self, mode="w", compression=zipfile.ZIP_STORED)
+
+    # File-like interface used by zipfile
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+    def add(self, name: str, data: bytes) -> bytes:
+        """Add an entry and return the archive bytes produced so far"""
+        self._zip.writestr(name, data)
+        return self._drain()
+
+    def close(self) -> bytes:
+        """Finish the archive and return its remaining bytes"""
+        self._zip.close()
+        return self._drain()
+
+
+def unique_name(name: str, used: Set[str]) -> str:
+    """Return name, or a numbered variant of it, that is not in used"""
+    candidate = name
+    stem, dot, suffix = name.rpartition(".")
+    if not dot:
+        stem, suffix = name, ""
+    counter = 1
+    while candidate in used:
+        candidate = f"{stem} ({counter}){dot}{suffix}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+def ndjson_line(result: Dict[str, Any]) -> bytes:
+    """Serialize a per-file result as one NDJSON line"""
+    return (json.dumps(result, separators=(",", ":")) + "\n").encode()
@@ -0,0 +1,9 @@
+"""
+Benchmarks for the conversion pipeline.
+
+Run from the backend directory after `pip install -r requirements-dev.txt`,
+e.g. `python -m benchmarks.downscale`. `python -m benchmarks.pipeline`
+generates a synthetic HEIC corpus with pillow-heif and times every stage of
+both servers' pipelines; `python -m benchmarks.load` load-tests the API on
+the same corpus.
+"""
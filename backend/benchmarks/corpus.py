@@ -0,0 +1,171 @@
+"""
+Reproducible synthetic HEIC corpus for the benchmarks.
+
+Images are rendered from deterministic patterns (no random noise) and
+encoded locally with pillow-heif, so the same corpus can be regenerated
+offline on any Linux box. Grid images are assembled from individually
+encoded tiles with the HEIF container writer.
+
+Usage:
+    python -m benchmarks.corpus [--directory benchmarks/corpus] [--quick]
+"""
+
+import argparse
+import hashlib
+import io
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from heif_container import build_grid_heif, read_heif_header, read_item_data
+
+DEFAULT_DIRECTORY = Path(__file__).resolve().parent / "corpus"
+
+# Version of the rendering code; bump it to force regeneration
+CORPUS_VERSION = 1
+
+
+@dataclass(frozen=True)
+class CorpusImage:
+    """Description of one generated image"""
+    name: str
+    width: int
+    height: int
+    bit_depth: int = 8
+    alpha: bool = False
+    tile_size: Optional[int] = None  # Encode as a grid of square tiles
+    quality: int = 90
+
+    @property
+    def filename(self) -> str:
+        return f"{self.name}.heic"
+
+
+DEFAULT_CORPUS: List[CorpusImage] = [
+    CorpusImage("small-8bit", 640, 480),
+    CorpusImage("hd-8bit", 1920, 1080),
+    CorpusImage("hd-10bit", 1920, 1080, bit_depth=10),
+    CorpusImage("hd-alpha", 1920, 1080, alpha=True),
+    CorpusImage("12mp-8bit", 4032, 3024),
+    CorpusImage("12mp-grid", 4032, 3024, tile_size=512),
+]
+
+QUICK_CORPUS: List[CorpusImage] = [
+    CorpusImage("small-8bit", 640, 480),
+    CorpusImage("small-10bit", 640, 480, bit_depth=10),
+    CorpusImage("small-alpha", 640, 480, alpha=True),
+    CorpusImage("small-grid", 640, 480, tile_size=256),
+]
+
+
+def render(width: int, height: int, alpha: bool = False) -> Image.Image:
+    """Deterministic test pattern with smooth areas, edges and fine detail"""
+    fractal = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 0.8, 1.2), 128)
+    linear = Image.linear_gradient("L").resize((width, height))
+    radial = Image.radial_gradient("L").resize((width, height))
+    image = Image.merge("RGB", (fractal, linear, radial))
+    if alpha:
+        image.putalpha(linear.transpose(Image.Transpose.FLIP_LEFT_RIGHT))
+    return image
+
+
+def _encode(image: Image.Image, bit_depth: int, quality: int) -> bytes:
+    """Encode an image as HEIC with pillow-heif"""
+    try:
+        import pillow_heif
+    except ImportError:
+        raise RuntimeError("Generating the corpus requires pillow-heif (pip install pillow-heif)")
+
+    buffer = io.BytesIO()
+    if bit_depth == 8:
+        pillow_heif.from_pillow(image).save(buffer, quality=quality)
+        return buffer.getvalue()
+
+    # Widen each 8-bit sample to the high byte of a native 16-bit sample;
+    # pillow-heif stores 16-bit input as 10-bit
+    mode = image.mode + ";16"
+    data = image.tobytes()
+    wide = bytearray(len(data) * 2)
+    wide[1::2] = data
+    pillow_heif.options.SAVE_HDR_TO_12_BIT = bit_depth == 12
+    pillow_heif.from_bytes(mode, image.size, bytes(wide)).save(buffer, quality=quality)
+    return buffer.getvalue()
+
+
+def _encode_grid(image: Image.Image, spec: CorpusImage) -> bytes:
+    """Encode an image as a grid of tiles, padding the last row and column"""
+    tile = spec.tile_size
+    columns = -(-spec.width // tile)
+    rows = -(-spec.height // tile)
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            box = (column * tile, row * tile, (column + 1) * tile, (row + 1) * tile)
+            # Edge tiles are padded with black by cropping past the image
+            coded = _encode(image.crop(box), spec.bit_depth, spec.quality)
+            header = read_heif_header(coded)
+            item = header.primary_item
+            tiles.append((item.item_type, item.properties, read_item_data(coded, header, item)))
+    return build_grid_heif(tiles, rows, columns, (spec.width, spec.height))
+
+
+def generate_image(spec: CorpusImage) -> bytes:
+    """Render and encode a single corpus image"""
+    image = render(spec.width, spec.height, spec.alpha)
+    if spec.tile_size:
+        return _encode_grid(image, spec)
+    return _encode(image, spec.bit_depth, spec.quality)
+
+
+def generate_corpus(directory: Path = DEFAULT_DIRECTORY, specs: List[CorpusImage] = DEFAULT_CORPUS) -> Dict[str, Path]:
+    """
+    Generate the corpus, reusing files from an earlier run with the same spec
+
+    Returns:
+        Mapping of image name to file path
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest_path = directory / "manifest.json"
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        manifest = {}
+
+    paths = {}
+    for spec in specs:
+        path = directory / spec.filename
+        described = dict(asdict(spec), version=CORPUS_VERSION)
+        recorded = manifest.get(spec.name, {})
+        if not (path.exists() and recorded.get("spec") == described
+                and recorded.get("sha256") == hashlib.sha256(path.read_bytes()).hexdigest()):
+            data = generate_image(spec)
+            path.write_bytes(data)
+            manifest[spec.name] = {"spec": described, "sha256": hashlib.sha256(data).hexdigest()}
+        paths[spec.name] = path
+
+    manifest_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    return paths
+
+
+def corpus_specs(quick: bool = False) -> List[CorpusImage]:
+    return QUICK_CORPUS if quick else DEFAULT_CORPUS
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", type=Path, default=DEFAULT_DIRECTORY)
+    parser.add_argument("--quick", action="store_true", help="Generate only small images")
+    args = parser.parse_args()
+
+    for name, path in generate_corpus(args.directory, corpus_specs(args.quick)).items():
+        header = read_heif_header(path)
+        width, height = header.size
+        kind = "grid" if header.is_grid else header.primary_item.item_type
+        print(f"{name:>12} {width}x{height} {kind:>5} {path.stat().st_size:>10} bytes  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark decode-time downscaling against a single full-resolution LANCZOS resize.
+
+Usage:
+    python -m benchmarks.downscale [--sizes 256 512 1024] [--source 4032x3024] [--file photo.heic]
+"""
+
+import argparse
+import time
+from pathlib import Path
+from statistics import median
+from typing import Callable, List, Tuple
+
+from PIL import Image, ImageChops, ImageStat
+
+from transforms import compute_resize_size
+from utils import decode_for_transform, decode_heic, transform_image
+
+
+def _time(fn: Callable, repeat: int) -> Tuple[float, object]:
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return median(timings), result
+
+
+def _difference(a: Image.Image, b: Image.Image) -> float:
+    """Mean absolute pixel difference on a 0-255 scale"""
+    stat = ImageStat.Stat(ImageChops.difference(a.convert("RGB"), b.convert("RGB")))
+    return sum(stat.mean) / len(stat.mean)
+
+
+def _synthetic_source(size: Tuple[int, int]) -> Image.Image:
+    """Noise with gradients, so resampling has real detail to work on"""
+    noise = Image.effect_noise(size, 64).convert("RGB")
+    gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+    return Image.blend(noise, gradient, 0.5)
+
+
+def bench_resize(source: Image.Image, sizes: List[int], repeat: int) -> None:
+    print(f"Resize from {source.width}x{source.height}")
+    print(f"{'target':>8} {'lanczos ms':>12} {'planned ms':>18} {'speedup':>8} {'mean diff':>10}")
+
+    for size in sizes:
+        target = compute_resize_size(source.size, size, size, True)
+        baseline_time, baseline = _time(lambda: source.resize(target, Image.LANCZOS), repeat)
+        fast_time, fast = _time(lambda: transform_image(source, True, size, size, True), repeat)
+        assert fast.size == target, (fast.size, target)
+        print(
+            f"{size:>8} {baseline_time * 1000:>12.1f} {fast_time * 1000:>18.1f} "
+            f"{baseline_time / fast_time:>7.1f}x {_difference(baseline, fast):>10.2f}"
+        )
+
+
+def bench_rotate(source: Image.Image, sizes: List[int], repeat: int) -> None:
+    print(f"Rotate and resize from {source.width}x{source.height}")
+    print(f"{'target':>8} {'angle':>6} {'rotate+resize ms':>17} {'planned ms':>11} {'speedup':>8}")
+
+    for size in sizes:
+        for angle in (90, 30):
+            def naive():
+                rotated = source.rotate(angle, expand=True)
+                return rotated.resize(compute_resize_size(rotated.size, size, size, True), Image.LANCZOS)
+
+            naive_time, expected = _time(naive, repeat)
+            planned_time, planned = _time(lambda: transform_image(source, True, size, size, True, angle), repeat)
+            assert planned.size == expected.size, (planned.size, expected.size)
+            print(
+                f"{size:>8} {angle:>6} {naive_time * 1000:>17.1f} {planned_time * 1000:>11.1f} "
+                f"{naive_time / planned_time:>7.1f}x"
+            )
+
+
+def bench_file(path: Path, sizes: List[int], repeat: int) -> None:
+    print(f"Decode and resize {path}")
+    print(f"{'target':>8} {'full decode ms':>15} {'fast path ms':>13} {'speedup':>8} {'thumbnail':>10}")
+
+    for size in sizes:
+        def full():
+            return transform_image(decode_heic(path.read_bytes()), True, size, size, True)
+
+        def fast():
+            image, reference = decode_for_transform(path.read_bytes(), True, size, size, True, None)
+            return transform_image(image, True, size, size, True, None, reference), reference
+
+        full_time, _ = _time(full, repeat)
+        fast_time, (_, reference) = _time(fast, repeat)
+        print(
+            f"{size:>8} {full_time * 1000:>15.1f} {fast_time * 1000:>13.1f} "
+            f"{full_time / fast_time:>7.1f}x {'yes' if reference else 'no':>10}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512, 1024])
+    parser.add_argument("--source", default="4032x3024", help="Synthetic source size, WIDTHxHEIGHT")
+    parser.add_argument("--file", type=Path, help="Also benchmark decoding a real HEIC file")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.source.lower().split("x"))
+    source = _synthetic_source((width, height))
+    bench_resize(source, args.sizes, args.repeat)
+    print()
+    bench_rotate(source, args.sizes, args.repeat)
+
+    if args.file:
+        print()
+        bench_file(args.file, args.sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
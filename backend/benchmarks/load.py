@@ -0,0 +1,360 @@
+"""
+Load-test the conversion API and report latency percentiles and saturation.
+
+Drives the FastAPI app from main.py in-process through httpx's ASGI
+transport, or a running server with --url. Every successful conversion is
+followed by a download of the result. Each (workers, concurrency) level
+runs for --duration seconds and reports p50/p95/p99 latency, throughput and
+error counts per endpoint, plus the RSS of the server and its conversion
+workers over time.
+
+Without --rate, each of the --concurrency clients sends its next request
+as soon as the previous one finishes (closed loop). With --rate, requests
+arrive on a Poisson schedule and latency is measured from the scheduled
+arrival, so queueing delay is included.
+
+Usage:
+    python -m benchmarks.load --concurrency 1 4 16 --workers 1 2 4 --duration 20
+    python -m benchmarks.load --url http://localhost:8000 --pid 1234 --rate 10
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.corpus import DEFAULT_DIRECTORY, DEFAULT_CORPUS, generate_corpus
+
+DEFAULT_MIX = {"small-8bit": 4, "hd-8bit": 2, "12mp-8bit": 1}
+
+
+@dataclass
+class EndpointStats:
+    """Latencies and outcomes of one endpoint"""
+    latencies: List[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+
+    def record(self, latency: float, status: int) -> None:
+        self.statuses[status] += 1
+        if 200 <= status < 300:
+            self.latencies.append(latency)
+
+    def summary(self, elapsed: float) -> Dict[str, object]:
+        ordered = sorted(self.latencies)
+        count = sum(self.statuses.values())
+        errors = {str(status): n for status, n in self.statuses.items() if not 200 <= status < 300}
+        return {
+            "requests": count,
+            "ok": len(ordered),
+            "errors": errors,
+            "error_rate": round(sum(errors.values()) / count, 4) if count else 0.0,
+            "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": _percentile(ordered, 50),
+            "p95_ms": _percentile(ordered, 95),
+            "p99_ms": _percentile(ordered, 99),
+            "max_ms": round(ordered[-1] * 1000, 1) if ordered else None,
+        }
+
+
+def _percentile(ordered: List[float], percent: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted latencies, in milliseconds"""
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered))) - 1))
+    return round(ordered[rank] * 1000, 1)
+
+
+def _process_tree_rss(pid: int) -> int:
+    """RSS in bytes of a process and all of its descendants"""
+    parents: Dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after ')'
+                fields = f.read().rsplit(")", 1)[1].split()
+            parents[int(entry)] = int(fields[1])
+        except (OSError, IndexError, ValueError):
+            continue
+
+    tree = {pid}
+    changed = True
+    while changed:
+        changed = False
+        for child, parent in parents.items():
+            if parent in tree and child not in tree:
+                tree.add(child)
+                changed = True
+
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    for member in tree:
+        try:
+            with open(f"/proc/{member}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+async def _sample_rss(pid: Optional[int], samples: List[Tuple[float, float]], interval: float) -> None:
+    if pid is None or not os.path.isdir("/proc"):
+        return
+    start = time.perf_counter()
+    while True:
+        rss = await asyncio.to_thread(_process_tree_rss, pid)
+        samples.append((round(time.perf_counter() - start, 2), round(rss / 2**20, 1)))
+        await asyncio.sleep(interval)
+
+
+class LoadRun:
+    """One load level against one client"""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        files: List[Tuple[str, bytes]],
+        weights: List[int],
+        options: Dict[str, str],
+        api_prefix: str,
+        seed: int,
+    ):
+        self.client = client
+        self.files = files
+        self.weights = weights
+        self.options = options
+        self.api_prefix = api_prefix
+        self.random = random.Random(seed)
+        self.stats: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+
+    async def one_request(self, started: Optional[float] = None) -> None:
+        """Convert one file from the mix, then download the result"""
+        name, content = self.random.choices(self.files, weights=self.weights)[0]
+        started = started if started is not None else time.perf_counter()
+        try:
+            response = await self.client.post(
+                f"{self.api_prefix}/convert",
+                files={"file": (name, content, "image/heic")},
+                data=self.options,
+            )
+            status = response.status_code
+        except httpx.HTTPError:
+            response, status = None, 599
+        self.stats["convert"].record(time.perf_counter() - started, status)
+        if status != 200:
+            return
+
+        started = time.perf_counter()
+        try:
+            download = await self.client.get(response.json()["download_url"])
+            status = download.status_code
+        except httpx.HTTPError:
+            status = 599
+        self.stats["download"].record(time.perf_counter() - started, status)
+
+    async def closed_loop(self, concurrency: int, duration: float) -> None:
+        deadline = time.perf_counter() + duration
+
+        async def client_loop():
+            while time.perf_counter() < deadline:
+                await self.one_request()
+
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+
+    async def open_loop(self, concurrency: int, duration: float, rate: float) -> None:
+        slots = asyncio.Semaphore(concurrency)
+        tasks = []
+
+        async def arrival(scheduled: float):
+            async with slots:
+                await self.one_request(started=scheduled)
+
+        start = time.perf_counter()
+        next_arrival = start
+        while next_arrival < start + duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(arrival(next_arrival)))
+            next_arrival += self.random.expovariate(rate)
+        await asyncio.gather(*tasks)
+
+
+async def warm_up(client: httpx.AsyncClient, files, weights, args: argparse.Namespace, requests: int) -> None:
+    """Send unmeasured requests so worker start-up and imports are not timed"""
+    run = LoadRun(client, files, weights, {"quality": str(args.quality)}, args.api_prefix, args.seed)
+    await asyncio.gather(*(run.one_request() for _ in range(requests)))
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    files: List[Tuple[str, bytes]],
+    weights: List[int],
+    args: argparse.Namespace,
+    concurrency: int,
+    pid: Optional[int],
+) -> Dict[str, object]:
+    options = {"quality": str(args.quality)}
+    if args.resize:
+        options.update(resize="true", width=str(args.resize), height=str(args.resize))
+
+    run = LoadRun(client, files, weights, options, args.api_prefix, args.seed)
+    rss: List[Tuple[float, float]] = []
+    sampler = asyncio.create_task(_sample_rss(pid, rss, args.rss_interval))
+
+    start = time.perf_counter()
+    try:
+        if args.rate:
+            await run.open_loop(concurrency, args.duration, args.rate)
+        else:
+            await run.closed_loop(concurrency, args.duration)
+    finally:
+        sampler.cancel()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "rate": args.rate,
+        "elapsed_s": round(elapsed, 2),
+        "endpoints": {name: stats.summary(elapsed) for name, stats in run.stats.items()},
+        "peak_rss_mb": max((mb for _, mb in rss), default=None),
+        "rss_mb": rss,
+    }
+
+
+async def _in_process_levels(files, weights, args) -> List[Dict[str, object]]:
+    import main
+    from config import settings
+    from executor import ConversionExecutor
+    from scheduler import FairScheduler
+
+    # Identical uploads would otherwise be served from the cache
+    settings.CACHE_ENABLED = args.cache
+
+    levels = []
+    for workers in args.workers:
+        main.conversion_executor = ConversionExecutor(
+            max_workers=workers,
+            max_queue_size=settings.CONVERSION_QUEUE_SIZE,
+            job_timeout=settings.CONVERSION_TIMEOUT_SECONDS,
+            initializer=main.conversion_executor.initializer,
+        )
+        # The scheduler caps running conversions too, so it must match the level's workers
+        main.scheduler = FairScheduler(
+            capacity=workers,
+            max_waiting=main.scheduler.max_waiting,
+            rate=main.scheduler.rate,
+            burst=main.scheduler.burst,
+            weights=main.scheduler.weights,
+            aging_seconds=main.scheduler.aging_seconds,
+        )
+        await main.app.router.startup()
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+                await warm_up(client, files, weights, args, workers)
+                for concurrency in args.concurrency:
+                    level = await run_level(client, files, weights, args, concurrency, os.getpid())
+                    level["workers"] = workers
+                    _print_level(level)
+                    levels.append(level)
+        finally:
+            await main.app.router.shutdown()
+    return levels
+
+
+async def _remote_levels(files, weights, args) -> List[Dict[str, object]]:
+    levels = []
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.url, timeout=None, limits=limits) as client:
+        await warm_up(client, files, weights, args, max(args.concurrency))
+        for concurrency in args.concurrency:
+            level = await run_level(client, files, weights, args, concurrency, args.pid)
+            level["workers"] = None
+            _print_level(level)
+            levels.append(level)
+    return levels
+
+
+def _print_header() -> None:
+    print(
+        f"{'workers':>7} {'conc':>5} {'endpoint':>9} {'ok':>6} {'err%':>6} {'rps':>7} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rss MB':>8}"
+    )
+
+
+def _print_level(level: Dict[str, object]) -> None:
+    for name, stats in sorted(level["endpoints"].items()):
+        print(
+            f"{level.get('workers') or '-':>7} {level['concurrency']:>5} {name:>9} {stats['ok']:>6} "
+            f"{stats['error_rate'] * 100:>5.1f}% {stats['throughput_rps']:>7.2f} "
+            f"{stats['p50_ms'] or 0:>8.1f} {stats['p95_ms'] or 0:>8.1f} {stats['p99_ms'] or 0:>8.1f} "
+            f"{level['peak_rss_mb'] or 0:>8.1f}"
+        )
+
+
+def _parse_mix(values: List[str]) -> Dict[str, int]:
+    mix = {}
+    for value in values:
+        name, _, weight = value.partition(":")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Load-test a running server instead of the in-process app")
+    parser.add_argument("--pid", type=int, help="Server process to sample RSS from when using --url")
+    parser.add_argument("--api-prefix", default="/api/v1")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--workers", type=int, nargs="+", default=[os.cpu_count() or 1],
+                        help="Conversion worker counts to sweep (in-process only)")
+    parser.add_argument("--rate", type=float, help="Open-loop arrival rate in requests per second")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per level")
+    parser.add_argument("--mix", nargs="+", default=[f"{name}:{weight}" for name, weight in DEFAULT_MIX.items()],
+                        help="Corpus images and weights, e.g. small-8bit:4 12mp-8bit:1")
+    parser.add_argument("--quality", type=int, default=95)
+    parser.add_argument("--resize", type=int, help="Fit outputs within this many pixels")
+    parser.add_argument("--cache", action="store_true", help="Keep the conversion cache enabled (in-process)")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_DIRECTORY)
+    parser.add_argument("--rss-interval", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=Path("load-results.json"))
+    args = parser.parse_args()
+
+    # Importing main turns on INFO logging, and httpx would log every request
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    mix = _parse_mix(args.mix)
+    specs = [spec for spec in DEFAULT_CORPUS if spec.name in mix]
+    unknown = set(mix) - {spec.name for spec in specs}
+    if unknown:
+        parser.error(f"Unknown corpus images: {', '.join(sorted(unknown))}")
+
+    paths = generate_corpus(args.corpus, specs)
+    files = [(paths[name].name, paths[name].read_bytes()) for name in mix]
+    weights = list(mix.values())
+
+    _print_header()
+    if args.url:
+        levels = asyncio.run(_remote_levels(files, weights, args))
+    else:
+        levels = asyncio.run(_in_process_levels(files, weights, args))
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    args.output.write_text(json.dumps({"config": config, "levels": levels}, indent=2, default=str))
+    print(f"\nWrote {len(levels)} levels to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Benchmark the conversion pipeline on the synthetic HEIC corpus.
+
+Every case (image x pipeline x quality x resize x rotate) runs in a fresh
+process, so its peak RSS is not inflated by earlier cases. Decode,
+transform and encode times are the median of --repeat runs.
+
+Pipelines:
+    main     utils.convert_heic_to_jpg stages
+    minimal  minimal_server.convert_image stages
+
+Both decode through the decoders registry, with its default backend order.
+
+Usage:
+    python -m benchmarks.pipeline [--quick] [--output results.json]
+    python -m benchmarks.pipeline --baseline baseline.json [--time-threshold 0.15]
+"""
+
+import argparse
+import io
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from statistics import median
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.corpus import DEFAULT_DIRECTORY, corpus_specs, generate_corpus
+
+PIPELINES = ("main", "minimal")
+QUALITIES = (75, 95)
+RESIZES = (None, 1024)
+ROTATIONS = (None, 90, 30)
+
+
+@dataclass(frozen=True)
+class Case:
+    """One benchmarked combination of input and options"""
+    image: str
+    path: str
+    pipeline: str
+    quality: int
+    resize: Optional[int]
+    rotate: Optional[int]
+
+    @property
+    def id(self) -> str:
+        resize = f"resize{self.resize}" if self.resize else "full"
+        rotate = f"rot{self.rotate}" if self.rotate is not None else "rot0"
+        return f"{self.image}/{self.pipeline}/q{self.quality}/{resize}/{rotate}"
+
+
+def build_cases(paths: Dict[str, Path], pipelines=PIPELINES, quick: bool = False) -> List[Case]:
+    qualities = QUALITIES[-1:] if quick else QUALITIES
+    # The quick corpus is small, so downscale further to stay a downscale
+    resizes = (None, 256) if quick else RESIZES
+    rotations = (None, 30) if quick else ROTATIONS
+    return [
+        Case(name, str(path), pipeline, quality, resize, rotate)
+        for name, path in paths.items()
+        for pipeline, quality, resize, rotate in itertools.product(pipelines, qualities, resizes, rotations)
+    ]
+
+
+def _current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return _peak_rss()
+
+
+def _peak_rss() -> int:
+    """Peak resident set size of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _main_stages(case: Case, content: bytes):
+    from utils import decode_for_transform, encode_with_options, transform_image
+
+    resize = case.resize is not None
+    stages = {}
+
+    start = time.perf_counter()
+    image, reference_size = decode_for_transform(
+        content, resize, case.resize, case.resize, True, case.rotate
+    )
+    stages["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image = transform_image(image, resize, case.resize, case.resize, True, case.rotate, reference_size)
+    stages["transform"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    jpeg, _, _ = encode_with_options(image, "jpeg", case.quality)
+    stages["encode"] = time.perf_counter() - start
+    return stages, len(jpeg), image.size
+
+
+def _minimal_stages(case: Case, content: bytes):
+    import decoders
+    from minimal_server import plan_conversion
+    from transforms import apply_plan
+
+    resize = case.resize is not None
+    stages = {}
+
+    start = time.perf_counter()
+    image = decoders.decode(content)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    stages["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image = apply_plan(image, plan_conversion(image.size, resize, case.resize, None, True, case.rotate))
+    stages["transform"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=case.quality, optimize=True)
+    stages["encode"] = time.perf_counter() - start
+    return stages, buffer.tell(), image.size
+
+
+def run_case(case: Case, repeat: int) -> Dict[str, Any]:
+    """Run one case; called in a fresh worker process"""
+    stages_fn = _main_stages if case.pipeline == "main" else _minimal_stages
+    content = Path(case.path).read_bytes()
+
+    # Import everything and warm up caches before taking the RSS baseline
+    stages_fn(case, content)
+    baseline_rss = _current_rss()
+
+    runs = [stages_fn(case, content) for _ in range(repeat)]
+    timings = {stage: median(run[0][stage] for run in runs) * 1000 for stage in ("decode", "transform", "encode")}
+    _, output_bytes, output_size = runs[-1]
+
+    peak_rss = _peak_rss()
+    return {
+        "case": case.id,
+        **asdict(case),
+        "decode_ms": round(timings["decode"], 3),
+        "transform_ms": round(timings["transform"], 3),
+        "encode_ms": round(timings["encode"], 3),
+        "total_ms": round(sum(timings.values()), 3),
+        "peak_rss_mb": round(peak_rss / 2**20, 2),
+        "peak_rss_delta_mb": round(max(0, peak_rss - baseline_rss) / 2**20, 2),
+        "output_bytes": output_bytes,
+        "output_size": list(output_size),
+    }
+
+
+def run_cases(cases: List[Case], repeat: int) -> List[Dict[str, Any]]:
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        for case in cases:
+            try:
+                result = pool.apply(run_case, (case, repeat))
+            except Exception as e:
+                result = {"case": case.id, **asdict(case), "error": f"{type(e).__name__}: {str(e)}"}
+                print(f"{case.id:<48} error: {result['error']}")
+            else:
+                print(
+                    f"{case.id:<48} {result['decode_ms']:>9.1f} {result['transform_ms']:>9.1f} "
+                    f"{result['encode_ms']:>9.1f} {result['total_ms']:>9.1f} {result['peak_rss_delta_mb']:>8.1f}"
+                )
+            results.append(result)
+    return results
+
+
+def compare(
+    results: List[Dict[str, Any]],
+    baseline: List[Dict[str, Any]],
+    time_threshold: float,
+    memory_threshold: float,
+    min_delta_ms: float,
+) -> List[Tuple[str, str, float, float]]:
+    """
+    Find cases that regressed against the baseline
+
+    A case regresses when its total time grows by more than time_threshold
+    (and by at least min_delta_ms, to ignore noise on tiny cases), or its
+    peak RSS growth by more than memory_threshold.
+
+    Returns:
+        (case, metric, baseline value, new value) per regression
+    """
+    previous = {result["case"]: result for result in baseline if "error" not in result}
+    regressions = []
+    for result in results:
+        before = previous.get(result["case"])
+        if before is None:
+            continue
+        if "error" in result:
+            regressions.append((result["case"], "error", 0.0, 0.0))
+            continue
+
+        old, new = before["total_ms"], result["total_ms"]
+        if new > old * (1 + time_threshold) and new - old >= min_delta_ms:
+            regressions.append((result["case"], "total_ms", old, new))
+
+        old, new = before["peak_rss_delta_mb"], result["peak_rss_delta_mb"]
+        if new > old * (1 + memory_threshold) and new - old >= 1.0:
+            regressions.append((result["case"], "peak_rss_delta_mb", old, new))
+    return regressions
+
+
+def _environment() -> Dict[str, Any]:
+    from PIL import __version__ as pillow_version
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pillow": pillow_version,
+        "cpu_count": multiprocessing.cpu_count(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_DIRECTORY, help="Corpus directory")
+    parser.add_argument("--quick", action="store_true", help="Small images and fewer option combinations")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--filter", help="Only run cases whose id contains this string")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, default=Path("benchmark-results.json"))
+    parser.add_argument("--baseline", type=Path, help="Compare against an earlier results file")
+    parser.add_argument("--time-threshold", type=float, default=0.15, help="Allowed relative slowdown")
+    parser.add_argument("--memory-threshold", type=float, default=0.15, help="Allowed relative RSS growth")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    paths = generate_corpus(args.corpus, corpus_specs(args.quick))
+    cases = build_cases(paths, args.pipelines, args.quick)
+    if args.filter:
+        cases = [case for case in cases if args.filter in case.id]
+
+    print(f"{'case':<48} {'decode':>9} {'transform':>9} {'encode':>9} {'total ms':>9} {'rss MB':>8}")
+    results = run_cases(cases, args.repeat)
+
+    args.output.write_text(json.dumps({"environment": _environment(), "results": results}, indent=2))
+    print(f"\nWrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        regressions = compare(
+            results, baseline, args.time_threshold, args.memory_threshold, args.min_delta_ms
+        )
+        for case_id, metric, old, new in regressions:
+            print(f"REGRESSION {case_id} {metric}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""
+Convert a directory tree of HEIC/HEIF files to JPG without the HTTP API.
+
+Outputs mirror the source tree under the destination directory, with a
+.jpg suffix; files that share a stem in one directory, such as IMG_1.heic
+and IMG_1.HEIF, keep their extension too (IMG_1.heic.jpg). Files are
+converted in parallel by a process pool, with the same conversion core as
+the API (utils.convert_heic_to_jpg).
+
+Every finished file is appended to a manifest in the destination, keyed by
+its source path, size, modification time and a hash of the conversion
+options. Reruns skip files whose manifest entry still matches and whose
+output exists, so an interrupted run resumes where it stopped and a rerun
+with new options converts everything again.
+
+Usage:
+    python bulk.py SOURCE DESTINATION [--quality 90] [--width 2048 --resize] [--workers 8]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import decoders
+from config import settings
+from storage import write_atomic
+from utils import convert_heic_to_jpg
+
+logger = logging.getLogger("bulk")
+
+MANIFEST_NAME = ".heic-manifest.jsonl"
+
+# Conversions submitted per worker ahead of time, so workers never wait for the parent
+PENDING_PER_WORKER = 4
+
+
+@dataclass
+class SourceFile:
+    """A file to convert, relative to the source directory"""
+    path: str
+    size: int
+    mtime_ns: int
+
+
+def options_hash(options: Dict[str, Any]) -> str:
+    normalized = json.dumps(options, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode()).hexdigest()[:16]
+
+
+def output_path_for(relative_path: str, keep_extension: bool = False) -> str:
+    """
+    Output path of a source file, relative to the destination
+
+    Args:
+        keep_extension: Append .jpg to the full name (IMG_1.heif.jpg), for
+            files with a namesake that would otherwise map to the same output
+    """
+    path = Path(relative_path)
+    if keep_extension:
+        return str(path.with_name(path.name + ".jpg"))
+    return str(path.with_suffix(".jpg"))
+
+
+def namesakes(paths: Iterable[str]) -> Set[str]:
+    """
+    Source paths that share their directory and stem with another source
+
+    IMG_1.heic and IMG_1.HEIF would both become IMG_1.jpg. Stems are
+    compared ignoring case, as they are on case-insensitive file systems.
+    """
+    groups: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+    for relative_path in paths:
+        path = Path(relative_path)
+        groups[(str(path.parent), path.stem.casefold())].append(relative_path)
+    return {relative_path for group in groups.values() if len(group) > 1 for relative_path in group}
+
+
+def has_namesake(source: Path, relative_path: str) -> bool:
+    """Whether a source file's directory holds another source with the same stem"""
+    path = source / relative_path
+    try:
+        names = os.listdir(path.parent)
+    except OSError:
+        return False
+    stem = path.stem.casefold()
+    return any(
+        name != path.name and is_source_name(name) and Path(name).stem.casefold() == stem for name in names
+    )
+
+
+def is_source_name(name: str) -> bool:
+    """Whether a file name is a HEIC/HEIF file to convert"""
+    extensions = {extension.lower() for extension in settings.ALLOWED_EXTENSIONS}
+    return not name.startswith(".") and Path(name).suffix.lower() in extensions
+
+
+def walk_sources(source: Path, directory: Optional[Path] = None) -> Iterator[SourceFile]:
+    """
+    HEIC/HEIF files under source, skipping hidden files and directories
+
+    Args:
+        source: Directory that paths are relative to
+        directory: Subdirectory of source to walk instead of all of it
+    """
+    stack = [directory or source]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            logger.warning(f"Cannot read {directory}: {str(e)}")
+            continue
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(Path(entry.path))
+            elif is_source_name(entry.name) and entry.is_file():
+                stat = entry.stat()
+                yield SourceFile(
+                    Path(entry.path).relative_to(source).as_posix(), stat.st_size, stat.st_mtime_ns
+                )
+
+
+class Manifest:
+    """
+    Append-only record of converted files
+
+    One JSON object per line; a later line for the same path replaces an
+    earlier one. A line cut short by a crash is ignored.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lines = 0
+        self._file = None
+
+    def load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    self._lines += 1
+                    try:
+                        entry = json.loads(line)
+                        self.entries[entry["path"]] = entry
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+        # Drop superseded lines once they make up most of the file
+        if self._lines > 2 * len(self.entries) + 1000:
+            data = "".join(json.dumps(entry) + "\n" for entry in self.entries.values())
+            write_atomic(self.path, data.encode())
+            self._lines = len(self.entries)
+
+    def is_current(self, source: SourceFile, digest: str, destination: Path) -> bool:
+        entry = self.entries.get(source.path)
+        return (
+            entry is not None
+            and entry.get("size") == source.size
+            and entry.get("mtime_ns") == source.mtime_ns
+            and entry.get("options") == digest
+            and (destination / entry.get("output", "")).is_file()
+        )
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps(entry) + "\n")
+        # Flushed per file, so a crash loses at most the conversions still running
+        self._file.flush()
+        self.entries[entry["path"]] = entry
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def convert_one(source: str, output: str, options: Dict[str, Any]) -> Tuple[int, int, float, int, int]:
+    """Convert one file in a worker process"""
+    output_path = Path(output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    return convert_heic_to_jpg(Path(source), output_path, **options)
+
+
+class Progress:
+    """Throughput and ETA, printed at most once per interval"""
+
+    def __init__(self, total_files: int, total_bytes: int, interval: float = 2.0):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self._printed = 0.0
+
+    def update(self, size: int, failed: bool = False) -> None:
+        self.files += 1
+        self.bytes += size
+        self.failed += failed
+        now = time.perf_counter()
+        if now - self._printed >= self.interval or self.files == self.total_files:
+            self._printed = now
+            self.print(now)
+
+    def print(self, now: float) -> None:
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.files / elapsed
+        byte_rate = self.bytes / elapsed
+        # Estimate by bytes: large files take longer
+        remaining = (self.total_bytes - self.bytes) / byte_rate if byte_rate > 0 else 0
+        print(
+            f"{self.files}/{self.total_files} files, {self.failed} failed, "
+            f"{rate:.1f} files/s, {byte_rate / 2**20:.1f} MB/s, "
+            f"ETA {_format_duration(remaining)}",
+            file=sys.stderr,
+            flush=True,
+        )
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def run(
+    source: Path,
+    destination: Path,
+    options: Dict[str, Any],
+    workers: int,
+    manifest_path: Optional[Path] = None,
+    force: bool = False,
+) -> int:
+    """
+    Convert every HEIC/HEIF file under source that is not up to date
+
+    Returns:
+        Number of files that failed to convert
+    """
+    manifest = Manifest(manifest_path or destination / MANIFEST_NAME)
+    manifest.load()
+    digest = options_hash(options)
+
+    sources = list(walk_sources(source))
+    # Namesakes keep their extension in the output name so neither overwrites the other
+    keep_extension = namesakes(source_file.path for source_file in sources)
+
+    def output_for(source_file: SourceFile) -> str:
+        return output_path_for(source_file.path, source_file.path in keep_extension)
+
+    pending: List[SourceFile] = []
+    skipped = 0
+    for source_file in sources:
+        if not force and manifest.is_current(source_file, digest, destination):
+            skipped += 1
+        else:
+            pending.append(source_file)
+
+    print(
+        f"{len(pending)} files to convert, {skipped} up to date, using {workers} workers",
+        file=sys.stderr,
+        flush=True,
+    )
+    if not pending:
+        return 0
+
+    progress = Progress(len(pending), sum(source_file.size for source_file in pending))
+    decoders.registry.configure(settings.DECODER_BACKENDS, settings.DECODER_PREFERENCES)
+
+    def finish(future: Future, source_file: SourceFile) -> None:
+        try:
+            _, converted_size, conversion_time, quality, _ = future.result()
+        except Exception as e:
+            logger.error(f"Failed to convert {source_file.path}: {str(e)}")
+            progress.update(source_file.size, failed=True)
+            return
+        manifest.record({
+            "path": source_file.path,
+            "size": source_file.size,
+            "mtime_ns": source_file.mtime_ns,
+            "options": digest,
+            "output": output_for(source_file),
+            "converted_size": converted_size,
+            "quality": quality,
+            "conversion_time": round(conversion_time, 4),
+        })
+        progress.update(source_file.size)
+
+    queue = iter(pending)
+    running: Dict[Future, SourceFile] = {}
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=decoders.configure,
+            initargs=(decoders.registry.order, decoders.registry.preferences),
+        ) as pool:
+            try:
+                while True:
+                    while len(running) < workers * PENDING_PER_WORKER:
+                        source_file = next(queue, None)
+                        if source_file is None:
+                            break
+                        future = pool.submit(
+                            convert_one,
+                            str(source / source_file.path),
+                            str(destination / output_for(source_file)),
+                            options,
+                        )
+                        running[future] = source_file
+                    if not running:
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(future, running.pop(future))
+            except KeyboardInterrupt:
+                # Stop without starting the conversions still queued
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+    finally:
+        manifest.close()
+
+    return progress.failed
+
+
+def add_conversion_arguments(parser: argparse.ArgumentParser) -> None:
+    """Command-line options for convert_heic_to_jpg"""
+    parser.add_argument("--quality", type=int, default=settings.JPG_QUALITY)
+    parser.add_argument("--max-bytes", type=int, default=None, help="Largest JPEG size; quality is lowered to fit")
+    parser.add_argument("--resize", action="store_true")
+    parser.add_argument("--width", type=int, default=None)
+    parser.add_argument("--height", type=int, default=None)
+    parser.add_argument("--no-aspect-ratio", dest="maintain_aspect_ratio", action="store_false")
+    parser.add_argument("--rotate", type=int, default=None)
+
+
+def conversion_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """convert_heic_to_jpg arguments from the parsed command line"""
+    return {
+        "quality": args.quality,
+        "resize": args.resize,
+        "width": args.width,
+        "height": args.height,
+        "maintain_aspect_ratio": args.maintain_aspect_ratio,
+        "rotate": args.rotate,
+        "max_bytes": args.max_bytes,
+    }
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Convert a directory tree of HEIC/HEIF files to JPG")
+    parser.add_argument("source", type=Path)
+    parser.add_argument("destination", type=Path)
+    add_conversion_arguments(parser)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--manifest", type=Path, default=None, help=f"Defaults to DESTINATION/{MANIFEST_NAME}")
+    parser.add_argument("--force", action="store_true", help="Convert files the manifest lists as up to date")
+    args = parser.parse_args()
+
+    if not args.source.is_dir():
+        parser.error(f"{args.source} is not a directory")
+
+    failed = run(
+        args.source, args.destination, conversion_options(args), max(1, args.workers), args.manifest, args.force
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Content-addressed cache of finished conversions.
+
+Conversions are keyed by a hash of the uploaded bytes plus the normalized
+conversion options. Identical requests that arrive while the first one is
+still converting wait for that conversion instead of starting their own.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedOutput:
+    """One output file of a conversion"""
+    format: str
+    filename: str
+    size: int
+    quality: Optional[int] = None
+    encode_passes: int = 1
+
+
+@dataclass
+class CacheEntry:
+    """A finished conversion in storage, with one file per output format"""
+    outputs: List[CachedOutput]
+    original_size: int
+    conversion_time: float
+    created_at: float = 0.0
+    queue_wait: float = 0.0
+
+    @property
+    def output_filename(self) -> str:
+        return self.outputs[0].filename
+
+    @property
+    def converted_size(self) -> int:
+        return self.outputs[0].size
+
+    @property
+    def quality(self) -> Optional[int]:
+        return self.outputs[0].quality
+
+    @property
+    def encode_passes(self) -> int:
+        return self.outputs[0].encode_passes
+
+    @property
+    def total_size(self) -> int:
+        return sum(output.size for output in self.outputs)
+
+
+class ConversionCache:
+    """
+    LRU cache of converted files with a byte budget and a TTL
+
+    Args:
+        storage: Storage the converted files live in
+        max_bytes: Total size of cached outputs before LRU eviction
+        ttl_seconds: Maximum age of a cached output
+        on_delete: Called with the file name of every output the cache deletes
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        max_bytes: int,
+        ttl_seconds: float,
+        on_delete: Optional[Callable[[str], None]] = None,
+    ):
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.on_delete = on_delete
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(content_digest: str, options: Dict[str, Any]) -> str:
+        """Build a cache key from the input hash and the conversion options"""
+        normalized = json.dumps(options, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(f"{content_digest}:{normalized}".encode()).hexdigest()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
+
+    def _delete_outputs(self, entry: CacheEntry) -> None:
+        for output in entry.outputs:
+            try:
+                self.storage.delete(output.filename)
+            except Exception as e:
+                logger.error(f"Error deleting cached file {output.filename}: {str(e)}")
+            if self.on_delete is not None:
+                self.on_delete(output.filename)
+
+    def _outputs_exist(self, entry: CacheEntry) -> bool:
+        return all(self.storage.exists(output.filename) for output in entry.outputs)
+
+    def _remove(self, key: str, delete_file: bool) -> None:
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry.total_size
+        if delete_file:
+            # Storage calls may go over the network, so keep them off the event loop
+            asyncio.get_running_loop().run_in_executor(None, self._delete_outputs, entry)
+
+    async def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expired = time.time() - entry.created_at > self.ttl_seconds
+        missing = not expired and not await asyncio.to_thread(self._outputs_exist, entry)
+        if self._entries.get(key) is not entry:
+            # Evicted while its files were being checked
+            return None
+        if expired or missing:
+            # Expired, or partly removed by the temp file cleanup; the
+            # remaining outputs are of no use on their own
+            self._remove(key, delete_file=True)
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, entry: CacheEntry) -> None:
+        entry.created_at = time.time()
+        self._entries[key] = entry
+        self._total_bytes += entry.total_size
+
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            self._remove(oldest, delete_file=True)
+            self.evictions += 1
+
+    async def get_or_create(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[CacheEntry]],
+    ) -> Tuple[CacheEntry, bool]:
+        """
+        Return the cached conversion for key, creating it if needed
+
+        The factory runs in its own task so that a client disconnecting
+        does not cancel a conversion other requests are waiting on.
+
+        Returns:
+            Tuple of (entry, cached) where cached is False only for the
+            request that actually ran the conversion
+        """
+        entry = await self._lookup(key)
+        if entry is not None:
+            self.hits += 1
+            return entry, True
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        self.misses += 1
+        task = asyncio.ensure_future(factory())
+        self._inflight[key] = task
+
+        def _finished(done: asyncio.Task) -> None:
+            self._inflight.pop(key, None)
+            if not done.cancelled() and done.exception() is None:
+                self._store(key, done.result())
+
+        task.add_done_callback(_finished)
+        return await asyncio.shield(task), False
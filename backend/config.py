@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from pathlib import Path
+from typing import Optional
 import os
 
 # Base directory
@@ -18,13 +19,97 @@ class Settings(BaseSettings):
     TEMP_DIR: Path = BASE_DIR / "temp"
     MAX_FILE_SIZE: int = 50 * 1024 * 1024  # 50 MB
     ALLOWED_EXTENSIONS: list = [".heic", ".heif"]
+    MAX_BATCH_FILES: int = 500
+    MAX_BATCH_SIZE: int = 1024 * 1024 * 1024  # 1 GB per batch request
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # 1 MB
+    UPLOAD_OVERHEAD_BYTES: int = 64 * 1024  # Allowance for multipart headers and form fields
     
     # Image settings
     JPG_QUALITY: int = 95  # 0-100
+    ALPHA_BACKGROUND: str = "#ffffff"  # Fills transparent areas in formats without alpha, such as JPEG
+    WEBP_QUALITY: int = 80  # 0-100
+    WEBP_METHOD: int = 4  # Encoder effort, 0 (fastest) to 6 (smallest output)
+    AVIF_QUALITY: int = 60  # 0-100
+    AVIF_SPEED: int = 6  # 0 (smallest output) to 10 (fastest)
+    PNG_COMPRESS_LEVEL: int = 6  # zlib level, 0-9
+    RESIZE_REDUCING_GAP: float = 3.0  # Integer-reduce large downscales before LANCZOS
+    JPEG_MIN_QUALITY: int = 10  # Lowest quality tried when fitting max_bytes
+    JPEG_SIZE_SEARCH_PASSES: int = 6  # Most encodes when fitting max_bytes
+    USE_EMBEDDED_THUMBNAILS: bool = True  # Decode a HEIF thumbnail when it covers the output size
+    GRID_STREAMING_MIN_PIXELS: int = 16_000_000  # Convert grid images this large to JPEG a tile row at a time when nothing needs the whole image, 0 disables
+    
+    # Decoder settings
+    DECODER_BACKENDS: list = ["pyheif", "pillow_heif"]  # Fallback order; leave a backend out to disable it
+    DECODER_BENCHMARK: bool = False  # Time the backends at startup and prefer the fastest per input kind
+    DECODER_BENCHMARK_DIR: Path = BASE_DIR / "benchmarks" / "corpus"  # Sample files, see benchmarks.corpus
+    DECODER_PREFERENCES: dict = {}  # Backend to try first per input kind, e.g. {"grid": "pillow_heif"}
+    
+    # Server settings, used by serve.py; the limits below are for the whole server and are split among its workers
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0  # 0 starts one worker per CPU
+    SHUTDOWN_DRAIN_SECONDS: int = 30  # Time given to open requests and running jobs on SIGTERM
+    
+    # Conversion executor settings
+    CONVERSION_WORKERS: int = os.cpu_count() or 1
+    CONVERSION_QUEUE_SIZE: int = 64  # Jobs allowed to wait for a free worker
+    CONVERSION_TIMEOUT_SECONDS: float = 120.0
+    CONVERSION_RETRY_AFTER_SECONDS: int = 5
+    
+    # Scheduler settings; clients are identified by SCHEDULER_CLIENT_HEADER, or by IP address without it
+    SCHEDULER_CLIENT_HEADER: str = "X-API-Key"
+    SCHEDULER_CLIENT_WEIGHTS: dict = {}  # Share of the workers per client key relative to 1, e.g. {"partner-key": 4}
+    # Rate limits are kept by each server worker: a client on one connection stays on one
+    # worker and gets the full rate, one spread over N workers can get up to N times it
+    SCHEDULER_RATE_PER_SECOND: float = 0.0  # Conversions each client may start per second per worker, 0 disables
+    SCHEDULER_BURST: int = 20  # Conversions a client may start at once after being idle, per worker
+    SCHEDULER_AGING_SECONDS: float = 10.0  # Wait after which a queued conversion's cost counts half
+    
+    # Memory admission settings
+    MEMORY_BUDGET_BYTES: int = 2 * 1024 * 1024 * 1024  # 2 GB across running conversions, 0 disables
+    MEMORY_ADMISSION_TIMEOUT_SECONDS: float = 30.0  # Longest wait for memory before answering 503
+    
+    # Conversion cache settings
+    CACHE_ENABLED: bool = True
+    CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # 1 GB
+    CACHE_TTL_SECONDS: int = 20 * 60  # Keep below FILE_RETENTION_MINUTES
+    
+    # Storage settings
+    STORAGE_BACKEND: str = "local"  # "local", "object" (S3-compatible, needs boto3) or "object-local"
+    STORAGE_DIR: Path = BASE_DIR / "temp" / "files"  # Local backend root, or where "object-local" keeps objects
+    STORAGE_SHARD_DEPTH: int = 2  # Shard directory levels of local storage, 256 directories each
+    UPLOAD_DIR: Path = BASE_DIR / "temp" / "uploads"  # Uploads waiting for conversion, always local
+    OBJECT_STORE_BUCKET: str = ""
+    OBJECT_STORE_PREFIX: str = ""
+    OBJECT_STORE_ENDPOINT_URL: Optional[str] = None  # For S3-compatible stores other than AWS
+    
+    # Download settings
+    DOWNLOAD_CACHE_MAX_AGE_SECONDS: int = 365 * 24 * 60 * 60  # For content-addressed files, which never change
+    
+    # Watch folder settings, used by watch.py
+    WATCH_FOLDERS: dict = {}  # Source directory -> destination directory
+    WATCH_DEBOUNCE_SECONDS: float = 2.0  # A file must stay unchanged this long before it is converted
+    WATCH_POLL_INTERVAL_SECONDS: float = 10.0  # Scan interval where inotify is unavailable or disabled
+    WATCH_MAX_PENDING: int = 10000  # Files tracked at once; the rest are found by a later scan
+    WATCH_STATUS_PATH: Path = BASE_DIR / "temp" / "watch-status.json"
+    
+    # Job settings
+    JOB_STORE: str = "memory"  # "memory" or "sqlite"
+    JOB_DB_PATH: Path = BASE_DIR / "jobs.sqlite3"
+    JOB_HEARTBEAT_SECONDS: float = 15.0  # How often a worker marks its running jobs as alive
+    JOB_STALE_SECONDS: float = 60.0  # Unfinished jobs without a heartbeat this long are failed
+    
+    # Metrics settings
+    METRICS_ENABLED: bool = True  # Serve Prometheus metrics at /metrics
     
     # Cleanup settings
     AUTO_CLEANUP: bool = True
     FILE_RETENTION_MINUTES: int = 30
+    CLEANUP_INTERVAL_SECONDS: int = 60
+    CLEANUP_SWEEP_INTERVAL_SECONDS: int = 60 * 60  # Full storage scans for files no worker tracks, leader only
+    CLEANUP_LOCK_PATH: Path = BASE_DIR / "temp" / ".cleanup.lock"  # Elects the worker that runs the full scans
+    TEMP_DIR_MAX_BYTES: int = 10 * 1024 * 1024 * 1024  # 10 GB for converted files and uploads together, least recently used files go first
+    TEMP_DIR_UPLOAD_FRACTION: float = 0.25  # Share of TEMP_DIR_MAX_BYTES for spooled uploads; converted files get the rest
     
     class Config:
         env_file = ".env"
@@ -33,5 +118,8 @@ class Settings(BaseSettings):
 # Create settings instance
 settings = Settings()
 
-# Ensure temp directory exists
-os.makedirs(settings.TEMP_DIR, exist_ok=True)
+# Ensure temp directory exists (may fail on read-only filesystems)
+try:
+    os.makedirs(settings.TEMP_DIR, exist_ok=True)
+except OSError:
+    pass
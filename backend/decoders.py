@@ -0,0 +1,277 @@
+"""
+Pluggable HEIC/HEIF decoder backends.
+
+All servers decode through the module-level `registry`, which knows the
+installed backends, initializes each one once per process and picks a
+backend for each kind of input. The kind is read from the container
+header, so choosing a backend costs no pixel decoding:
+
+- "grid"   the primary image is a grid of tiles
+- "hdr"    more than 8 bits per channel
+- "alpha"  an alpha plane is attached
+- "plain"  everything else
+
+By default backends are tried in registration order. benchmark() times
+every installed backend on sample files and prefers the fastest one for
+each kind; a backend that fails on a file falls back to the next one.
+"""
+
+import importlib
+import io
+import logging
+import time
+from pathlib import Path
+from statistics import median
+from typing import Dict, Iterable, List, Optional, Union
+
+from PIL import Image
+
+from heif_container import HeifFormatError, HeifHeader, read_heif_header
+
+logger = logging.getLogger(__name__)
+
+INPUT_KINDS = ("plain", "grid", "hdr", "alpha")
+
+Source = Union[Path, str, bytes]
+
+
+class DecoderUnavailableError(RuntimeError):
+    """Raised when no installed backend can decode HEIC/HEIF"""
+
+
+def input_kind(header: HeifHeader) -> str:
+    """Classify an input by the features that decoders handle differently"""
+    if header.is_grid:
+        return "grid"
+    if header.bit_depth > 8:
+        return "hdr"
+    if header.has_alpha:
+        return "alpha"
+    return "plain"
+
+
+class Decoder:
+    """
+    A decoding backend
+
+    Subclasses set `name` and `module` (the package that must be
+    importable) and implement decode().
+    """
+    name = ""
+    module = ""
+
+    def __init__(self):
+        self._available: Optional[bool] = None
+        self._initialized = False
+
+    @property
+    def available(self) -> bool:
+        if self._available is None:
+            try:
+                importlib.import_module(self.module)
+                self._available = True
+            except ImportError:
+                self._available = False
+        return self._available
+
+    def initialize(self) -> None:
+        """Run the backend's one-time setup in this process"""
+        if not self._initialized:
+            self._setup()
+            self._initialized = True
+
+    def _setup(self) -> None:
+        pass
+
+    def decode(self, source: Source) -> Image.Image:
+        """Decode the primary image; the mode is whatever the backend produces"""
+        raise NotImplementedError
+
+
+class PyheifDecoder(Decoder):
+    name = "pyheif"
+    module = "pyheif"
+
+    def decode(self, source: Source) -> Image.Image:
+        import pyheif
+
+        if isinstance(source, Path):
+            source = str(source)
+
+        heif_file = pyheif.read(source)
+        return Image.frombytes(
+            heif_file.mode,
+            heif_file.size,
+            heif_file.data,
+            "raw",
+            heif_file.mode,
+            heif_file.stride,
+        )
+
+
+class PillowHeifDecoder(Decoder):
+    name = "pillow_heif"
+    module = "pillow_heif"
+
+    def _setup(self) -> None:
+        import pillow_heif
+
+        # Lets Image.open() read HEIF anywhere in this process
+        pillow_heif.register_heif_opener()
+
+    def decode(self, source: Source) -> Image.Image:
+        import pillow_heif
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        return pillow_heif.open_heif(source, convert_hdr_to_8bit=True).to_pillow()
+
+
+class DecoderRegistry:
+    """Installed decoder backends and the preferred backend per input kind"""
+
+    def __init__(self):
+        self._decoders: Dict[str, Decoder] = {}
+        self.preferences: Dict[str, str] = {}
+
+    def register(self, decoder: Decoder) -> None:
+        self._decoders[decoder.name] = decoder
+
+    @property
+    def order(self) -> List[str]:
+        return list(self._decoders)
+
+    def configure(self, order: Optional[Iterable[str]] = None, preferences: Optional[Dict[str, str]] = None) -> None:
+        """
+        Set the fallback order and per-kind preferences
+
+        Args:
+            order: Backend names to try, in order; backends left out are disabled
+            preferences: Backend to try first for each input kind
+        """
+        if order is not None:
+            order = list(order)
+            unknown = [name for name in order if name not in self._decoders]
+            if unknown:
+                raise ValueError(f"Unknown decoder backends: {', '.join(unknown)}")
+            self._decoders = {name: self._decoders[name] for name in order}
+        if preferences is not None:
+            self.preferences = {kind: name for kind, name in preferences.items() if name in self._decoders}
+
+    def available(self) -> List[Decoder]:
+        return [decoder for decoder in self._decoders.values() if decoder.available]
+
+    def initialize(self) -> List[str]:
+        """Initialize every installed backend, returning their names"""
+        decoders = self.available()
+        for decoder in decoders:
+            decoder.initialize()
+        return [decoder.name for decoder in decoders]
+
+    def candidates(self, kind: str = "plain") -> List[Decoder]:
+        """Installed backends in the order they are tried for an input kind"""
+        decoders = self.available()
+        preferred = self.preferences.get(kind)
+        decoders.sort(key=lambda decoder: decoder.name != preferred)
+        return decoders
+
+    def decode(self, source: Source, kind: Optional[str] = None) -> Image.Image:
+        """
+        Decode with the preferred backend for the input, falling back to the others
+
+        Args:
+            source: Path to the file or its contents
+            kind: Input kind; read from the header when not given
+
+        Raises:
+            DecoderUnavailableError: If no backend is installed
+        """
+        if kind is None:
+            try:
+                kind = input_kind(read_heif_header(source))
+            except (HeifFormatError, OSError):
+                kind = "plain"
+
+        decoders = self.candidates(kind)
+        if not decoders:
+            raise DecoderUnavailableError("No HEIC/HEIF decoder backend is installed")
+
+        for decoder in decoders:
+            decoder.initialize()
+            try:
+                return decoder.decode(source)
+            except Exception as e:
+                if decoder is decoders[-1]:
+                    raise
+                logger.warning(f"{decoder.name} failed to decode {kind} input: {str(e)}. Trying the next backend")
+
+    def benchmark(self, samples: Dict[str, bytes], repeat: int = 3) -> Dict[str, Dict[str, float]]:
+        """
+        Time every installed backend on each sample and prefer the fastest per kind
+
+        Args:
+            samples: File contents per input kind
+            repeat: Timed runs per backend and sample, after one warm-up
+
+        Returns:
+            Median decode time in seconds per kind and backend; failed
+            backends are left out
+        """
+        timings: Dict[str, Dict[str, float]] = {}
+        for kind, content in samples.items():
+            results = {}
+            for decoder in self.available():
+                decoder.initialize()
+                try:
+                    decoder.decode(content)
+                    runs = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        decoder.decode(content)
+                        runs.append(time.perf_counter() - start)
+                except Exception as e:
+                    logger.warning(f"{decoder.name} cannot decode the {kind} sample: {str(e)}")
+                    continue
+                results[decoder.name] = median(runs)
+
+            timings[kind] = results
+            if results:
+                self.preferences[kind] = min(results, key=results.get)
+        return timings
+
+
+def load_samples(directory: Path) -> Dict[str, bytes]:
+    """
+    Pick one sample file per input kind from a directory
+
+    The smallest file of each kind is used, to keep the benchmark short.
+    """
+    samples: Dict[str, bytes] = {}
+    paths = sorted(
+        (path for pattern in ("*.heic", "*.heif") for path in Path(directory).glob(pattern)),
+        key=lambda path: path.stat().st_size,
+    )
+    for path in paths:
+        try:
+            kind = input_kind(read_heif_header(path))
+        except (HeifFormatError, OSError):
+            continue
+        if kind not in samples:
+            samples[kind] = path.read_bytes()
+    return samples
+
+
+registry = DecoderRegistry()
+registry.register(PyheifDecoder())
+registry.register(PillowHeifDecoder())
+
+
+def configure(order: Optional[Iterable[str]] = None, preferences: Optional[Dict[str, str]] = None) -> None:
+    """Configure and initialize the registry; used as a worker process initializer"""
+    registry.configure(order, preferences)
+    registry.initialize()
+
+
+def decode(source: Source, kind: Optional[str] = None) -> Image.Image:
+    """Decode a HEIC/HEIF file with the shared registry"""
+    return registry.decode(source, kind)
@@ -0,0 +1,302 @@
+"""
+Cache-friendly serving of converted files.
+
+Converted files are named after the SHA-256 of their contents, so a
+download URL always refers to the same bytes: the name doubles as a strong
+ETag and responses can be cached as immutable. Files with other names get
+an ETag from hashing their contents once.
+
+Responses honour If-None-Match, If-Modified-Since, Range and If-Range.
+Files in local storage are handed to the server with the ASGI pathsend or
+zerocopysend extensions when the server offers them; other backends are
+read with a ranged get.
+"""
+
+import asyncio
+import hashlib
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
+from typing import List, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from storage import Storage, StoredObject
+
+# <sha256 hex>.<extension>, as written by utils.content_addressed_filename()
+CONTENT_ADDRESSED_NAME = re.compile(r"^([0-9a-f]{64})\.[a-z0-9]+$")
+
+# Characters replaced in the plain filename parameter: non-ASCII, controls, quotes and backslashes
+UNSAFE_FILENAME_CHARACTERS = re.compile(r'[^\x20-\x7e]|["\\]')
+
+CHUNK_SIZE = 64 * 1024
+
+
+@lru_cache(maxsize=4096)
+def _hash_file(path: str, modified: float, size: int) -> str:
+    """SHA-256 of a file, remembered per path, modification time and size"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_content_addressed(filename: str) -> bool:
+    return CONTENT_ADDRESSED_NAME.match(filename) is not None
+
+
+def file_etag(storage: Storage, stored: StoredObject) -> str:
+    """
+    Strong ETag for a stored file: its content hash
+
+    Reads the file unless its name already is the hash, so call it off the
+    event loop.
+    """
+    match = CONTENT_ADDRESSED_NAME.match(stored.name)
+    if match:
+        digest = match.group(1)
+    elif stored.path is not None:
+        digest = _hash_file(str(stored.path), stored.modified, stored.size)
+    else:
+        digest = hashlib.sha256(storage.get(stored.name)).hexdigest()
+    return f'"{digest}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison against an If-None-Match list"""
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in header.split(","))
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return False
+    # Last-Modified has one-second resolution
+    return int(mtime) <= since
+
+
+def content_disposition(disposition: str, filename: str) -> str:
+    """
+    Content-Disposition header value offering a filename
+
+    Names that are not plain ASCII, or that contain characters needing
+    escapes, are sent RFC 5987-encoded in filename*, after an ASCII
+    fallback in filename for clients that do not understand it.
+    """
+    quoted = quote(filename)
+    if quoted == filename:
+        return f'{disposition}; filename="{filename}"'
+    fallback = UNSAFE_FILENAME_CHARACTERS.sub("_", filename)
+    return f"{disposition}; filename=\"{fallback}\"; filename*=utf-8''{quoted}"
+
+
+def parse_range(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a bytes Range header into inclusive (start, end) pairs
+
+    Returns:
+        The satisfiable ranges (empty if none are), or None if the header
+        is malformed or not in bytes and should be ignored
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        first, dash, last = part.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if not first:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(0, size - length), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+                if start >= size:
+                    continue
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        ranges.append((start, end))
+    return ranges
+
+
+class DownloadResponse(Response):
+    """
+    File response with validators, conditional requests and byte ranges
+
+    Only single ranges are served as 206; a request for several ranges gets
+    the whole file, which RFC 9110 allows.
+
+    Args:
+        storage: Storage holding the file
+        stored: The file, as stat-ed when the ETag was computed
+        etag: Strong ETag of the file contents
+        media_type: Content-Type of the file
+        filename: Name offered in Content-Disposition
+        cache_control: Cache-Control header value
+        background: Task run after the body has been sent
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        stored: StoredObject,
+        etag: str,
+        media_type: str,
+        filename: Optional[str] = None,
+        cache_control: Optional[str] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        background: Optional[BackgroundTask] = None,
+    ):
+        self.storage = storage
+        self.stored = stored
+        self.status_code = 200
+        self.media_type = media_type
+        self.background = background
+        # Body bytes actually sent, known once the response has run
+        self.sent_bytes = 0
+        self.init_headers(headers)
+
+        self.headers["etag"] = etag
+        self.headers["last-modified"] = formatdate(stored.modified, usegmt=True)
+        self.headers["accept-ranges"] = "bytes"
+        if cache_control:
+            self.headers["cache-control"] = cache_control
+        if filename is not None:
+            self.headers["content-disposition"] = content_disposition("attachment", filename)
+
+    def _evaluate(self, request_headers: Headers) -> Tuple[int, Optional[Tuple[int, int]]]:
+        """Status code and byte range to send for the request's conditions"""
+        etag = self.headers["etag"]
+        mtime = self.stored.modified
+        size = self.stored.size
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            if _etag_matches(if_none_match, etag):
+                return 304, None
+        else:
+            if_modified_since = request_headers.get("if-modified-since")
+            if if_modified_since and _not_modified_since(if_modified_since, mtime):
+                return 304, None
+
+        range_header = request_headers.get("range")
+        if range_header is None:
+            return 200, None
+
+        # A stale If-Range means the client's partial copy is useless: send everything
+        if_range = request_headers.get("if-range")
+        if if_range is not None:
+            if if_range.strip().startswith(("\"", "W/")):
+                if if_range.strip() != etag:
+                    return 200, None
+            elif not _not_modified_since(if_range, mtime):
+                return 200, None
+
+        ranges = parse_range(range_header, size)
+        if ranges is None or len(ranges) > 1:
+            return 200, None
+        if not ranges:
+            return 416, None
+        return 206, ranges[0]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        size = self.stored.size
+        status, byte_range = self._evaluate(Headers(scope=scope))
+        send_body = scope.get("method", "GET").upper() != "HEAD"
+
+        if status == 304:
+            for name in ("content-type", "content-disposition", "accept-ranges"):
+                if name in self.headers:
+                    del self.headers[name]
+            send_body = False
+        elif status == 416:
+            self.headers["content-range"] = f"bytes */{size}"
+            self.headers["content-length"] = "0"
+            send_body = False
+        elif status == 206:
+            start, end = byte_range
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-length"] = str(end - start + 1)
+        else:
+            byte_range = (0, size - 1)
+            self.headers["content-length"] = str(size)
+
+        self.status_code = status
+        await send({"type": "http.response.start", "status": status, "headers": self.raw_headers})
+
+        if not send_body or size == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            await self._send_file(scope, send, *byte_range)
+            self.sent_bytes = byte_range[1] - byte_range[0] + 1
+
+        if self.background is not None:
+            await self.background()
+
+    async def _send_file(self, scope: Scope, send: Send, start: int, end: int) -> None:
+        extensions = scope.get("extensions") or {}
+        count = end - start + 1
+        path = self.stored.path
+
+        if path is None:
+            body = await asyncio.to_thread(self.storage.get, self.stored.name, start, count)
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+            return
+
+        if "http.response.pathsend" in extensions and count == self.stored.size:
+            await send({"type": "http.response.pathsend", "path": str(path)})
+            return
+
+        if "http.response.zerocopysend" in extensions:
+            with open(path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": start,
+                    "count": count,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(path, mode="rb") as f:
+            await f.seek(start)
+            remaining = count
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # The file shrank underneath us; end the body rather than hang
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def stat_and_etag(storage: Storage, name: str) -> Tuple[StoredObject, str]:
+    """
+    Stat a stored file and compute its ETag
+
+    Raises:
+        FileNotFoundError: If there is no such file
+    """
+    stored = storage.stat(name)
+    return stored, file_etag(storage, stored)
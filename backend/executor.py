@@ -0,0 +1,255 @@
+"""
+Process-pool executor for running CPU-bound conversions off the event loop.
+
+Each worker is a dedicated process connected through a pipe, so a job that
+exceeds its timeout can be killed and replaced without disturbing the jobs
+running on the other workers.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorBusyError(Exception):
+    """Raised when the submission queue is full"""
+
+
+class ConversionTimeoutError(Exception):
+    """Raised when a job runs longer than the configured timeout"""
+
+
+class WorkerCrashedError(Exception):
+    """Raised when a worker process dies while running a job"""
+
+
+# Pipe to the parent process, set inside worker processes
+_worker_conn = None
+_report_progress = False
+
+
+def report_progress(stage: str) -> None:
+    """
+    Report the current stage of the running job to the parent process
+
+    Does nothing outside a worker or when the caller did not ask for progress.
+    """
+    if _worker_conn is not None and _report_progress:
+        _worker_conn.send(("progress", (stage, time.time())))
+
+
+def _worker_main(conn, initializer: Optional[Callable] = None, initargs: tuple = ()) -> None:
+    """Worker process loop: receive jobs, run them and send back the outcome"""
+    global _worker_conn, _report_progress
+    _worker_conn = conn
+
+    if initializer is not None:
+        try:
+            initializer(*initargs)
+        except Exception:
+            logger.exception("Worker initializer failed")
+
+    while True:
+        try:
+            fn, args, kwargs, _report_progress = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        try:
+            outcome = ("ok", fn(*args, **kwargs))
+        except Exception as e:
+            outcome = ("error", e)
+
+        try:
+            conn.send(outcome)
+        except Exception as e:
+            # The result or exception could not be pickled
+            conn.send(("error", RuntimeError(f"{type(e).__name__}: {str(e)}")))
+
+
+class _Worker:
+    """A single worker process and the parent end of its pipe"""
+
+    def __init__(self, context, initializer: Optional[Callable] = None, initargs: tuple = ()):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, initializer, initargs), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def roundtrip(self, job: tuple, on_progress: Optional[Callable[[str, float], None]]) -> tuple:
+        """Send a job and block until its outcome arrives, relaying progress reports"""
+        self.conn.send(job)
+        while True:
+            kind, value = self.conn.recv()
+            if kind != "progress":
+                return kind, value
+            if on_progress is not None:
+                on_progress(*value)
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ConversionExecutor:
+    """
+    Bounded pool of worker processes
+
+    Args:
+        max_workers: Number of worker processes
+        max_queue_size: Number of jobs allowed to wait for a free worker
+        job_timeout: Seconds a job may run before its worker is killed
+        start_method: multiprocessing start method for the workers
+        initializer: Module-level function each worker calls with initargs
+            before its first job; may be changed until the workers start
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_queue_size: int,
+        job_timeout: float,
+        start_method: str = "spawn",
+        initializer: Optional[Callable] = None,
+        initargs: tuple = (),
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max(0, max_queue_size)
+        self.job_timeout = job_timeout
+        self._context = multiprocessing.get_context(start_method)
+        self.initializer = initializer
+        self.initargs = initargs
+        self._workers: List[_Worker] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._io_threads: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+
+    @property
+    def started(self) -> bool:
+        return self._idle is not None
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs running or waiting for a worker"""
+        return self._pending
+
+    @property
+    def is_full(self) -> bool:
+        """Whether a new job would be rejected"""
+        return self._pending >= self.max_workers + self.max_queue_size
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker"""
+        return max(0, self._pending - self.max_workers)
+
+    def start(self) -> None:
+        """Spawn the worker processes"""
+        if self.started:
+            return
+
+        self._idle = asyncio.Queue()
+        self._io_threads = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="conversion-io",
+        )
+        for _ in range(self.max_workers):
+            worker = _Worker(self._context, self.initializer, self.initargs)
+            self._workers.append(worker)
+            self._idle.put_nowait(worker)
+
+        logger.info(f"Started conversion executor with {self.max_workers} workers")
+
+    def shutdown(self) -> None:
+        """Stop all worker processes"""
+        for worker in self._workers:
+            worker.kill()
+        self._workers = []
+        self._idle = None
+
+        if self._io_threads is not None:
+            self._io_threads.shutdown(wait=False, cancel_futures=True)
+            self._io_threads = None
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        if worker not in self._workers:
+            # Shut down while its job ran; nothing to replace it in
+            return worker
+        replacement = _Worker(self._context, self.initializer, self.initargs)
+        self._workers[self._workers.index(worker)] = replacement
+        return replacement
+
+    async def run(
+        self,
+        fn: Callable,
+        *args: Any,
+        on_progress: Optional[Callable[[str, float], None]] = None,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Run fn(*args, **kwargs) in a worker process
+
+        fn must be a module-level function and its arguments and result
+        must be picklable. If on_progress is given, it is called on the
+        event loop with (stage, timestamp) for every report_progress()
+        call made by fn.
+
+        Raises:
+            ExecutorBusyError: If all workers are busy and the queue is full
+            ConversionTimeoutError: If the job exceeds the job timeout
+            WorkerCrashedError: If the worker process died during the job
+        """
+        if not self.started:
+            self.start()
+
+        if self.is_full:
+            raise ExecutorBusyError("Conversion queue is full")
+
+        self._pending += 1
+        try:
+            worker = await self._idle.get()
+            loop = asyncio.get_running_loop()
+
+            relay = None
+            if on_progress is not None:
+                def relay(stage: str, timestamp: float) -> None:
+                    loop.call_soon_threadsafe(on_progress, stage, timestamp)
+
+            job = (fn, args, kwargs, on_progress is not None)
+            try:
+                kind, value = await asyncio.wait_for(
+                    loop.run_in_executor(self._io_threads, worker.roundtrip, job, relay),
+                    timeout=self.job_timeout,
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Job exceeded {self.job_timeout}s, killing worker {worker.process.pid}")
+                worker = self._replace(worker)
+                raise ConversionTimeoutError(f"Conversion timed out after {self.job_timeout} seconds")
+            except (EOFError, OSError) as e:
+                logger.error(f"Worker {worker.process.pid} crashed: {str(e)}")
+                worker = self._replace(worker)
+                raise WorkerCrashedError("Conversion worker crashed")
+            except asyncio.CancelledError:
+                # The worker is still busy with the abandoned job
+                worker = self._replace(worker)
+                raise
+            finally:
+                # Unless the executor shut down, or restarted with new workers, meanwhile
+                if worker in self._workers:
+                    self._idle.put_nowait(worker)
+        finally:
+            self._pending -= 1
+
+        if kind == "error":
+            raise value
+        return value
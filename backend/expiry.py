@@ -0,0 +1,165 @@
+"""
+Expiry index for stored files.
+
+Files are registered when they are written, so cleanup only touches files
+that are actually due instead of listing and stat-ing the whole storage.
+The index also keeps the storage under a total size budget by evicting
+the least recently used files first.
+"""
+
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IndexedFile:
+    """A tracked stored file"""
+    size: int
+    expires_at: float
+
+
+class ExpiryIndex:
+    """
+    Min-heap of file expiry times plus an LRU order for the byte budget
+
+    Safe to use from the event loop and from worker threads.
+
+    Args:
+        storage: Storage the tracked files live in
+        retention_seconds: How long a file is kept after it was written
+        max_bytes: Total size of tracked files before LRU eviction
+    """
+
+    def __init__(self, storage: Storage, retention_seconds: float, max_bytes: int):
+        self.storage = storage
+        self.retention_seconds = retention_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._files: "OrderedDict[str, IndexedFile]" = OrderedDict()
+        self._heap: List[Tuple[float, str]] = []
+        self._total_bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def _insert(self, name: str, size: int, expires_at: float) -> None:
+        previous = self._files.pop(name, None)
+        if previous is not None:
+            self._total_bytes -= previous.size
+        self._files[name] = IndexedFile(size, expires_at)
+        self._total_bytes += size
+        heapq.heappush(self._heap, (expires_at, name))
+
+    def add(self, name: str, size: Optional[int] = None, written_at: Optional[float] = None) -> None:
+        """
+        Track a file that was just written to the storage
+
+        Args:
+            name: Name of the stored file
+            size: File size in bytes, read from the storage if not given
+            written_at: Time the file was written, defaults to now
+        """
+        if size is None:
+            try:
+                size = self.storage.stat(name).size
+            except FileNotFoundError:
+                return
+        expires_at = (written_at or time.time()) + self.retention_seconds
+        with self._lock:
+            self._insert(name, size, expires_at)
+
+    def touch(self, name: str) -> None:
+        """Mark a file as recently used"""
+        with self._lock:
+            if name in self._files:
+                self._files.move_to_end(name)
+
+    def discard(self, name: str) -> None:
+        """Stop tracking a file that was deleted elsewhere"""
+        with self._lock:
+            entry = self._files.pop(name, None)
+            if entry is not None:
+                self._total_bytes -= entry.size
+
+    def rebuild(self) -> int:
+        """
+        Rebuild the index from the stored files
+
+        Used on startup so files written before a restart still expire.
+        Files are ordered for eviction by modification time. Blocking; run
+        it off the event loop.
+
+        Returns:
+            Number of files tracked
+        """
+        found = [(stored.modified, stored.name, stored.size) for stored in self.storage.iterate()]
+
+        found.sort()
+        with self._lock:
+            self._files.clear()
+            self._total_bytes = 0
+            for mtime, name, size in found:
+                self._files[name] = IndexedFile(size, mtime + self.retention_seconds)
+                self._total_bytes += size
+            self._heap = [(entry.expires_at, name) for name, entry in self._files.items()]
+            heapq.heapify(self._heap)
+        return len(found)
+
+    def _pop_expired(self, now: float) -> List[str]:
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, name = heapq.heappop(self._heap)
+            entry = self._files.get(name)
+            # Skip heap entries left behind by discard() or a re-add
+            if entry is None or entry.expires_at != expires_at:
+                continue
+            del self._files[name]
+            self._total_bytes -= entry.size
+            expired.append(name)
+        return expired
+
+    def _pop_over_budget(self) -> List[str]:
+        evicted = []
+        while self._total_bytes > self.max_bytes and self._files:
+            name, entry = self._files.popitem(last=False)
+            self._total_bytes -= entry.size
+            evicted.append(name)
+        return evicted
+
+    def purge(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Delete expired files, then the least recently used ones over the budget
+
+        Blocking; run it off the event loop.
+
+        Returns:
+            Counts of "expired" and "evicted" files
+        """
+        with self._lock:
+            expired = self._pop_expired(now or time.time())
+            evicted = self._pop_over_budget()
+            # Drop stale heap entries once they dominate the heap
+            if len(self._heap) > 2 * len(self._files) + 64:
+                self._heap = [(entry.expires_at, name) for name, entry in self._files.items()]
+                heapq.heapify(self._heap)
+
+        for name in expired + evicted:
+            try:
+                self.storage.delete(name)
+            except Exception as e:
+                logger.error(f"Error deleting file {name}: {str(e)}")
+
+        return {"expired": len(expired), "evicted": len(evicted)}
@@ -0,0 +1,179 @@
+"""
+Output formats and their encoder settings.
+
+A conversion can write one or more formats from the same decoded and
+transformed image. Clients pick formats with the `format` option, or let
+the server choose from their `Accept` header.
+"""
+
+import importlib
+import io
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from config import settings
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    """An image format the converter can write"""
+    name: str
+    media_type: str
+    extension: str
+    pillow_format: str
+    lossy: bool = True
+    # Whether the format stores an alpha channel; others are flattened onto ALPHA_BACKGROUND
+    alpha: bool = True
+    # Optional package that adds the Pillow plugin
+    plugin: Optional[str] = None
+    # Encoding time per pixel relative to decoding a HEIC pixel, for scheduling
+    encode_cost: float = 0.1
+
+    @property
+    def supported(self) -> bool:
+        """Whether the installed Pillow can write this format"""
+        if self.plugin is not None:
+            try:
+                importlib.import_module(self.plugin)
+            except ImportError:
+                pass
+        Image.init()
+        return self.pillow_format in Image.SAVE
+
+
+FORMATS: Dict[str, OutputFormat] = {
+    "jpeg": OutputFormat("jpeg", "image/jpeg", ".jpg", "JPEG", alpha=False),
+    "webp": OutputFormat("webp", "image/webp", ".webp", "WEBP", encode_cost=1.0),
+    "avif": OutputFormat("avif", "image/avif", ".avif", "AVIF", plugin="pillow_avif", encode_cost=4.0),
+    "png": OutputFormat("png", "image/png", ".png", "PNG", lossy=False, encode_cost=1.0),
+}
+ALIASES = {"jpg": "jpeg"}
+
+DEFAULT_FORMAT = "jpeg"
+
+# Preferred order when a client accepts several formats equally, smallest output first
+NEGOTIATION_ORDER = ("avif", "webp", "jpeg", "png")
+
+
+def get_format(name: str) -> OutputFormat:
+    """
+    Look up a format by name or alias
+
+    Raises:
+        ValueError: If the format is unknown or cannot be written here
+    """
+    key = name.strip().lower()
+    fmt = FORMATS.get(ALIASES.get(key, key))
+    if fmt is None:
+        raise ValueError(f"Unknown output format '{name}'. Supported formats: {', '.join(supported_formats())}")
+    if not fmt.supported:
+        raise ValueError(f"Output format '{fmt.name}' is not available on this server")
+    return fmt
+
+
+def supported_formats() -> List[str]:
+    return [name for name, fmt in FORMATS.items() if fmt.supported]
+
+
+def format_for_extension(extension: str) -> Optional[OutputFormat]:
+    for fmt in FORMATS.values():
+        if fmt.extension == extension.lower():
+            return fmt
+    return None
+
+
+def parse_formats(value: str) -> List[str]:
+    """
+    Parse a comma-separated list of format names, dropping duplicates
+
+    Raises:
+        ValueError: If a format is unknown or cannot be written here
+    """
+    names: List[str] = []
+    for part in value.split(","):
+        if part.strip():
+            name = get_format(part).name
+            if name not in names:
+                names.append(name)
+    if not names:
+        raise ValueError("No output format given")
+    return names
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """
+    Choose the output format from an Accept header
+
+    Only explicitly listed image types count; wildcards such as `image/*`
+    keep the default, so generic clients still get JPEG.
+    """
+    if not accept:
+        return DEFAULT_FORMAT
+
+    weights: Dict[str, float] = {}
+    by_media_type = {fmt.media_type: fmt.name for fmt in FORMATS.values()}
+    for part in accept.split(","):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        name = by_media_type.get(media_type.lower())
+        if name is None:
+            continue
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name] = max(weight, weights.get(name, 0.0))
+
+    candidates = [name for name in NEGOTIATION_ORDER if weights.get(name, 0) > 0 and FORMATS[name].supported]
+    if not candidates:
+        return DEFAULT_FORMAT
+    return max(candidates, key=lambda name: weights[name])
+
+
+def default_quality(name: str) -> Optional[int]:
+    """Quality used when the request does not give one; None for lossless formats"""
+    return {
+        "jpeg": settings.JPG_QUALITY,
+        "webp": settings.WEBP_QUALITY,
+        "avif": settings.AVIF_QUALITY,
+    }.get(name)
+
+
+def encoder_options(name: str, quality: Optional[int]) -> Dict[str, Any]:
+    """Pillow save() arguments for a format"""
+    if name == "webp":
+        return {"quality": quality, "method": settings.WEBP_METHOD}
+    if name == "avif":
+        return {"quality": quality, "speed": settings.AVIF_SPEED}
+    if name == "png":
+        return {"compress_level": settings.PNG_COMPRESS_LEVEL}
+    return {"quality": quality}
+
+
+def flatten(image: Image.Image) -> Image.Image:
+    """RGB copy of an image, with any transparency composited onto ALPHA_BACKGROUND"""
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", image.size, settings.ALPHA_BACKGROUND)
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def encode_image(image: Image.Image, name: str, quality: Optional[int] = None) -> bytes:
+    """Encode an image in memory"""
+    fmt = FORMATS[name]
+    if quality is None:
+        quality = default_quality(name)
+    if not fmt.alpha:
+        image = flatten(image)
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt.pillow_format, **encoder_options(name, quality))
+    return buffer.getvalue()
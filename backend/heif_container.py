@@ -0,0 +1,715 @@
+"""
+Lightweight HEIF (ISOBMFF) container parser.
+
+Reads the `ftyp` and `meta` boxes to describe the images in a HEIF file
+without touching the compressed pixel data in `mdat`.
+"""
+
+import io
+import struct
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+# Brands that identify a HEIF still image or image sequence
+HEIF_BRANDS = {
+    "heic", "heix", "heim", "heis",
+    "hevc", "hevx", "hevm", "hevs",
+    "mif1", "msf1", "avif", "avis",
+}
+
+# Refuse to load absurdly large metadata boxes into memory
+MAX_META_SIZE = 16 * 1024 * 1024
+
+# Item types that hold an image, as opposed to metadata such as Exif or XMP
+IMAGE_ITEM_TYPES = {"hvc1", "av01", "avc1", "jpeg", "j2k1", "unci", "grid", "iovl", "iden"}
+
+
+class HeifFormatError(ValueError):
+    """Raised when a file is not a well-formed HEIF container"""
+
+
+@dataclass
+class HeifProperty:
+    """An item property from the `ipco` box"""
+    box_type: str
+    payload: bytes
+    essential: bool = False
+
+
+@dataclass
+class HeifItem:
+    """An item from the `iinf` box with its location and properties"""
+    item_id: int
+    item_type: str
+    hidden: bool = False
+    construction_method: int = 0
+    base_offset: int = 0
+    extents: List[Tuple[int, int]] = field(default_factory=list)
+    properties: List[HeifProperty] = field(default_factory=list)
+    references: Dict[str, List[int]] = field(default_factory=dict)
+
+    def get_property(self, box_type: str) -> Optional[HeifProperty]:
+        for prop in self.properties:
+            if prop.box_type == box_type:
+                return prop
+        return None
+
+    @property
+    def size(self) -> Optional[Tuple[int, int]]:
+        """Width and height from the `ispe` property, before irot/imir"""
+        ispe = self.get_property("ispe")
+        if ispe is None or len(ispe.payload) < 12:
+            return None
+        return struct.unpack(">II", ispe.payload[4:12])
+
+    @property
+    def rotation(self) -> int:
+        """Counter-clockwise rotation from the `irot` property, in degrees"""
+        irot = self.get_property("irot")
+        if irot is None or not irot.payload:
+            return 0
+        return (irot.payload[0] & 0x03) * 90
+
+    @property
+    def display_size(self) -> Optional[Tuple[int, int]]:
+        """Width and height with irot applied"""
+        size = self.size
+        if size is not None and self.rotation in (90, 270):
+            return size[1], size[0]
+        return size
+
+    @property
+    def bit_depth(self) -> Optional[int]:
+        """Largest bits per channel from the `pixi` property"""
+        pixi = self.get_property("pixi")
+        if pixi is None or len(pixi.payload) < 6:
+            return None
+        channels = pixi.payload[4]
+        return max(pixi.payload[5:5 + channels], default=None)
+
+    @property
+    def data_length(self) -> int:
+        return sum(length for _, length in self.extents)
+
+
+@dataclass
+class HeifHeader:
+    """Container-level description of a HEIF file"""
+    major_brand: str
+    compatible_brands: List[str]
+    primary_item_id: int
+    items: Dict[int, HeifItem]
+    file_size: int
+    idat: bytes = b""
+
+    @property
+    def primary_item(self) -> HeifItem:
+        return self.items[self.primary_item_id]
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Displayed width and height of the primary image, with irot applied"""
+        return self.primary_item.display_size
+
+    @property
+    def pixel_count(self) -> int:
+        width, height = self.size
+        return width * height
+
+    @property
+    def rotation(self) -> int:
+        """Counter-clockwise rotation of the primary image, in degrees"""
+        return self.primary_item.rotation
+
+    @property
+    def is_grid(self) -> bool:
+        return self.primary_item.item_type == "grid"
+
+    @property
+    def bit_depth(self) -> int:
+        """Bits per channel of the primary image, read from its first tile for grids"""
+        primary = self.primary_item
+        depth = primary.bit_depth
+        tiles = primary.references.get("dimg", [])
+        if depth is None and tiles and tiles[0] in self.items:
+            depth = self.items[tiles[0]].bit_depth
+        return depth or 8
+
+    @property
+    def has_alpha(self) -> bool:
+        """Whether an auxiliary alpha plane is attached to the primary image"""
+        for item in self.items.values():
+            if self.primary_item_id not in item.references.get("auxl", []):
+                continue
+            auxc = item.get_property("auxC")
+            if auxc is not None and (b"alpha" in auxc.payload or b"auxid:1" in auxc.payload):
+                return True
+        return False
+
+    @property
+    def images(self) -> List[HeifItem]:
+        """Top-level images: neither grid tiles, thumbnails nor auxiliary images such as alpha"""
+        tiles = {item_id for item in self.items.values() for item_id in item.references.get("dimg", [])}
+        return [
+            item for item in self.items.values()
+            if item.item_type in IMAGE_ITEM_TYPES
+            and item.item_id not in tiles
+            and not item.hidden
+            and "thmb" not in item.references
+            and "auxl" not in item.references
+        ]
+
+
+class _Reader:
+    """Big-endian cursor over a bytes buffer"""
+
+    def __init__(self, data: bytes, pos: int = 0, end: Optional[int] = None):
+        self.data = data
+        self.pos = pos
+        self.end = len(data) if end is None else end
+
+    def remaining(self) -> int:
+        return self.end - self.pos
+
+    def read(self, n: int) -> bytes:
+        if n < 0 or self.pos + n > self.end:
+            raise HeifFormatError("Unexpected end of box")
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+    def uint(self, n: int) -> int:
+        if n == 0:
+            return 0
+        return int.from_bytes(self.read(n), "big")
+
+    def fourcc(self) -> str:
+        return self.read(4).decode("latin-1")
+
+    def cstring(self) -> str:
+        terminator = self.data.find(b"\x00", self.pos, self.end)
+        if terminator < 0:
+            terminator = self.end
+        value = self.data[self.pos:terminator].decode("utf-8", errors="replace")
+        self.pos = min(terminator + 1, self.end)
+        return value
+
+    def full_box_header(self) -> Tuple[int, int]:
+        version = self.uint(1)
+        flags = self.uint(3)
+        return version, flags
+
+    def boxes(self):
+        """Iterate over (box_type, payload_start, box_end, box_start) child boxes"""
+        while self.remaining() >= 8:
+            start = self.pos
+            size = self.uint(4)
+            box_type = self.fourcc()
+            if size == 1:
+                size = self.uint(8)
+            elif size == 0:
+                size = self.end - start
+            header_size = self.pos - start
+            if size < header_size or start + size > self.end:
+                raise HeifFormatError(f"Box '{box_type}' overruns its container")
+            yield box_type, self.pos, start + size, start
+            self.pos = start + size
+
+
+def _parse_ftyp(payload: bytes) -> Tuple[str, List[str]]:
+    reader = _Reader(payload)
+    major_brand = reader.fourcc()
+    reader.uint(4)  # minor_version
+    brands = []
+    while reader.remaining() >= 4:
+        brands.append(reader.fourcc())
+    return major_brand, brands
+
+
+def _parse_infe(reader: _Reader) -> HeifItem:
+    version, flags = reader.full_box_header()
+    if version < 2:
+        raise HeifFormatError(f"Unsupported infe version {version}")
+    item_id = reader.uint(2 if version == 2 else 4)
+    reader.uint(2)  # item_protection_index
+    item_type = reader.fourcc()
+    return HeifItem(item_id=item_id, item_type=item_type, hidden=bool(flags & 1))
+
+
+def _parse_iinf(reader: _Reader, items: Dict[int, HeifItem]) -> None:
+    version, _ = reader.full_box_header()
+    reader.uint(2 if version == 0 else 4)  # entry_count
+    for box_type, start, end, _ in reader.boxes():
+        if box_type == "infe":
+            entry = _parse_infe(_Reader(reader.data, start, end))
+            item = items.setdefault(entry.item_id, entry)
+            item.item_type = entry.item_type
+            item.hidden = entry.hidden
+
+
+def _parse_iloc(reader: _Reader, items: Dict[int, HeifItem]) -> None:
+    version, _ = reader.full_box_header()
+    sizes = reader.uint(2)
+    offset_size = (sizes >> 12) & 0xF
+    length_size = (sizes >> 8) & 0xF
+    base_offset_size = (sizes >> 4) & 0xF
+    index_size = sizes & 0xF if version in (1, 2) else 0
+
+    item_count = reader.uint(2 if version < 2 else 4)
+    for _ in range(item_count):
+        item_id = reader.uint(2 if version < 2 else 4)
+        construction_method = reader.uint(2) & 0xF if version in (1, 2) else 0
+        reader.uint(2)  # data_reference_index
+        base_offset = reader.uint(base_offset_size)
+        extents = []
+        for _ in range(reader.uint(2)):
+            reader.uint(index_size)
+            extents.append((reader.uint(offset_size), reader.uint(length_size)))
+
+        item = items.setdefault(item_id, HeifItem(item_id=item_id, item_type=""))
+        item.construction_method = construction_method
+        item.base_offset = base_offset
+        item.extents = extents
+
+
+def _parse_iref(reader: _Reader, items: Dict[int, HeifItem]) -> None:
+    version, _ = reader.full_box_header()
+    id_size = 2 if version == 0 else 4
+    for ref_type, start, end, _ in reader.boxes():
+        ref = _Reader(reader.data, start, end)
+        from_id = ref.uint(id_size)
+        to_ids = [ref.uint(id_size) for _ in range(ref.uint(2))]
+        item = items.setdefault(from_id, HeifItem(item_id=from_id, item_type=""))
+        item.references.setdefault(ref_type, []).extend(to_ids)
+
+
+def _parse_iprp(reader: _Reader, items: Dict[int, HeifItem]) -> None:
+    properties: List[Tuple[str, bytes]] = []
+    associations = []
+
+    for box_type, start, end, _ in reader.boxes():
+        if box_type == "ipco":
+            for prop_type, prop_start, prop_end, _ in _Reader(reader.data, start, end).boxes():
+                properties.append((prop_type, reader.data[prop_start:prop_end]))
+        elif box_type == "ipma":
+            ipma = _Reader(reader.data, start, end)
+            version, flags = ipma.full_box_header()
+            for _ in range(ipma.uint(4)):
+                item_id = ipma.uint(2 if version < 1 else 4)
+                for _ in range(ipma.uint(1)):
+                    if flags & 1:
+                        value = ipma.uint(2)
+                        associations.append((item_id, value & 0x7FFF, bool(value & 0x8000)))
+                    else:
+                        value = ipma.uint(1)
+                        associations.append((item_id, value & 0x7F, bool(value & 0x80)))
+
+    for item_id, index, essential in associations:
+        # Property indices are 1-based; 0 means "no property"
+        if index == 0 or index > len(properties):
+            continue
+        box_type, payload = properties[index - 1]
+        item = items.setdefault(item_id, HeifItem(item_id=item_id, item_type=""))
+        item.properties.append(HeifProperty(box_type=box_type, payload=payload, essential=essential))
+
+
+def _parse_meta(data: bytes, ftyp: Tuple[str, List[str]], file_size: int) -> HeifHeader:
+    reader = _Reader(data)
+    reader.full_box_header()
+
+    handler = None
+    primary_item_id = None
+    items: Dict[int, HeifItem] = {}
+    idat = b""
+
+    for box_type, start, end, _ in reader.boxes():
+        child = _Reader(data, start, end)
+        if box_type == "hdlr":
+            child.full_box_header()
+            child.uint(4)  # pre_defined
+            handler = child.fourcc()
+        elif box_type == "pitm":
+            version, _ = child.full_box_header()
+            primary_item_id = child.uint(2 if version == 0 else 4)
+        elif box_type == "iinf":
+            _parse_iinf(child, items)
+        elif box_type == "iloc":
+            _parse_iloc(child, items)
+        elif box_type == "iref":
+            _parse_iref(child, items)
+        elif box_type == "iprp":
+            _parse_iprp(child, items)
+        elif box_type == "idat":
+            idat = data[start:end]
+
+    if handler != "pict":
+        raise HeifFormatError("Missing 'pict' handler")
+    if primary_item_id is None or primary_item_id not in items:
+        raise HeifFormatError("Missing primary item")
+
+    return HeifHeader(
+        major_brand=ftyp[0],
+        compatible_brands=ftyp[1],
+        primary_item_id=primary_item_id,
+        items=items,
+        file_size=file_size,
+        idat=idat,
+    )
+
+
+def _read_box_header(stream: BinaryIO) -> Optional[Tuple[str, int, int]]:
+    """Read a top-level box header, returning (type, header_size, box_size)"""
+    header = stream.read(8)
+    if len(header) == 0:
+        return None
+    if len(header) < 8:
+        raise HeifFormatError("Truncated box header")
+    size, box_type = struct.unpack(">I4s", header)
+    header_size = 8
+    if size == 1:
+        large = stream.read(8)
+        if len(large) < 8:
+            raise HeifFormatError("Truncated box header")
+        size = struct.unpack(">Q", large)[0]
+        header_size = 16
+    elif size == 0:
+        size = None
+    return box_type.decode("latin-1"), header_size, size
+
+
+def _parse_stream(stream: BinaryIO, file_size: int) -> HeifHeader:
+    ftyp = None
+    position = 0
+
+    while position < file_size:
+        stream.seek(position)
+        box = _read_box_header(stream)
+        if box is None:
+            break
+        box_type, header_size, size = box
+        if size is None:
+            size = file_size - position
+        if size < header_size:
+            raise HeifFormatError(f"Invalid size for box '{box_type}'")
+
+        if ftyp is None:
+            if box_type != "ftyp":
+                raise HeifFormatError("File does not start with an 'ftyp' box")
+            ftyp = _parse_ftyp(stream.read(min(size - header_size, 1024)))
+            brands = {ftyp[0], *ftyp[1]}
+            if not brands & HEIF_BRANDS:
+                raise HeifFormatError(f"Not a HEIF file (brand '{ftyp[0]}')")
+        elif box_type == "meta":
+            if position + size > file_size:
+                raise HeifFormatError("Truncated 'meta' box")
+            if size > MAX_META_SIZE:
+                raise HeifFormatError("'meta' box is too large")
+            return _parse_meta(stream.read(size - header_size), ftyp, file_size)
+
+        position += size
+
+    raise HeifFormatError("Missing 'meta' box" if ftyp else "Empty file")
+
+
+def read_heif_header(source: Union[Path, str, bytes, bytearray, memoryview, BinaryIO]) -> HeifHeader:
+    """
+    Parse the container metadata of a HEIF file without decoding it
+
+    Args:
+        source: Path, in-memory file contents or a seekable binary stream
+
+    Returns:
+        HeifHeader describing the items in the file
+
+    Raises:
+        HeifFormatError: If the file is not a well-formed HEIF container
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return _parse_stream(io.BytesIO(source), len(source))
+
+    if isinstance(source, (str, Path)):
+        with open(source, "rb") as stream:
+            return _parse_stream(stream, Path(source).stat().st_size)
+
+    stream = source
+    stream.seek(0, 2)
+    file_size = stream.tell()
+    return _parse_stream(stream, file_size)
+
+
+def validate_heif_header(header: HeifHeader) -> None:
+    """
+    Check that the primary image is present and its data lies inside the file
+
+    Raises:
+        HeifFormatError: If the primary image is missing or truncated
+    """
+    primary = header.primary_item
+    size = primary.size
+    if size is None or size[0] == 0 or size[1] == 0:
+        raise HeifFormatError("Primary image has no dimensions")
+
+    # A grid's pixel data lives in its tiles
+    item_ids = primary.references.get("dimg", []) if header.is_grid else []
+    for item_id in [primary.item_id, *item_ids]:
+        item = header.items.get(item_id)
+        if item is None:
+            raise HeifFormatError(f"Missing image item {item_id}")
+        if not item.extents:
+            raise HeifFormatError(f"Image item {item_id} has no data")
+
+        if item.construction_method not in (0, 1):
+            continue
+        limit = len(header.idat) if item.construction_method == 1 else header.file_size
+        for offset, length in item.extents:
+            if item.base_offset + offset + length > limit:
+                raise HeifFormatError(f"Image item {item_id} is truncated")
+
+
+def read_item_data(
+    source: Union[Path, str, bytes, bytearray, memoryview, BinaryIO],
+    header: HeifHeader,
+    item: HeifItem,
+) -> bytes:
+    """Read the coded data of an item from its iloc extents"""
+    if item.construction_method == 1:
+        chunks = [
+            header.idat[item.base_offset + offset:item.base_offset + offset + length]
+            for offset, length in item.extents
+        ]
+        return b"".join(chunks)
+    if item.construction_method != 0:
+        raise HeifFormatError(f"Unsupported construction method {item.construction_method}")
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        return b"".join(
+            bytes(view[item.base_offset + offset:item.base_offset + offset + length if length else None])
+            for offset, length in item.extents
+        )
+
+    if isinstance(source, (str, Path)):
+        with open(source, "rb") as stream:
+            return _read_extents(stream, item)
+    return _read_extents(source, item)
+
+
+def _read_extents(stream: BinaryIO, item: HeifItem) -> bytes:
+    chunks = []
+    for offset, length in item.extents:
+        stream.seek(item.base_offset + offset)
+        chunks.append(stream.read(length) if length else stream.read())
+    return b"".join(chunks)
+
+
+def find_thumbnails(header: HeifHeader) -> List[HeifItem]:
+    """Thumbnail items of the primary image, smallest first"""
+    thumbnails = [
+        item for item in header.items.values()
+        if header.primary_item_id in item.references.get("thmb", []) and item.size
+    ]
+    return sorted(thumbnails, key=lambda item: item.size[0] * item.size[1])
+
+
+@dataclass
+class HeifGrid:
+    """Layout of a grid image from its `grid` item data"""
+    rows: int
+    columns: int
+    width: int
+    height: int
+    tile_ids: List[int]
+
+
+def read_grid(source: Union[Path, str, bytes, bytearray, memoryview, BinaryIO], header: HeifHeader) -> HeifGrid:
+    """
+    Read the layout of the primary image, which must be a grid
+
+    Tiles are listed in row-major order; the grid is cropped to width and
+    height at its right and bottom edges.
+
+    Raises:
+        HeifFormatError: If the grid is malformed
+    """
+    primary = header.primary_item
+    if not header.is_grid:
+        raise HeifFormatError("Primary image is not a grid")
+
+    data = read_item_data(source, header, primary)
+    if len(data) < 8:
+        raise HeifFormatError("Truncated 'grid' item")
+    large = data[1] & 1
+    if large and len(data) < 12:
+        raise HeifFormatError("Truncated 'grid' item")
+    width, height = struct.unpack(">II" if large else ">HH", data[4:12 if large else 8])
+
+    grid = HeifGrid(
+        rows=data[2] + 1,
+        columns=data[3] + 1,
+        width=width,
+        height=height,
+        tile_ids=primary.references.get("dimg", []),
+    )
+    if len(grid.tile_ids) != grid.rows * grid.columns:
+        raise HeifFormatError(f"Grid has {len(grid.tile_ids)} tiles for {grid.rows}x{grid.columns}")
+    return grid
+
+
+def find_exif(header: HeifHeader) -> Optional[HeifItem]:
+    """The Exif item describing the primary image, if there is one"""
+    exif_items = [item for item in header.items.values() if item.item_type == "Exif"]
+    for item in exif_items:
+        if header.primary_item_id in item.references.get("cdsc", []):
+            return item
+    # Some writers leave out the reference when there is only one image
+    return exif_items[0] if len(exif_items) == 1 else None
+
+
+def read_exif(source: Union[Path, str, bytes, bytearray, memoryview, BinaryIO], header: HeifHeader) -> Optional[bytes]:
+    """
+    Read the EXIF block of the primary image
+
+    Returns:
+        The EXIF data from its TIFF header on, or None if there is none
+
+    Raises:
+        HeifFormatError: If the Exif item is malformed
+    """
+    item = find_exif(header)
+    if item is None:
+        return None
+    if not item.extents or any(length == 0 for _, length in item.extents) or item.data_length > MAX_META_SIZE:
+        raise HeifFormatError("Invalid 'Exif' item size")
+
+    # The item starts with the offset of the TIFF header past a 4-byte field
+    data = read_item_data(source, header, item)
+    if len(data) < 4 or 4 + int.from_bytes(data[:4], "big") > len(data):
+        raise HeifFormatError("Truncated 'Exif' item")
+    return data[4 + int.from_bytes(data[:4], "big"):]
+
+
+def _box(box_type: str, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type.encode("latin-1")) + payload
+
+
+def _full_box(box_type: str, version: int, flags: int, payload: bytes) -> bytes:
+    return _box(box_type, bytes([version]) + flags.to_bytes(3, "big") + payload)
+
+
+def _build_heif(
+    brand: bytes,
+    primary_id: int,
+    items: List[Tuple[int, str, bool, List[HeifProperty], bytes]],
+    references: List[Tuple[str, int, List[int]]] = (),
+) -> bytes:
+    """
+    Write a minimal HEIF file
+
+    Args:
+        brand: Major brand, e.g. b"heic"
+        primary_id: Item ID of the primary image
+        items: (item_id, item_type, hidden, properties, data) per item
+        references: (reference_type, from_item_id, to_item_ids) per iref entry
+    """
+    ftyp = _box("ftyp", brand + b"\x00\x00\x00\x00" + b"mif1" + brand)
+
+    hdlr = _full_box("hdlr", 0, 0, b"\x00" * 4 + b"pict" + b"\x00" * 12 + b"\x00")
+    pitm = _full_box("pitm", 0, 0, struct.pack(">H", primary_id))
+    iinf = _full_box("iinf", 0, 0, struct.pack(">H", len(items)) + b"".join(
+        _full_box("infe", 2, 1 if hidden else 0, struct.pack(">HH", item_id, 0) + item_type.encode("latin-1") + b"\x00")
+        for item_id, item_type, hidden, _, _ in items
+    ))
+
+    iref = b""
+    if references:
+        iref = _full_box("iref", 0, 0, b"".join(
+            _box(ref_type, struct.pack(">HH", from_id, len(to_ids)) + b"".join(struct.pack(">H", to_id) for to_id in to_ids))
+            for ref_type, from_id, to_ids in references
+        ))
+
+    # Identical properties (e.g. the hvcC of every grid tile) are stored once
+    unique: Dict[Tuple[str, bytes], int] = {}
+    associations = b""
+    for item_id, _, _, properties, _ in items:
+        indexes = []
+        for prop in properties:
+            index = unique.setdefault((prop.box_type, prop.payload), len(unique) + 1)
+            indexes.append((0x8000 if prop.essential else 0) | index)
+        associations += struct.pack(">HB", item_id, len(indexes)) + b"".join(struct.pack(">H", i) for i in indexes)
+    ipco = _box("ipco", b"".join(_box(box_type, payload) for box_type, payload in unique))
+    # flags=1: 15-bit property indexes
+    ipma = _full_box("ipma", 0, 1, struct.pack(">I", len(items)) + associations)
+    iprp = _box("iprp", ipco + ipma)
+
+    def meta(mdat_offset: int) -> bytes:
+        # offset_size=4, length_size=4, base_offset_size=0; one extent per item
+        locations = b""
+        offset = mdat_offset
+        for item_id, _, _, _, data in items:
+            locations += struct.pack(">HHHII", item_id, 0, 1, offset, len(data))
+            offset += len(data)
+        iloc = _full_box("iloc", 0, 0, b"\x44\x00" + struct.pack(">H", len(items)) + locations)
+        return _full_box("meta", 0, 0, hdlr + pitm + iinf + iloc + iref + iprp)
+
+    mdat_offset = len(ftyp) + len(meta(0)) + 8
+    return ftyp + meta(mdat_offset) + _box("mdat", b"".join(data for *_, data in items))
+
+
+def build_single_image_heif(item_type: str, properties: List[HeifProperty], data: bytes) -> bytes:
+    """
+    Wrap the coded data of one image item in a minimal standalone HEIF file
+
+    Used to hand a thumbnail or grid tile to a decoder that only decodes
+    the primary image of a file.
+
+    Args:
+        item_type: Item type of the image, e.g. "hvc1" or "av01"
+        properties: Properties to associate with the image (hvcC, ispe, colr...)
+        data: Coded image data
+    """
+    brand = b"avif" if item_type == "av01" else b"heic"
+    return _build_heif(brand, 1, [(1, item_type, False, properties, data)])
+
+
+def build_grid_heif(
+    tiles: List[Tuple[str, List[HeifProperty], bytes]],
+    rows: int,
+    columns: int,
+    size: Tuple[int, int],
+) -> bytes:
+    """
+    Assemble coded tiles into a HEIF file whose primary image is a grid
+
+    Args:
+        tiles: (item_type, properties, data) per tile, in row-major order
+        rows: Number of tile rows
+        columns: Number of tile columns
+        size: Width and height of the grid image, at most the tiled area
+    """
+    if len(tiles) != rows * columns:
+        raise ValueError(f"Expected {rows * columns} tiles, got {len(tiles)}")
+
+    width, height = size
+    large = width > 0xFFFF or height > 0xFFFF
+    grid_data = bytes([0, 1 if large else 0, rows - 1, columns - 1]) + struct.pack(
+        ">II" if large else ">HH", width, height
+    )
+    ispe = HeifProperty("ispe", b"\x00" * 4 + struct.pack(">II", width, height), False)
+
+    items = [(1, "grid", False, [ispe], grid_data)]
+    for index, (item_type, properties, data) in enumerate(tiles):
+        items.append((index + 2, item_type, True, properties, data))
+
+    brand = b"avif" if tiles[0][0] == "av01" else b"heic"
+    return _build_heif(brand, 1, items, [("dimg", 1, [item_id for item_id, *_ in items[1:]])])
+
+
+def extract_image(
+    source: Union[Path, str, bytes, bytearray, memoryview],
+    header: HeifHeader,
+    item_id: int,
+) -> bytes:
+    """Copy a single coded image item out of a HEIF file as a standalone HEIF file"""
+    item = header.items[item_id]
+    return build_single_image_heif(item.item_type, item.properties, read_item_data(source, header, item))
@@ -0,0 +1,262 @@
+"""
+Asynchronous conversion jobs and the stores that keep their state.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+# Job states, in the order a successful job passes through them
+JOB_QUEUED = "queued"
+JOB_DECODING = "decoding"
+JOB_TRANSFORMING = "transforming"
+JOB_ENCODING = "encoding"
+JOB_PERSISTING = "persisting"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+TERMINAL_STATES = {JOB_DONE, JOB_FAILED}
+
+# Error recorded for jobs whose worker stopped without finishing them
+STALE_JOB_ERROR = "The server stopped while the job was running. Please resubmit the file"
+
+
+@dataclass
+class Job:
+    """State of an asynchronous conversion job"""
+    id: str
+    filename: str
+    status: str = JOB_QUEUED
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    # Timestamp at which each state was entered
+    stages: Dict[str, float] = field(default_factory=dict)
+    original_size: Optional[int] = None
+    converted_size: Optional[int] = None
+    conversion_time: Optional[float] = None
+    quality: Optional[int] = None
+    encode_passes: Optional[int] = None
+    download_url: Optional[str] = None
+    outputs: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @classmethod
+    def new(cls, filename: str) -> "Job":
+        job = cls(id=uuid.uuid4().hex, filename=filename)
+        job.stages[JOB_QUEUED] = job.created_at
+        return job
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        """Seconds spent in each state that has been left"""
+        ordered = sorted(self.stages.items(), key=lambda item: item[1])
+        return {
+            stage: round(ordered[i + 1][1] - started, 6)
+            for i, (stage, started) in enumerate(ordered[:-1])
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class JobStore:
+    """Interface for job state storage"""
+
+    def create(self, job: Job) -> None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields: Any) -> Optional[Job]:
+        raise NotImplementedError
+
+    def delete_older_than(self, cutoff: float) -> int:
+        raise NotImplementedError
+
+    def heartbeat(self, job_ids: Iterable[str]) -> None:
+        """Record that the given jobs are still being worked on"""
+        raise NotImplementedError
+
+    def fail_stale(self, cutoff: float) -> int:
+        """
+        Fail unfinished jobs whose last heartbeat is older than cutoff
+
+        A job whose worker crashed or was restarted would otherwise stay
+        unfinished until it expires.
+
+        Returns:
+            Number of jobs failed
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    @staticmethod
+    def _apply(job: Job, fields: Dict[str, Any]) -> Job:
+        now = time.time()
+        status = fields.get("status")
+        if status is not None and status != job.status:
+            job.stages[status] = fields.pop("stage_time", now)
+        fields.pop("stage_time", None)
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.updated_at = now
+        return job
+
+
+class InMemoryJobStore(JobStore):
+    """Job store local to one process"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._heartbeats: Dict[str, float] = {}
+
+    def create(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        self._heartbeats[job.id] = job.updated_at
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        return Job(**job.to_dict()) if job is not None else None
+
+    def update(self, job_id: str, **fields: Any) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        self._apply(job, fields)
+        if job.status in TERMINAL_STATES:
+            self._heartbeats.pop(job_id, None)
+        return job
+
+    def delete_older_than(self, cutoff: float) -> int:
+        expired = [job_id for job_id, job in self._jobs.items() if job.updated_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+            self._heartbeats.pop(job_id, None)
+        return len(expired)
+
+    def heartbeat(self, job_ids: Iterable[str]) -> None:
+        now = time.time()
+        for job_id in job_ids:
+            if job_id in self._heartbeats:
+                self._heartbeats[job_id] = now
+
+    def fail_stale(self, cutoff: float) -> int:
+        stale = [job_id for job_id, beat in self._heartbeats.items() if beat < cutoff]
+        for job_id in stale:
+            self.update(job_id, status=JOB_FAILED, error=STALE_JOB_ERROR)
+        return len(stale)
+
+
+class SQLiteJobStore(JobStore):
+    """Job store in a SQLite database, shared by workers and kept across restarts"""
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " updated_at REAL NOT NULL,"
+            " heartbeat_at REAL,"
+            " data TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "heartbeat_at" not in columns:
+            # Databases from before heartbeats: unfinished jobs count from their last update
+            self._db.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+            self._db.execute("UPDATE jobs SET heartbeat_at = updated_at")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_heartbeat_at ON jobs (heartbeat_at)")
+
+    def create(self, job: Job) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, updated_at, heartbeat_at, data) VALUES (?, ?, ?, ?)",
+                (job.id, job.updated_at, job.updated_at, json.dumps(job.to_dict())),
+            )
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(**json.loads(row[0])) if row else None
+
+    def update(self, job_id: str, **fields: Any) -> Optional[Job]:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                job = self._apply(Job(**json.loads(row[0])), fields)
+                self._db.execute(
+                    "UPDATE jobs SET updated_at = ?, data = ?,"
+                    " heartbeat_at = CASE WHEN ? THEN NULL ELSE heartbeat_at END WHERE id = ?",
+                    (job.updated_at, json.dumps(job.to_dict()), job.status in TERMINAL_STATES, job_id),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return job
+
+    def delete_older_than(self, cutoff: float) -> int:
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM jobs WHERE updated_at < ?", (cutoff,))
+        return cursor.rowcount
+
+    def heartbeat(self, job_ids: Iterable[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND heartbeat_at IS NOT NULL",
+                [(now, job_id) for job_id in job_ids],
+            )
+
+    def fail_stale(self, cutoff: float) -> int:
+        failed = 0
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute("SELECT id, data FROM jobs WHERE heartbeat_at < ?", (cutoff,)).fetchall()
+                for job_id, data in rows:
+                    job = Job(**json.loads(data))
+                    if job.status not in TERMINAL_STATES:
+                        self._apply(job, {"status": JOB_FAILED, "error": STALE_JOB_ERROR})
+                        failed += 1
+                    self._db.execute(
+                        "UPDATE jobs SET updated_at = ?, heartbeat_at = NULL, data = ? WHERE id = ?",
+                        (job.updated_at, json.dumps(job.to_dict()), job_id),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return failed
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def create_job_store(kind: str, path: Optional[Path] = None) -> JobStore:
+    """Create the job store selected in settings ("memory" or "sqlite")"""
+    if kind == "memory":
+        return InMemoryJobStore()
+    if kind == "sqlite":
+        return SQLiteJobStore(path)
+    raise ValueError(f"Unknown job store '{kind}'")
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> bytes:
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
@@ -0,0 +1,79 @@
+"""
+Leader election between server workers through a file lock.
+
+When several server processes share the same storage, housekeeping that
+scans all of it should run in only one of them. Every worker tries to take
+an exclusive lock on the same file; the one that holds it is the leader.
+The operating system drops the lock when its holder exits, even if it is
+killed, so another worker takes over the next time it tries.
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    """
+    Non-blocking exclusive lock on a file
+
+    Args:
+        path: Lock file shared by all workers; created if missing
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """Take the lock if no other process holds it; returns whether this process holds it"""
+        if self._fd is not None:
+            return True
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            logger.error(f"Cannot open lock file {self.path}: {str(e)}")
+            return False
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+
+        # Record the holder, for whoever inspects the lock file
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
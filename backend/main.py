@@ -1,21 +1,43 @@
 import time
+import math
 import shutil
 import asyncio
+import hashlib
+import json
 from pathlib import Path
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, BackgroundTasks, Depends, Query
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, BackgroundTasks, Depends, Header, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.openapi.docs import get_swagger_ui_html
+from starlette.background import BackgroundTask
 from starlette.responses import RedirectResponse
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from datetime import datetime
 import logging
 
 # Import local modules
 from config import settings
-from models import ConversionOptions, ConversionResponse, ErrorResponse, HealthResponse
-from utils import convert_heic_to_jpg, generate_unique_filename, clean_temp_files, is_valid_heic_file
+from models import ConversionOptions, ConversionResponse, ConvertedOutput, ErrorResponse, HealthResponse, CacheStatsResponse, JobResponse, ProbeResponse, ProbeResult
+from utils import TargetSizeError, clean_temp_files, content_addressed_filename, convert_heic, convert_heic_bytes, generate_unique_filename, probe_heic_file
+from downloads import DownloadResponse, content_disposition, is_content_addressed, stat_and_etag
+from formats import FORMATS, format_for_extension, negotiate_format, parse_formats
+from executor import ConversionExecutor, ExecutorBusyError, ConversionTimeoutError
+from admission import MemoryBudget, estimate_cost, estimate_peak_bytes, estimate_streaming_peak_bytes
+from scheduler import FairScheduler, RateLimitedError, Ticket
+import decoders
+from heif_container import HeifHeader
+from metadata import describe_heif
+from streaming import band_height, can_stream
+from transforms import plan_transforms
+from cache import CachedOutput, CacheEntry, ConversionCache
+from batch import ZipStream, ndjson_line, unique_name
+from jobs import Job, JOB_DECODING, JOB_DONE, JOB_ENCODING, JOB_FAILED, JOB_PERSISTING, JOB_TRANSFORMING, STALE_JOB_ERROR, TERMINAL_STATES, create_job_store, sse_event
+from expiry import ExpiryIndex
+from leader import LeaderLock
+from storage import LocalStorage, create_storage
+from metrics import CONTENT_TYPE, MetricsMiddleware, Registry, observe_stages
+from uploads import UploadSizeLimitMiddleware, UploadTooLargeError, read_upload, spool_upload
 
 # Configure logging
 logging.basicConfig(
@@ -33,6 +55,168 @@ app = FastAPI(
     redoc_url=None,
 )
 
+# Worker pool for CPU-bound conversion work
+conversion_executor = ConversionExecutor(
+    max_workers=settings.CONVERSION_WORKERS,
+    max_queue_size=settings.CONVERSION_QUEUE_SIZE,
+    job_timeout=settings.CONVERSION_TIMEOUT_SECONDS,
+    initializer=decoders.configure,
+    initargs=(settings.DECODER_BACKENDS, {}),
+)
+
+# Fair share of the workers between clients; the executor's own queue stays empty
+scheduler = FairScheduler(
+    capacity=conversion_executor.max_workers,
+    max_waiting=settings.CONVERSION_QUEUE_SIZE,
+    rate=settings.SCHEDULER_RATE_PER_SECOND,
+    burst=settings.SCHEDULER_BURST,
+    weights=settings.SCHEDULER_CLIENT_WEIGHTS,
+    aging_seconds=settings.SCHEDULER_AGING_SECONDS,
+)
+
+# Decoded-memory budget shared by running conversions
+memory_budget = MemoryBudget(
+    limit_bytes=settings.MEMORY_BUDGET_BYTES,
+    max_wait_seconds=settings.MEMORY_ADMISSION_TIMEOUT_SECONDS,
+)
+
+# Converted files, stored by name
+storage = create_storage(
+    settings.STORAGE_BACKEND,
+    settings.STORAGE_DIR,
+    shard_depth=settings.STORAGE_SHARD_DEPTH,
+    bucket=settings.OBJECT_STORE_BUCKET,
+    prefix=settings.OBJECT_STORE_PREFIX,
+    endpoint_url=settings.OBJECT_STORE_ENDPOINT_URL,
+)
+
+# Uploads are spooled locally, where the conversion workers can read them
+uploads = LocalStorage(settings.UPLOAD_DIR, settings.STORAGE_SHARD_DEPTH)
+
+# Expiry times of the converted files and of the spooled uploads, which share the disk budget
+upload_budget = int(settings.TEMP_DIR_MAX_BYTES * settings.TEMP_DIR_UPLOAD_FRACTION)
+temp_files = ExpiryIndex(
+    storage=storage,
+    retention_seconds=settings.FILE_RETENTION_MINUTES * 60,
+    max_bytes=settings.TEMP_DIR_MAX_BYTES - upload_budget,
+)
+upload_files = ExpiryIndex(
+    storage=uploads,
+    retention_seconds=settings.FILE_RETENTION_MINUTES * 60,
+    max_bytes=upload_budget,
+)
+
+# Elects the one server worker that scans the whole storage
+cleanup_leader = LeaderLock(settings.CLEANUP_LOCK_PATH)
+
+# Cache of finished conversions keyed by input hash and options
+conversion_cache = ConversionCache(
+    storage=storage,
+    max_bytes=settings.CACHE_MAX_BYTES,
+    ttl_seconds=settings.CACHE_TTL_SECONDS,
+    on_delete=temp_files.discard,
+)
+
+# State of asynchronous conversion jobs
+job_store = create_job_store(settings.JOB_STORE, settings.JOB_DB_PATH)
+
+# Running job tasks by job ID, referenced so they are not garbage collected
+job_tasks = {}
+
+# Metrics served at /metrics
+metrics = Registry()
+
+# Stage names reported by conversion workers, as recorded in metrics
+METRIC_STAGES = {
+    JOB_DECODING: "decode",
+    JOB_TRANSFORMING: "transform",
+    JOB_ENCODING: "encode",
+    JOB_PERSISTING: "persist",
+}
+stage_seconds = metrics.histogram(
+    "heic_stage_duration_seconds",
+    "Time spent in each stage of handling a conversion",
+    labels=("stage",),
+)
+http_requests = metrics.counter(
+    "heic_http_requests_total", "Requests by endpoint and status code", labels=("endpoint", "status")
+)
+http_request_seconds = metrics.histogram(
+    "heic_http_request_duration_seconds", "Request duration by endpoint", labels=("endpoint",)
+)
+input_bytes = metrics.counter("heic_input_bytes_total", "Bytes of HEIC uploads received")
+output_bytes = metrics.counter(
+    "heic_output_bytes_total", "Bytes of images produced by conversions", labels=("format",)
+)
+download_bytes = metrics.counter("heic_download_bytes_total", "Bytes of converted files downloaded")
+batch_files = metrics.counter("heic_batch_files_total", "Files in batch conversions by result", labels=("status",))
+probe_seconds = metrics.histogram(
+    "heic_probe_duration_seconds",
+    "Time spent reading the metadata of a probed file",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1),
+)
+metrics.counter_callback(
+    "heic_cache_requests_total",
+    "Conversion cache lookups by outcome",
+    lambda: {
+        ("hit",): conversion_cache.hits,
+        ("coalesced",): conversion_cache.coalesced,
+        ("miss",): conversion_cache.misses,
+    },
+    labels=("outcome",),
+)
+metrics.counter_callback(
+    "heic_cache_evictions_total", "Cached conversions evicted over the byte budget", lambda: conversion_cache.evictions
+)
+metrics.gauge_callback("heic_cache_bytes", "Size of cached conversions", lambda: conversion_cache.total_bytes)
+metrics.gauge_callback(
+    "heic_executor_queue_depth", "Conversions waiting for a free worker", lambda: conversion_executor.queue_depth
+)
+metrics.gauge_callback(
+    "heic_executor_pending", "Conversions running or waiting for a worker", lambda: conversion_executor.pending
+)
+metrics.gauge_callback("heic_scheduler_waiting", "Conversions waiting for their turn", lambda: scheduler.waiting)
+metrics.gauge_callback("heic_scheduler_running", "Conversions started by the scheduler", lambda: scheduler.running)
+metrics.counter_callback(
+    "heic_scheduler_rejections_total", "Conversions rejected by rate limits or a full queue", lambda: scheduler.rejected
+)
+metrics.gauge_callback(
+    "heic_memory_reserved_bytes", "Estimated peak memory of running conversions", lambda: memory_budget.reserved_bytes
+)
+metrics.gauge_callback("heic_memory_waiting", "Conversions waiting for memory", lambda: memory_budget.waiting)
+metrics.counter_callback(
+    "heic_memory_rejections_total", "Conversions rejected after waiting too long for memory", lambda: memory_budget.rejected
+)
+metrics.gauge_callback(
+    "heic_temp_dir_bytes",
+    "Size of tracked converted files and uploads",
+    lambda: temp_files.total_bytes + upload_files.total_bytes,
+)
+metrics.gauge_callback(
+    "heic_temp_dir_files",
+    "Number of tracked converted files and uploads",
+    lambda: len(temp_files) + len(upload_files),
+)
+
+# Reject oversized uploads before their body is parsed
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    limits={
+        f"{settings.API_V1_STR}/convert": settings.MAX_FILE_SIZE + settings.UPLOAD_OVERHEAD_BYTES,
+        f"{settings.API_V1_STR}/convert/batch": settings.MAX_BATCH_SIZE + settings.UPLOAD_OVERHEAD_BYTES,
+        f"{settings.API_V1_STR}/probe": settings.MAX_FILE_SIZE + settings.UPLOAD_OVERHEAD_BYTES,
+        f"{settings.API_V1_STR}/probe/batch": settings.MAX_BATCH_SIZE + settings.UPLOAD_OVERHEAD_BYTES,
+        f"{settings.API_V1_STR}/jobs": settings.MAX_FILE_SIZE + settings.UPLOAD_OVERHEAD_BYTES,
+    },
+    file_limits={
+        f"{settings.API_V1_STR}/convert": settings.MAX_FILE_SIZE,
+        f"{settings.API_V1_STR}/probe": settings.MAX_FILE_SIZE,
+        f"{settings.API_V1_STR}/probe/batch": settings.MAX_BATCH_SIZE,
+        f"{settings.API_V1_STR}/jobs": settings.MAX_FILE_SIZE,
+        f"{settings.API_V1_STR}/convert/batch": settings.MAX_BATCH_SIZE,
+    },
+)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -40,21 +224,225 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Original-Size", "X-Converted-Size", "X-Conversion-Time", "X-Quality", "X-Encode-Passes", "ETag", "Content-Range", "Accept-Ranges"],
 )
 
+# Count and time every request, including those rejected by the middleware above
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, requests=http_requests, durations=http_request_seconds)
+
+async def sweep_stored_files(rebuild: bool = False) -> None:
+    """
+    Delete expired files no matter which worker wrote them
+
+    With rebuild, also track the remaining files, so files written before
+    a restart or by a worker that exited still expire. Scans the whole
+    storage, so only the cleanup leader runs it.
+    """
+    retention = settings.FILE_RETENTION_MINUTES
+    for backend, index in ((storage, temp_files), (uploads, upload_files)):
+        removed = await asyncio.to_thread(clean_temp_files, backend, retention)
+        if removed > 0:
+            logger.info(f"Cleaned up {removed} expired files found in storage")
+        if rebuild:
+            tracked = await asyncio.to_thread(index.rebuild)
+            if tracked > 0:
+                logger.info(f"Tracking {tracked} existing files")
+
 # Background task to clean up old files
 async def cleanup_old_files():
+    last_sweep = time.time()
     while True:
         try:
             if settings.AUTO_CLEANUP:
-                deleted_count = clean_temp_files(settings.FILE_RETENTION_MINUTES)
-                if deleted_count > 0:
-                    logger.info(f"Cleaned up {deleted_count} old files")
+                # Every worker expires the files it wrote itself
+                removed = await asyncio.to_thread(temp_files.purge)
+                await asyncio.to_thread(upload_files.purge)
+                if removed["expired"] > 0:
+                    logger.info(f"Cleaned up {removed['expired']} old files")
+                if removed["evicted"] > 0:
+                    logger.info(f"Evicted {removed['evicted']} files over the temp directory budget")
+
+                # Take over the full scans when the leader has exited
+                if not cleanup_leader.held and await asyncio.to_thread(cleanup_leader.try_acquire):
+                    logger.info("Became the cleanup leader")
+                    await sweep_stored_files(rebuild=True)
+                    last_sweep = time.time()
+                elif cleanup_leader.held and time.time() - last_sweep >= settings.CLEANUP_SWEEP_INTERVAL_SECONDS:
+                    await sweep_stored_files()
+                    last_sweep = time.time()
+
+                # Job records expire together with their output files; a
+                # shared job store is cleaned by the leader alone
+                if cleanup_leader.held or settings.JOB_STORE == "memory":
+                    await asyncio.to_thread(
+                        job_store.delete_older_than, time.time() - settings.FILE_RETENTION_MINUTES * 60
+                    )
         except Exception as e:
             logger.error(f"Error during cleanup: {str(e)}")
 
-        # Sleep for 10 minutes
-        await asyncio.sleep(600)
+        await asyncio.sleep(settings.CLEANUP_INTERVAL_SECONDS)
+
+async def heartbeat_jobs():
+    """Keep this worker's running jobs alive in the job store, and fail those of workers that died"""
+    while True:
+        try:
+            await asyncio.to_thread(job_store.heartbeat, list(job_tasks))
+            failed = await asyncio.to_thread(job_store.fail_stale, time.time() - settings.JOB_STALE_SECONDS)
+            if failed:
+                logger.warning(f"Failed {failed} jobs left unfinished by a stopped worker")
+        except Exception as e:
+            logger.error(f"Error during job heartbeat: {str(e)}")
+
+        await asyncio.sleep(settings.JOB_HEARTBEAT_SECONDS)
+
+def remove_temp_file(path: Path) -> None:
+    """Delete a spooled upload and stop tracking its expiry"""
+    path.unlink(missing_ok=True)
+    upload_files.discard(path.name)
+
+def estimate_memory(header: HeifHeader, options: ConversionOptions) -> int:
+    """Estimate the peak memory of converting an image with the given options"""
+    if can_stream(
+        header,
+        options.formats,
+        options.resize,
+        options.width,
+        options.height,
+        options.maintain_aspect_ratio,
+        options.rotate,
+        options.max_bytes,
+    ):
+        return estimate_streaming_peak_bytes(header, band_height(header))
+
+    plan = plan_transforms(
+        header.size,
+        options.rotate,
+        options.resize,
+        options.width,
+        options.height,
+        options.maintain_aspect_ratio,
+    )
+    return estimate_peak_bytes(header, plan)
+
+def client_key(request: Request) -> str:
+    """Identify the client a conversion is scheduled for: its API key, or its IP address"""
+    api_key = request.headers.get(settings.SCHEDULER_CLIENT_HEADER)
+    if api_key:
+        return api_key
+    return request.client.host if request.client else "unknown"
+
+def conversion_ticket(request: Request, header: HeifHeader, options: ConversionOptions) -> Ticket:
+    """Scheduler ticket for converting an image with the given options"""
+    plan = plan_transforms(
+        header.size,
+        options.rotate,
+        options.resize,
+        options.width,
+        options.height,
+        options.maintain_aspect_ratio,
+    )
+    return Ticket(client_key(request), estimate_cost(header, plan, options.formats, options.max_bytes))
+
+async def run_conversion(fn, *args, ticket: Ticket, on_progress=None, peak_bytes: int = 0, **kwargs):
+    """
+    Run a conversion on the executor, recording the duration of each stage
+
+    The conversion first waits for its turn in the scheduler, recorded as
+    the "queue" stage, then until peak_bytes fits in the memory budget,
+    recorded as the "admission" stage. ticket.queue_wait covers both. The
+    wait for an executor process to pick it up is the "dispatch" stage.
+
+    Raises:
+        RateLimitedError: If the ticket's client is over its rate limit
+        ExecutorBusyError: If the scheduler's queue is full or memory ran out
+    """
+    stages = []
+
+    def record(stage: str, timestamp: float):
+        stages.append((METRIC_STAGES.get(stage, stage), timestamp))
+        if on_progress is not None:
+            on_progress(stage, timestamp)
+
+    queued = time.time()
+    async with scheduler.turn(ticket):
+        waiting = time.time()
+        stage_seconds.observe(waiting - queued, stage="queue")
+        async with memory_budget.reserve(peak_bytes):
+            submitted = ticket.started = time.time()
+            stage_seconds.observe(submitted - waiting, stage="admission")
+            try:
+                return await conversion_executor.run(fn, *args, on_progress=record, **kwargs)
+            finally:
+                observe_stages(stage_seconds, submitted, stages, time.time(), queue_stage="dispatch")
+
+async def convert_file(
+    input_path: Path,
+    content_digest: str,
+    options: ConversionOptions,
+    ticket: Ticket,
+    on_progress=None,
+    peak_bytes: int = 0,
+) -> Tuple[CacheEntry, bool]:
+    """
+    Convert a spooled upload to a JPG in the temp directory
+
+    peak_bytes is the estimated memory the conversion needs; a cache hit
+    skips scheduling and admission entirely.
+
+    Returns:
+        Tuple of (entry, cached) where cached is True if an identical
+        conversion was reused
+    """
+    async def convert() -> CacheEntry:
+        original_size, conversion_time, outputs = await run_conversion(
+            convert_heic,
+            input_path=input_path,
+            storage=storage,
+            ticket=ticket,
+            on_progress=on_progress,
+            peak_bytes=peak_bytes,
+            **options.model_dump(),
+        )
+        for output in outputs:
+            temp_files.add(output["filename"], output["size"])
+            output_bytes.inc(output["size"], format=output["format"])
+        return CacheEntry(
+            [CachedOutput(**output) for output in outputs],
+            original_size,
+            conversion_time,
+            queue_wait=ticket.queue_wait,
+        )
+
+    if not settings.CACHE_ENABLED:
+        return await convert(), False
+
+    cache_key = ConversionCache.make_key(content_digest, options.model_dump())
+    return await conversion_cache.get_or_create(cache_key, convert)
+
+def resolve_formats(output_format: Optional[str], accept: Optional[str]) -> List[str]:
+    """Output formats from the format option, or negotiated from the Accept header"""
+    try:
+        return parse_formats(output_format) if output_format else [negotiate_format(accept)]
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+def converted_outputs(stem: str, entry: CacheEntry) -> List[ConvertedOutput]:
+    """Describe every output file of a conversion"""
+    return [
+        ConvertedOutput(
+            format=output.format,
+            filename=f"{stem}{FORMATS[output.format].extension}",
+            converted_size=output.size,
+            download_url=f"{settings.API_V1_STR}/download/{output.filename}",
+            quality=output.quality,
+            encode_passes=output.encode_passes,
+        )
+        for output in entry.outputs
+    ]
 
 # Custom OpenAPI docs
 @app.get("/docs", include_in_schema=False)
@@ -79,48 +467,140 @@ async def health_check():
         "timestamp": datetime.now(),
     }
 
+@app.get("/api/cache/stats", response_model=CacheStatsResponse, tags=["System"])
+async def cache_stats():
+    """Get conversion cache statistics"""
+    return conversion_cache.stats()
+
+def probe_upload(upload: UploadFile) -> ProbeResponse:
+    """
+    Describe an upload from its container metadata and EXIF
+
+    Reads only those parts of the spooled upload; no pixels are decoded.
+
+    Raises:
+        ValueError: If the upload is not a valid HEIC/HEIF file
+    """
+    file_ext = Path(upload.filename).suffix.lower()
+    if file_ext not in settings.ALLOWED_EXTENSIONS:
+        raise ValueError(f"Unsupported file format. Allowed formats: {', '.join(settings.ALLOWED_EXTENSIONS)}")
+
+    with probe_seconds.time():
+        header = probe_heic_file(upload.file)
+        if header is None:
+            raise ValueError("Invalid HEIC/HEIF file format")
+        return ProbeResponse(filename=upload.filename, **describe_heif(upload.file, header))
+
+@app.post(
+    f"{settings.API_V1_STR}/probe",
+    response_model=ProbeResponse,
+    responses={
+        400: {"model": ErrorResponse},
+        413: {"model": ErrorResponse},
+        415: {"model": ErrorResponse},
+    },
+    tags=["Conversion"],
+)
+async def probe_image(file: UploadFile = File(...)):
+    """
+    Describe a HEIC/HEIF image without converting it
+
+    Reports dimensions, rotation, bit depth, alpha, the number of images
+    and EXIF capture metadata, read from the file's metadata alone.
+    """
+    if Path(file.filename).suffix.lower() not in settings.ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported file format. Allowed formats: {', '.join(settings.ALLOWED_EXTENSIONS)}"
+        )
+
+    try:
+        return probe_upload(file)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+
+@app.post(
+    f"{settings.API_V1_STR}/probe/batch",
+    response_model=List[ProbeResult],
+    responses={
+        400: {"model": ErrorResponse},
+        413: {"model": ErrorResponse},
+    },
+    tags=["Conversion"],
+)
+async def probe_batch(files: List[UploadFile] = File(...)):
+    """
+    Describe many HEIC/HEIF images without converting them
+
+    Results are in upload order. A file that cannot be read is reported in
+    its result and does not fail the batch.
+    """
+    if len(files) > settings.MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files. Maximum is {settings.MAX_BATCH_FILES} per batch"
+        )
+
+    results = []
+    for index, upload in enumerate(files):
+        try:
+            info = probe_upload(upload)
+            results.append(ProbeResult(index=index, filename=upload.filename, status="ok", info=info))
+        except ValueError as e:
+            results.append(ProbeResult(index=index, filename=upload.filename, status="error", detail=str(e)))
+    return results
+
 @app.post(
     f"{settings.API_V1_STR}/convert",
     response_model=ConversionResponse,
     responses={
+        200: {
+            "content": {fmt.media_type: {} for fmt in FORMATS.values()},
+            "description": "Conversion details, or the converted image itself when inline=true",
+        },
         400: {"model": ErrorResponse},
         413: {"model": ErrorResponse},
         415: {"model": ErrorResponse},
+        422: {"model": ErrorResponse},
+        429: {"model": ErrorResponse},
         500: {"model": ErrorResponse},
+        503: {"model": ErrorResponse},
+        504: {"model": ErrorResponse},
     },
     tags=["Conversion"],
 )
 async def convert_image(
+    request: Request,
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    quality: Optional[int] = Form(95, ge=1, le=100),
+    quality: Optional[int] = Form(None, ge=1, le=100),
     resize: Optional[bool] = Form(False),
     width: Optional[int] = Form(None, ge=1),
     height: Optional[int] = Form(None, ge=1),
     maintain_aspect_ratio: Optional[bool] = Form(True),
     rotate: Optional[int] = Form(None),
+    max_bytes: Optional[int] = Form(None, ge=1),
+    output_format: Optional[str] = Form(
+        None, alias="format", description="Comma-separated output formats (jpeg, webp, avif, png); negotiated from Accept if not given"
+    ),
+    accept: Optional[str] = Header(None),
+    inline: bool = Query(False, description="Return the image in the response body instead of a download URL"),
 ):
-    """Convert HEIC/HEIF image to JPG format"""
-    # Validate file size
-    file_size = 0
-    chunk_size = 1024 * 1024  # 1MB
-    content = b""
-
-    while True:
-        chunk = await file.read(chunk_size)
-        if not chunk:
-            break
-        content += chunk
-        file_size += len(chunk)
-
-        if file_size > settings.MAX_FILE_SIZE:
-            raise HTTPException(
-                status_code=413,
-                detail=f"File too large. Maximum size is {settings.MAX_FILE_SIZE / (1024 * 1024):.1f} MB"
-            )
-
-    # Reset file position
-    await file.seek(0)
+    """Convert HEIC/HEIF image to JPG, WebP, AVIF or PNG format"""
+    options = ConversionOptions(
+        quality=quality,
+        resize=resize,
+        width=width,
+        height=height,
+        maintain_aspect_ratio=maintain_aspect_ratio,
+        rotate=rotate,
+        max_bytes=max_bytes,
+        formats=resolve_formats(output_format, accept),
+    )
+    input_path = None
 
     # Validate file extension
     file_ext = Path(file.filename).suffix.lower()
@@ -130,94 +610,659 @@ async def convert_image(
             detail=f"Unsupported file format. Allowed formats: {', '.join(settings.ALLOWED_EXTENSIONS)}"
         )
 
+    if inline and len(options.formats) > 1:
+        raise HTTPException(
+            status_code=400,
+            detail="Inline conversions return a single format"
+        )
+
     try:
-        # Generate unique filenames
-        input_filename = generate_unique_filename(file_ext)
-        output_filename = generate_unique_filename(".jpg")
+        # Validate from the upload's metadata, as /probe does, before copying
+        # it anywhere; the header also sizes the job for admission
+        with stage_seconds.time(stage="validate"):
+            header = probe_heic_file(file.file)
+        if header is None:
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid HEIC/HEIF file format"
+            )
+        ticket = conversion_ticket(request, header, options)
+
+        if inline:
+            # Convert entirely in memory and return the image directly
+            try:
+                with stage_seconds.time(stage="receive"):
+                    content = await read_upload(file, settings.MAX_FILE_SIZE)
+            except UploadTooLargeError as e:
+                raise HTTPException(
+                    status_code=413,
+                    detail=str(e)
+                )
+            input_bytes.inc(len(content))
 
-        input_path = settings.TEMP_DIR / input_filename
-        output_path = settings.TEMP_DIR / output_filename
+            outputs, conversion_time = await run_conversion(
+                convert_heic_bytes,
+                content,
+                ticket=ticket,
+                peak_bytes=estimate_memory(header, options),
+                **options.model_dump(),
+            )
+            output = outputs[0]
+            output_bytes.inc(len(output["data"]), format=output["format"])
+            fmt = FORMATS[output["format"]]
 
-        # Save uploaded file
-        with open(input_path, "wb") as buffer:
-            buffer.write(content)
+            headers = {
+                "Content-Disposition": content_disposition("inline", f"{Path(file.filename).stem}{fmt.extension}"),
+                "X-Original-Size": str(len(content)),
+                "X-Converted-Size": str(len(output["data"])),
+                "X-Conversion-Time": f"{conversion_time:.6f}",
+                "X-Queue-Wait-Time": f"{ticket.queue_wait:.6f}",
+                "X-Encode-Passes": str(output["encode_passes"]),
+                "Vary": "Accept",
+            }
+            if output["quality"] is not None:
+                headers["X-Quality"] = str(output["quality"])
+            return Response(content=output["data"], media_type=fmt.media_type, headers=headers)
 
-        # Validate HEIC file
-        if not is_valid_heic_file(input_path):
+        # Generate unique filename for the upload
+        input_filename = generate_unique_filename(file_ext)
+        input_path = await asyncio.to_thread(uploads.prepare, input_filename)
+
+        # Stream uploaded file to disk, enforcing the size limit
+        hasher = hashlib.sha256()
+        try:
+            with stage_seconds.time(stage="receive"):
+                input_size = await spool_upload(
+                    file,
+                    input_path,
+                    max_size=settings.MAX_FILE_SIZE,
+                    chunk_size=settings.UPLOAD_CHUNK_SIZE,
+                    hasher=hasher,
+                )
+        except UploadTooLargeError as e:
             raise HTTPException(
-                status_code=400,
-                detail="Invalid HEIC/HEIF file format"
+                status_code=413,
+                detail=str(e)
             )
+        upload_files.add(input_filename, input_size)
+        input_bytes.inc(input_size)
 
-        # Convert HEIC to JPG
-        original_size, converted_size, conversion_time = convert_heic_to_jpg(
-            input_path=input_path,
-            output_path=output_path,
-            quality=quality,
-            resize=resize,
-            width=width,
-            height=height,
-            maintain_aspect_ratio=maintain_aspect_ratio,
-            rotate=rotate,
+        # Convert HEIC, reusing an identical earlier conversion if there is one
+        entry, cached = await convert_file(
+            input_path, hasher.hexdigest(), options, ticket, peak_bytes=estimate_memory(header, options)
         )
 
         # Schedule cleanup of input file
-        background_tasks.add_task(lambda: input_path.unlink(missing_ok=True))
+        background_tasks.add_task(remove_temp_file, input_path)
 
-        # Generate download URL
-        download_url = f"{settings.API_V1_STR}/download/{output_filename}"
-
-        # Return conversion details
+        # Describe every output; the first requested format is the main result
+        outputs = converted_outputs(Path(file.filename).stem, entry)
         return ConversionResponse(
-            filename=f"{Path(file.filename).stem}.jpg",
-            original_size=original_size,
-            converted_size=converted_size,
-            conversion_time=conversion_time,
-            download_url=download_url,
+            filename=outputs[0].filename,
+            original_size=entry.original_size,
+            converted_size=entry.converted_size,
+            conversion_time=entry.conversion_time,
+            download_url=outputs[0].download_url,
+            cached=cached,
+            queue_wait_time=0.0 if cached else entry.queue_wait,
+            format=outputs[0].format,
+            quality=entry.quality,
+            encode_passes=entry.encode_passes,
+            outputs=outputs,
         )
 
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
 
+    except TargetSizeError as e:
+        if input_path is not None:
+            remove_temp_file(input_path)
+        raise HTTPException(
+            status_code=422,
+            detail=str(e)
+        )
+
+    except RateLimitedError as e:
+        if input_path is not None:
+            remove_temp_file(input_path)
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+
+    except ExecutorBusyError:
+        if input_path is not None:
+            remove_temp_file(input_path)
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy. Please retry later",
+            headers={"Retry-After": str(settings.CONVERSION_RETRY_AFTER_SECONDS)},
+        )
+
+    except ConversionTimeoutError as e:
+        if input_path is not None:
+            remove_temp_file(input_path)
+        raise HTTPException(
+            status_code=504,
+            detail=str(e)
+        )
+
     except Exception as e:
         logger.error(f"Error during conversion: {str(e)}")
+        if input_path is not None:
+            remove_temp_file(input_path)
         raise HTTPException(
             status_code=500,
             detail=f"Error during conversion: {str(e)}"
         )
 
+@app.post(
+    f"{settings.API_V1_STR}/convert/batch",
+    responses={
+        200: {
+            "content": {"application/zip": {}, "application/x-ndjson": {}},
+            "description": "ZIP of converted images, or one JSON result per line",
+        },
+        400: {"model": ErrorResponse},
+        413: {"model": ErrorResponse},
+    },
+    tags=["Conversion"],
+)
+async def convert_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    quality: Optional[int] = Form(None, ge=1, le=100),
+    resize: Optional[bool] = Form(False),
+    width: Optional[int] = Form(None, ge=1),
+    height: Optional[int] = Form(None, ge=1),
+    maintain_aspect_ratio: Optional[bool] = Form(True),
+    rotate: Optional[int] = Form(None),
+    max_bytes: Optional[int] = Form(None, ge=1),
+    output_format: Optional[str] = Form(
+        None, alias="format", description="Comma-separated output formats (jpeg, webp, avif, png); negotiated from Accept if not given"
+    ),
+    accept: Optional[str] = Header(None),
+    output: str = Query("zip", pattern="^(zip|ndjson)$", description="Stream a ZIP archive or NDJSON results"),
+):
+    """
+    Convert many HEIC/HEIF images with shared options
+
+    Files are converted in parallel and streamed back as each one finishes.
+    A failed file is reported in its result and does not abort the batch.
+    """
+    if len(files) > settings.MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files. Maximum is {settings.MAX_BATCH_FILES} per batch"
+        )
+
+    options = ConversionOptions(
+        quality=quality,
+        resize=resize,
+        width=width,
+        height=height,
+        maintain_aspect_ratio=maintain_aspect_ratio,
+        rotate=rotate,
+        max_bytes=max_bytes,
+        formats=resolve_formats(output_format, accept),
+    )
+
+    # Bound how many uploads are held in memory at once
+    slots = asyncio.Semaphore(settings.CONVERSION_WORKERS)
+
+    async def convert_one(index: int, upload: UploadFile):
+        stem = Path(upload.filename).stem
+        result = {"index": index, "filename": f"{stem}{FORMATS[options.formats[0]].extension}"}
+        images = []
+
+        try:
+            file_ext = Path(upload.filename).suffix.lower()
+            if file_ext not in settings.ALLOWED_EXTENSIONS:
+                raise ValueError(f"Unsupported file format. Allowed formats: {', '.join(settings.ALLOWED_EXTENSIONS)}")
+
+            async with slots:
+                with stage_seconds.time(stage="receive"):
+                    content = await read_upload(upload, settings.MAX_FILE_SIZE)
+                input_bytes.inc(len(content))
+
+                with stage_seconds.time(stage="validate"):
+                    header = probe_heic_file(content)
+                if header is None:
+                    raise ValueError("Invalid HEIC/HEIF file format")
+
+                ticket = conversion_ticket(request, header, options)
+                outputs, conversion_time = await run_conversion(
+                    convert_heic_bytes,
+                    content,
+                    ticket=ticket,
+                    peak_bytes=estimate_memory(header, options),
+                    **options.model_dump(),
+                )
+
+            described = []
+            for converted in outputs:
+                data = converted["data"]
+                output_bytes.inc(len(data), format=converted["format"])
+                described.append({
+                    "format": converted["format"],
+                    "filename": f"{stem}{FORMATS[converted['format']].extension}",
+                    "converted_size": len(data),
+                    "quality": converted["quality"],
+                    "encode_passes": converted["encode_passes"],
+                })
+                images.append(data)
+
+            if output == "ndjson":
+                with stage_seconds.time(stage="persist"):
+                    for info, data in zip(described, images):
+                        output_filename = content_addressed_filename(data, FORMATS[info["format"]].extension)
+                        await asyncio.to_thread(storage.put, output_filename, data)
+                        temp_files.add(output_filename, len(data))
+                        info["download_url"] = f"{settings.API_V1_STR}/download/{output_filename}"
+
+            # The first requested format is the main result
+            result.update(
+                status="ok",
+                original_size=len(content),
+                conversion_time=conversion_time,
+                queue_wait_time=ticket.queue_wait,
+            )
+            result.update({key: value for key, value in described[0].items() if key != "filename"})
+            result["outputs"] = described
+
+        except RateLimitedError as e:
+            result.update(status="error", detail=str(e))
+        except ExecutorBusyError:
+            result.update(status="error", detail="Server is busy. Please retry later")
+        except Exception as e:
+            logger.error(f"Error converting batch file {upload.filename}: {str(e)}")
+            result.update(status="error", detail=str(e) or type(e).__name__)
+
+        batch_files.inc(status=result["status"])
+        return result, images
+
+    async def stream():
+        tasks = [asyncio.ensure_future(convert_one(i, f)) for i, f in enumerate(files)]
+        archive = ZipStream() if output == "zip" else None
+        used_names = set()
+        results = []
+
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result, images = await next_done
+
+                if archive is None:
+                    yield ndjson_line(result)
+                    continue
+
+                for info, data in zip(result.get("outputs", []), images):
+                    info["filename"] = unique_name(info["filename"], used_names)
+                    yield archive.add(info["filename"], data)
+                if images:
+                    result["filename"] = result["outputs"][0]["filename"]
+                results.append(result)
+
+            if archive is not None:
+                results.sort(key=lambda r: r["index"])
+                yield archive.add(unique_name("results.json", used_names), json.dumps(results, indent=2))
+                yield archive.close()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    if output == "zip":
+        return StreamingResponse(
+            stream(),
+            media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="converted.zip"'},
+        )
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def job_response(job: Job) -> JobResponse:
+    return JobResponse(**job.to_dict(), timings=job.timings)
+
+async def run_job(
+    job_id: str,
+    input_path: Path,
+    content_digest: str,
+    options: ConversionOptions,
+    filename: str,
+    ticket: Ticket,
+    peak_bytes: int = 0,
+):
+    """Run a queued conversion job and record its progress"""
+    progress: Optional[asyncio.Task] = None
+
+    async def record_progress(previous: Optional[asyncio.Task], stage: str, timestamp: float):
+        if previous is not None:
+            await asyncio.wait([previous])
+        await asyncio.to_thread(job_store.update, job_id, status=stage, stage_time=timestamp)
+
+    def on_progress(stage: str, timestamp: float):
+        # Called on the event loop: write in a thread, in the order reported
+        nonlocal progress
+        progress = asyncio.create_task(record_progress(progress, stage, timestamp))
+
+    async def update(**fields):
+        if progress is not None:
+            await asyncio.wait([progress])
+        await asyncio.to_thread(job_store.update, job_id, **fields)
+
+    try:
+        entry, _ = await convert_file(
+            input_path, content_digest, options, ticket, on_progress=on_progress, peak_bytes=peak_bytes
+        )
+        await update(
+            status=JOB_DONE,
+            original_size=entry.original_size,
+            converted_size=entry.converted_size,
+            conversion_time=entry.conversion_time,
+            quality=entry.quality,
+            encode_passes=entry.encode_passes,
+            download_url=f"{settings.API_V1_STR}/download/{entry.output_filename}",
+            outputs=[output.model_dump() for output in converted_outputs(Path(filename).stem, entry)],
+        )
+    except RateLimitedError as e:
+        await update(status=JOB_FAILED, error=str(e))
+    except ExecutorBusyError:
+        await update(status=JOB_FAILED, error="Server is busy. Please retry later")
+    except asyncio.CancelledError:
+        await update(status=JOB_FAILED, error=STALE_JOB_ERROR)
+        raise
+    except Exception as e:
+        logger.error(f"Error during job {job_id}: {str(e)}")
+        await update(status=JOB_FAILED, error=f"Error during conversion: {str(e)}")
+    finally:
+        remove_temp_file(input_path)
+
+@app.post(
+    f"{settings.API_V1_STR}/jobs",
+    response_model=JobResponse,
+    status_code=202,
+    responses={
+        400: {"model": ErrorResponse},
+        413: {"model": ErrorResponse},
+        415: {"model": ErrorResponse},
+        429: {"model": ErrorResponse},
+        503: {"model": ErrorResponse},
+    },
+    tags=["Jobs"],
+)
+async def create_job(
+    request: Request,
+    file: UploadFile = File(...),
+    quality: Optional[int] = Form(None, ge=1, le=100),
+    resize: Optional[bool] = Form(False),
+    width: Optional[int] = Form(None, ge=1),
+    height: Optional[int] = Form(None, ge=1),
+    maintain_aspect_ratio: Optional[bool] = Form(True),
+    rotate: Optional[int] = Form(None),
+    max_bytes: Optional[int] = Form(None, ge=1),
+    output_format: Optional[str] = Form(
+        None, alias="format", description="Comma-separated output formats (jpeg, webp, avif, png); negotiated from Accept if not given"
+    ),
+    accept: Optional[str] = Header(None),
+):
+    """Queue a HEIC/HEIF to JPG conversion and return its job id immediately"""
+    options = ConversionOptions(
+        quality=quality,
+        resize=resize,
+        width=width,
+        height=height,
+        maintain_aspect_ratio=maintain_aspect_ratio,
+        rotate=rotate,
+        max_bytes=max_bytes,
+        formats=resolve_formats(output_format, accept),
+    )
+
+    # Validate file extension
+    file_ext = Path(file.filename).suffix.lower()
+    if file_ext not in settings.ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported file format. Allowed formats: {', '.join(settings.ALLOWED_EXTENSIONS)}"
+        )
+
+    retry_after = scheduler.retry_after(client_key(request))
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit of {settings.SCHEDULER_RATE_PER_SECOND:g} conversions per second exceeded",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    if scheduler.is_full:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy. Please retry later",
+            headers={"Retry-After": str(settings.CONVERSION_RETRY_AFTER_SECONDS)},
+        )
+
+    input_path = await asyncio.to_thread(uploads.prepare, generate_unique_filename(file_ext))
+    hasher = hashlib.sha256()
+    try:
+        with stage_seconds.time(stage="receive"):
+            input_size = await spool_upload(
+                file,
+                input_path,
+                max_size=settings.MAX_FILE_SIZE,
+                chunk_size=settings.UPLOAD_CHUNK_SIZE,
+                hasher=hasher,
+            )
+    except UploadTooLargeError as e:
+        raise HTTPException(
+            status_code=413,
+            detail=str(e)
+        )
+    upload_files.add(input_path.name, input_size)
+    input_bytes.inc(input_size)
+
+    with stage_seconds.time(stage="validate"):
+        header = probe_heic_file(input_path)
+    if header is None:
+        remove_temp_file(input_path)
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid HEIC/HEIF file format"
+        )
+
+    job = Job.new(filename=f"{Path(file.filename).stem}{FORMATS[options.formats[0]].extension}")
+    await asyncio.to_thread(job_store.create, job)
+
+    task = asyncio.create_task(
+        run_job(
+            job.id,
+            input_path,
+            hasher.hexdigest(),
+            options,
+            job.filename,
+            conversion_ticket(request, header, options),
+            estimate_memory(header, options),
+        )
+    )
+    job_tasks[job.id] = task
+    task.add_done_callback(lambda _: job_tasks.pop(job.id, None))
+
+    return job_response(job)
+
 @app.get(
+    f"{settings.API_V1_STR}/jobs/{{job_id}}",
+    response_model=JobResponse,
+    responses={404: {"model": ErrorResponse}},
+    tags=["Jobs"],
+)
+async def get_job(job_id: str):
+    """Get the status of a conversion job"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Job not found or has expired"
+        )
+    return job_response(job)
+
+@app.get(
+    f"{settings.API_V1_STR}/jobs/{{job_id}}/events",
+    responses={
+        200: {"content": {"text/event-stream": {}}, "description": "Server-sent job status events"},
+        404: {"model": ErrorResponse},
+    },
+    tags=["Jobs"],
+)
+async def job_events(job_id: str):
+    """Stream job status changes as server-sent events until the job finishes"""
+    if await asyncio.to_thread(job_store.get, job_id) is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Job not found or has expired"
+        )
+
+    async def stream():
+        last_update = None
+        last_sent = time.time()
+
+        while True:
+            job = await asyncio.to_thread(job_store.get, job_id)
+            if job is None:
+                break
+
+            if job.updated_at != last_update:
+                last_update = job.updated_at
+                last_sent = time.time()
+                yield sse_event("status", job_response(job).model_dump())
+                if job.status in TERMINAL_STATES:
+                    break
+            elif time.time() - last_sent > 15:
+                # Keep proxies from closing an idle connection
+                last_sent = time.time()
+                yield b": keep-alive\n\n"
+
+            await asyncio.sleep(0.25)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def record_download(started: float, response: DownloadResponse) -> None:
+    """Record a finished download once its body has been sent"""
+    stage_seconds.observe(time.perf_counter() - started, stage="download")
+    download_bytes.inc(response.sent_bytes)
+
+@app.api_route(
     f"{settings.API_V1_STR}/download/{{filename}}",
+    methods=["GET", "HEAD"],
     tags=["Conversion"],
 )
 async def download_image(filename: str, custom_filename: Optional[str] = Query(None)):
-    """Download a converted image"""
-    file_path = settings.TEMP_DIR / filename
+    """
+    Download a converted image
 
-    if not file_path.exists():
+    Responses carry a strong ETag and Last-Modified and honour conditional
+    and Range requests. Content-addressed names are cacheable forever.
+    """
+    try:
+        stored, etag = await asyncio.to_thread(stat_and_etag, storage, filename)
+    except FileNotFoundError:
         raise HTTPException(
             status_code=404,
             detail="File not found or has expired"
         )
 
-    return FileResponse(
-        path=str(file_path),
-        media_type="image/jpeg",
+    fmt = format_for_extension(Path(filename).suffix)
+    if is_content_addressed(filename):
+        cache_control = f"public, max-age={settings.DOWNLOAD_CACHE_MAX_AGE_SECONDS}, immutable"
+    else:
+        cache_control = "no-cache"
+
+    temp_files.touch(filename)
+    response = DownloadResponse(
+        storage=storage,
+        stored=stored,
+        etag=etag,
+        media_type=fmt.media_type if fmt is not None else "application/octet-stream",
         filename=custom_filename or filename,
+        cache_control=cache_control,
     )
+    response.background = BackgroundTask(record_download, time.perf_counter(), response)
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Expose metrics in the Prometheus text format"""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(content=metrics.render(), headers={"Content-Type": CONTENT_TYPE})
 
 @app.on_event("startup")
 async def startup_event():
     """Run startup tasks"""
     # Create temp directory if it doesn't exist
-    settings.TEMP_DIR.mkdir(exist_ok=True)
+    try:
+        settings.TEMP_DIR.mkdir(exist_ok=True)
+    except OSError as e:
+        # Read-only filesystems can still serve inline conversions
+        logger.warning(f"Temp directory unavailable: {str(e)}")
+
+    # One worker deletes files that expired while the server was down and
+    # tracks the rest so they still expire
+    if await asyncio.to_thread(cleanup_leader.try_acquire):
+        logger.info("Became the cleanup leader")
+        try:
+            await sweep_stored_files(rebuild=True)
+        except Exception as e:
+            logger.error(f"Error scanning stored files: {str(e)}")
+
+    # Choose decoder backends before the workers start, so they inherit the choice
+    decoders.registry.configure(settings.DECODER_BACKENDS, settings.DECODER_PREFERENCES)
+    installed = decoders.registry.initialize()
+    if not installed:
+        logger.error("No HEIC/HEIF decoder backend is installed")
+    else:
+        logger.info(f"Decoder backends: {', '.join(installed)}")
+    if installed and settings.DECODER_BENCHMARK:
+        samples = await asyncio.to_thread(decoders.load_samples, settings.DECODER_BENCHMARK_DIR)
+        if samples:
+            timings = await asyncio.to_thread(decoders.registry.benchmark, samples)
+            for kind, results in timings.items():
+                measured = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in results.items())
+                logger.info(f"Decoding {kind} input with {decoders.registry.preferences.get(kind)} ({measured})")
+        else:
+            logger.warning(f"No decoder benchmark samples in {settings.DECODER_BENCHMARK_DIR}")
+    conversion_executor.initargs = (decoders.registry.order, decoders.registry.preferences)
+
+    # Start conversion worker processes
+    conversion_executor.start()
 
     # Start background cleanup task
     asyncio.create_task(cleanup_old_files())
 
+    # Fail jobs a previous run left unfinished, then keep this worker's jobs alive
+    asyncio.create_task(heartbeat_jobs())
+
     logger.info(f"Started {settings.PROJECT_NAME}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Run shutdown tasks"""
+    # The server has stopped taking requests; let running jobs finish before the workers go
+    if job_tasks:
+        logger.info(f"Waiting for {len(job_tasks)} jobs to finish")
+        _, pending = await asyncio.wait(set(job_tasks.values()), timeout=settings.SHUTDOWN_DRAIN_SECONDS)
+        for task in pending:
+            task.cancel()
+        if pending:
+            # Let the cancelled jobs record their failure before the store closes
+            await asyncio.wait(pending)
+            logger.warning(f"Cancelled {len(pending)} jobs still running after {settings.SHUTDOWN_DRAIN_SECONDS}s")
+
+    conversion_executor.shutdown()
+    cleanup_leader.release()
+    job_store.close()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
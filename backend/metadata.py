@@ -0,0 +1,133 @@
+"""
+Describe HEIC/HEIF files without decoding them.
+
+Everything here comes from the container header and the EXIF block, so
+probing costs the same for any image size: a few small reads, no pixels.
+"""
+
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional, Union
+
+from PIL import Image
+from PIL.ExifTags import GPS, IFD, Base
+
+from heif_container import HeifFormatError, HeifHeader, find_thumbnails, read_exif
+
+# Reported EXIF fields and the tags they come from, in IFD0 or the Exif IFD
+_EXIF_FIELDS = {
+    "make": Base.Make,
+    "model": Base.Model,
+    "software": Base.Software,
+    "orientation": Base.Orientation,
+}
+_EXIF_IFD_FIELDS = {
+    "datetime_original": Base.DateTimeOriginal,
+    "offset_time_original": Base.OffsetTimeOriginal,
+    "exposure_time": Base.ExposureTime,
+    "f_number": Base.FNumber,
+    "iso": Base.ISOSpeedRatings,
+    "focal_length": Base.FocalLength,
+    "focal_length_35mm": Base.FocalLengthIn35mmFilm,
+    "lens_model": Base.LensModel,
+}
+
+
+def _json_value(value: Any) -> Any:
+    """EXIF value as a JSON-friendly type, or None for values that are not meaningful there"""
+    if isinstance(value, str):
+        return value.strip("\x00 ") or None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, tuple) and len(value) == 1:
+        return _json_value(value[0])
+    try:
+        # IFDRational and other numeric wrappers
+        return float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _gps_degrees(values: Any, reference: Any, negative: str) -> Optional[float]:
+    try:
+        degrees, minutes, seconds = (float(value) for value in values)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    result = degrees + minutes / 60 + seconds / 3600
+    return round(-result if reference == negative else result, 7)
+
+
+def parse_exif(data: bytes) -> Dict[str, Any]:
+    """
+    Summarize the capture metadata in an EXIF block
+
+    Args:
+        data: EXIF data starting at its TIFF header
+
+    Returns:
+        The fields present, keyed by the names in _EXIF_FIELDS and
+        _EXIF_IFD_FIELDS, plus latitude, longitude and altitude when the
+        block has a GPS position
+    """
+    exif = Image.Exif()
+    exif.load(data)
+
+    summary: Dict[str, Any] = {}
+    for name, tag in _EXIF_FIELDS.items():
+        value = _json_value(exif.get(tag))
+        if value is not None:
+            summary[name] = value
+
+    exif_ifd = exif.get_ifd(IFD.Exif)
+    for name, tag in _EXIF_IFD_FIELDS.items():
+        value = _json_value(exif_ifd.get(tag))
+        if value is not None:
+            summary[name] = value
+
+    gps = exif.get_ifd(IFD.GPSInfo)
+    if GPS.GPSLatitude in gps and GPS.GPSLongitude in gps:
+        latitude = _gps_degrees(gps[GPS.GPSLatitude], gps.get(GPS.GPSLatitudeRef), "S")
+        longitude = _gps_degrees(gps[GPS.GPSLongitude], gps.get(GPS.GPSLongitudeRef), "W")
+        if latitude is not None and longitude is not None:
+            summary["latitude"] = latitude
+            summary["longitude"] = longitude
+    altitude = _json_value(gps.get(GPS.GPSAltitude))
+    if altitude is not None:
+        # Reference 1 means below sea level
+        summary["altitude"] = -altitude if gps.get(GPS.GPSAltitudeRef) in (1, b"\x01") else altitude
+
+    return summary
+
+
+def describe_heif(source: Union[Path, bytes, BinaryIO], header: HeifHeader) -> Dict[str, Any]:
+    """
+    Describe a HEIF file from its parsed header
+
+    Args:
+        source: The file the header was read from, for reading its EXIF block
+        header: Parsed and validated header of the file
+
+    Returns:
+        Keyword arguments for models.ProbeResponse. A malformed EXIF block
+        is left out rather than failing the whole description.
+    """
+    width, height = header.size
+    try:
+        exif_data = read_exif(source, header)
+        exif = parse_exif(exif_data) if exif_data else {}
+    except (HeifFormatError, OSError, SyntaxError, ValueError):
+        exif = {}
+
+    return {
+        "width": width,
+        "height": height,
+        "rotation": header.rotation,
+        "orientation": exif.get("orientation"),
+        "bit_depth": header.bit_depth,
+        "has_alpha": header.has_alpha,
+        "is_grid": header.is_grid,
+        "image_count": len(header.images),
+        "thumbnail_count": len(find_thumbnails(header)),
+        "brand": header.major_brand,
+        "file_size": header.file_size,
+        "exif": exif,
+    }
@@ -0,0 +1,279 @@
+"""
+In-process metrics exposed in the Prometheus text exposition format.
+
+Recording a sample is a dict lookup and a few additions under an
+uncontended lock, so instrumentation can stay enabled in production.
+Values describing state owned elsewhere (queue depth, cache statistics,
+temp directory size) are read from callbacks when /metrics is scraped.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans a small inline conversion up to the conversion timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+Samples = Union[float, Dict[LabelValues, float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return lines + self._render_samples()
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing value, optionally per label combination"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in items]
+
+
+class CallbackMetric(_Metric):
+    """
+    Counter or gauge whose value is read from a callback at scrape time
+
+    The callback returns a single number, or a mapping of label values to
+    numbers when the metric has labels.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Samples],
+        kind: str = "gauge",
+        labels: Sequence[str] = (),
+    ):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.callback = callback
+
+    def _render_samples(self) -> List[str]:
+        samples = self.callback()
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in sorted(samples.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label combination: [per-bucket counts..., +Inf count], sum
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of a block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """A set of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge_callback(
+        self, name: str, documentation: str, callback: Callable[[], Samples], labels: Sequence[str] = ()
+    ) -> CallbackMetric:
+        return self._register(CallbackMetric(name, documentation, callback, "gauge", labels))
+
+    def counter_callback(
+        self, name: str, documentation: str, callback: Callable[[], Samples], labels: Sequence[str] = ()
+    ) -> CallbackMetric:
+        return self._register(CallbackMetric(name, documentation, callback, "counter", labels))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def observe_stages(
+    histogram: Histogram,
+    submitted: float,
+    stages: List[Tuple[str, float]],
+    finished: float,
+    queue_stage: Optional[str] = "queue",
+) -> None:
+    """
+    Record stage durations from the timestamps at which each stage started
+
+    Args:
+        histogram: Histogram with a "stage" label
+        submitted: Time the job was submitted
+        stages: (stage, started_at) in the order the stages ran
+        finished: Time the last stage ended
+        queue_stage: Stage name for the wait before the first stage
+    """
+    if not stages:
+        return
+    if queue_stage is not None:
+        histogram.observe(max(0.0, stages[0][1] - submitted), stage=queue_stage)
+    ends = [started for _, started in stages[1:]] + [finished]
+    for (stage, started), ended in zip(stages, ends):
+        histogram.observe(max(0.0, ended - started), stage=stage)
+
+
+class MetricsMiddleware:
+    """
+    Count requests and time them per endpoint and status code
+
+    Endpoints are labelled with the name of the route handler, so paths with
+    parameters (like download file names) do not create new series.
+
+    Args:
+        app: The wrapped ASGI application
+        requests: Counter with "endpoint" and "status" labels
+        durations: Histogram with an "endpoint" label
+    """
+
+    def __init__(self, app: ASGIApp, requests: Counter, durations: Histogram):
+        self.app = app
+        self.requests = requests
+        self.durations = durations
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched handler in the shared scope
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            self.requests.inc(endpoint=endpoint, status=str(status))
+            self.durations.observe(time.perf_counter() - start, endpoint=endpoint)
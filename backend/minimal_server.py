@@ -1,6 +1,7 @@
 """
 Enhanced FastAPI server for HEIC to JPG conversion.
-This version uses Pillow for image processing and handles HEIC files by converting them to JPG.
+This version uses Pillow for image processing and decodes HEIC files with the
+shared decoder backends.
 """
 
 import uuid
@@ -21,11 +22,8 @@ from fastapi.openapi.docs import get_swagger_ui_html
 from starlette.responses import RedirectResponse
 from pydantic import BaseModel, Field
 
-# Pillow for image processing
-from PIL import Image
-
-# Import pillow-heif for HEIC support
-import pillow_heif
+import decoders
+from transforms import TransformPlan, apply_plan, plan_transforms
 
 # Configure logging
 logging.basicConfig(
@@ -80,6 +78,10 @@ async def lifespan(_: FastAPI):
     # Create temp directory if it doesn't exist
     settings.TEMP_DIR.mkdir(exist_ok=True)
 
+    # Initialize the decoder backends once
+    installed = decoders.registry.initialize()
+    logger.info(f"Decoder backends: {', '.join(installed) or 'none'}")
+
     # Start background cleanup task
     cleanup_task = asyncio.create_task(cleanup_old_files())
 
@@ -121,6 +123,27 @@ def generate_unique_filename(extension: str = ".jpg") -> str:
     """Generate a unique filename with the given extension"""
     return f"{uuid.uuid4()}{extension}"
 
+def plan_conversion(
+    size: tuple,
+    resize: bool,
+    width: Optional[int],
+    height: Optional[int],
+    maintain_aspect_ratio: bool,
+    rotate: Optional[int]
+) -> TransformPlan:
+    """Plan the requested transforms with this server's semantics"""
+    # Only right-angle rotations are supported, and giving both width and
+    # height resizes to exactly that size
+    return plan_transforms(
+        size,
+        rotate=rotate if rotate in (90, 180, 270) else None,
+        resize=resize,
+        width=width,
+        height=height,
+        maintain_aspect_ratio=maintain_aspect_ratio,
+        fit_within=False,
+    )
+
 def clean_temp_files(retention_minutes: int = 30) -> int:
     """Clean up temporary files older than the specified retention period"""
     deleted_count = 0
@@ -222,92 +245,22 @@ async def convert_image(
         with open(input_path, "wb") as buffer:
             buffer.write(content)
 
-        # Convert HEIC to JPG using pillow-heif and Pillow
+        # Decode with the preferred backend, falling back to the other installed ones
         try:
-            # Register HEIF opener with Pillow
-            pillow_heif.register_heif_opener()
-
-            # Now we can open HEIC files directly with Pillow
-            with Image.open(input_path) as img:
-                # Convert to RGB mode if needed (HEIC might be in other color modes)
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-
-                # Apply rotation if specified
-                if rotate is not None:
-                    try:
-                        if rotate == 90:
-                            img = img.transpose(Image.ROTATE_90)
-                        elif rotate == 180:
-                            img = img.transpose(Image.ROTATE_180)
-                        elif rotate == 270:
-                            img = img.transpose(Image.ROTATE_270)
-                    except AttributeError:
-                        # For newer Pillow versions
-                        if rotate == 90:
-                            img = img.transpose(Image.Transpose.ROTATE_90)
-                        elif rotate == 180:
-                            img = img.transpose(Image.Transpose.ROTATE_180)
-                        elif rotate == 270:
-                            img = img.transpose(Image.Transpose.ROTATE_270)
-
-                # Apply resize if specified
-                if resize and (width is not None or height is not None):
-                    original_width, original_height = img.size
-                    new_width = width or original_width
-                    new_height = height or original_height
-
-                    if maintain_aspect_ratio:
-                        if width and not height:
-                            # Calculate height to maintain aspect ratio
-                            new_height = int(original_height * (new_width / original_width))
-                        elif height and not width:
-                            # Calculate width to maintain aspect ratio
-                            new_width = int(original_width * (new_height / original_height))
-
-                    # Use LANCZOS resampling (different constant name in different Pillow versions)
-                    try:
-                        img = img.resize((new_width, new_height), Image.LANCZOS)
-                    except AttributeError:
-                        # For older Pillow versions
-                        try:
-                            img = img.resize((new_width, new_height), Image.ANTIALIAS)
-                        except AttributeError:
-                            # For newer Pillow versions where ANTIALIAS is also removed
-                            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-                # Save as JPG with specified quality
-                img.save(output_path, "JPEG", quality=quality, optimize=True)
-                logger.info(f"Successfully converted {file.filename} to JPG using pillow-heif")
-        except Exception as img_error:
-            # If pillow-heif conversion fails, try alternative method
-            logger.warning(f"pillow-heif conversion failed: {str(img_error)}. Trying alternative method...")
-
-            try:
-                # Try using direct heif reading
-                heif_file = pillow_heif.open_heif(input_path)
-
-                # Convert to PIL Image
-                img = Image.frombytes(
-                    heif_file.mode,
-                    heif_file.size,
-                    heif_file.data,
-                    'raw',
-                    heif_file.mode,
-                    heif_file.stride,
-                )
-
-                # Apply the same processing as above
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-
-                # Save as JPG
-                img.save(output_path, "JPEG", quality=quality, optimize=True)
-                logger.info(f"Successfully converted {file.filename} to JPG using alternative method")
-            except Exception as alt_error:
-                # If all conversion methods fail, log the error
-                logger.error(f"All conversion methods failed: {str(alt_error)}")
-                raise HTTPException(status_code=500, detail=f"Failed to convert HEIC to JPG: {str(alt_error)}")
+            img = decoders.decode(input_path)
+        except Exception as decode_error:
+            logger.error(f"All conversion methods failed: {str(decode_error)}")
+            raise HTTPException(status_code=500, detail=f"Failed to convert HEIC to JPG: {str(decode_error)}")
+
+        # Convert to RGB mode if needed (HEIC might be in other color modes)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # Apply rotation and resize if specified
+        img = apply_plan(img, plan_conversion(img.size, resize, width, height, maintain_aspect_ratio, rotate))
+
+        # Save as JPG with specified quality
+        img.save(output_path, "JPEG", quality=quality, optimize=True)
 
         # Get file sizes
         original_size = input_path.stat().st_size
@@ -1,15 +1,30 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Any, Optional, List, Dict
 from datetime import datetime
 
 class ConversionOptions(BaseModel):
     """Options for image conversion"""
-    quality: Optional[int] = Field(default=95, ge=1, le=100, description="JPEG quality (1-100)")
+    quality: Optional[int] = Field(
+        default=None, ge=1, le=100, description="Quality of lossy formats (1-100); each format's default if not given"
+    )
     resize: Optional[bool] = Field(default=False, description="Whether to resize the image")
     width: Optional[int] = Field(default=None, ge=1, description="Target width in pixels")
     height: Optional[int] = Field(default=None, ge=1, description="Target height in pixels")
     maintain_aspect_ratio: Optional[bool] = Field(default=True, description="Maintain aspect ratio when resizing")
     rotate: Optional[int] = Field(default=None, description="Rotation angle in degrees")
+    max_bytes: Optional[int] = Field(
+        default=None, ge=1, description="Largest acceptable size of each output in bytes; quality is lowered to fit"
+    )
+    formats: List[str] = Field(default_factory=lambda: ["jpeg"], description="Output formats to produce")
+
+class ConvertedOutput(BaseModel):
+    """One output format of a conversion"""
+    format: str
+    filename: str
+    converted_size: int
+    download_url: str
+    quality: Optional[int] = Field(default=None, description="Quality used; none for lossless formats")
+    encode_passes: int = Field(default=1, description="Encodes needed to meet max_bytes")
 
 class ConversionResponse(BaseModel):
     """Response for successful conversion"""
@@ -18,6 +33,63 @@ class ConversionResponse(BaseModel):
     converted_size: int
     conversion_time: float
     download_url: str
+    cached: bool = False
+    queue_wait_time: float = Field(default=0.0, description="Seconds the conversion waited for a worker")
+    format: str = "jpeg"
+    quality: Optional[int] = Field(default=None, description="Quality used; none for lossless formats")
+    encode_passes: int = Field(default=1, description="Encodes needed to meet max_bytes")
+    outputs: List[ConvertedOutput] = Field(default_factory=list, description="Every format produced, this one first")
+
+class ProbeResponse(BaseModel):
+    """Container metadata and EXIF of an image, read without decoding it"""
+    filename: str
+    width: int = Field(description="Displayed width in pixels, with rotation applied")
+    height: int = Field(description="Displayed height in pixels, with rotation applied")
+    rotation: int = Field(description="Counter-clockwise rotation applied by the container, in degrees")
+    orientation: Optional[int] = Field(default=None, description="EXIF orientation tag, informational for HEIF")
+    bit_depth: int
+    has_alpha: bool
+    is_grid: bool = Field(description="Whether the image is stored as a grid of tiles")
+    image_count: int = Field(description="Top-level images, excluding tiles, thumbnails and alpha planes")
+    thumbnail_count: int
+    brand: str
+    file_size: int
+    exif: Dict[str, Any] = Field(default_factory=dict, description="Capture metadata present in the EXIF block")
+
+class ProbeResult(BaseModel):
+    """One file of a batch probe"""
+    index: int
+    filename: str
+    status: str
+    detail: Optional[str] = None
+    info: Optional[ProbeResponse] = None
+
+class CacheStatsResponse(BaseModel):
+    """Response for conversion cache statistics"""
+    entries: int
+    bytes: int
+    hits: int
+    misses: int
+    coalesced: int
+    evictions: int
+
+class JobResponse(BaseModel):
+    """Response describing an asynchronous conversion job"""
+    id: str
+    status: str
+    filename: str
+    created_at: float
+    updated_at: float
+    stages: Dict[str, float] = Field(default_factory=dict, description="Time at which each state was entered")
+    timings: Dict[str, float] = Field(default_factory=dict, description="Seconds spent in each completed state")
+    original_size: Optional[int] = None
+    converted_size: Optional[int] = None
+    conversion_time: Optional[float] = None
+    quality: Optional[int] = None
+    encode_passes: Optional[int] = None
+    download_url: Optional[str] = None
+    outputs: List[ConvertedOutput] = Field(default_factory=list)
+    error: Optional[str] = None
 
 class ErrorResponse(BaseModel):
     """Response for error"""
@@ -1,3 +1,5 @@
+"""Development server with auto-reload; see serve.py for production"""
+
 import uvicorn
 
 if __name__ == "__main__":
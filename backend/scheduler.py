@@ -0,0 +1,252 @@
+"""
+Fair scheduling of conversions between clients.
+
+Conversions no longer start in arrival order. Each client (an API key, or
+the client's IP address) has its own queue, and the scheduler lets at most
+`capacity` conversions run at once:
+
+- Clients share the workers in proportion to their weights. Every client
+  accumulates the estimated cost of the work it has started, divided by
+  its weight, and the next conversion comes from the waiting client with
+  the least. A client that was idle starts from the level of the last
+  conversion started, so it neither spends credit saved while idle nor
+  waits behind work that arrived before it.
+- Within a client's queue the cheapest conversion goes first, so one large
+  file does not hold up the small ones behind it. A conversion's cost
+  shrinks the longer it waits, so large ones are not starved.
+- A token bucket per client limits how many conversions it may start per
+  second; beyond that, requests are rejected with RateLimitedError.
+
+All of this state is kept in one process. Under serve.py each server
+worker schedules, and rate-limits, the requests it receives on its own.
+"""
+
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional
+
+from executor import ExecutorBusyError
+
+
+class RateLimitedError(ExecutorBusyError):
+    """Raised when a client exceeds its rate limit"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class Ticket:
+    """A conversion's place in the schedule, and how long it waited for it"""
+    client: str
+    cost: float
+    enqueued: Optional[float] = None
+    started: Optional[float] = None
+
+    @property
+    def queue_wait(self) -> float:
+        """Seconds from joining the queue until the conversion started"""
+        if self.enqueued is None:
+            return 0.0
+        return (self.started or time.time()) - self.enqueued
+
+
+@dataclass
+class _Waiter:
+    ticket: Ticket
+    future: asyncio.Future
+    order: int
+
+
+@dataclass
+class _Client:
+    weight: float
+    tokens: float
+    refilled: float
+    service: float = 0.0
+    running: int = 0
+    waiting: List[_Waiter] = field(default_factory=list)
+
+
+class FairScheduler:
+    """
+    Weighted fair queue of conversions with per-client rate limits
+
+    Args:
+        capacity: Conversions allowed to run at once
+        max_waiting: Conversions allowed to wait in all queues together
+        rate: Conversions each client may start per second; 0 disables the limit
+        burst: Conversions a client may start at once after being idle
+        weights: Share of each client key relative to the default of 1
+        aging_seconds: Wait after which a conversion counts as half its cost
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        max_waiting: int,
+        rate: float = 0.0,
+        burst: int = 1,
+        weights: Optional[Dict[str, float]] = None,
+        aging_seconds: float = 10.0,
+    ):
+        self.capacity = max(1, capacity)
+        self.max_waiting = max(0, max_waiting)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.weights = weights or {}
+        self.aging_seconds = aging_seconds
+        self._clients: Dict[str, _Client] = {}
+        self._order = itertools.count()
+        self._running = 0
+        self._waiting = 0
+        # Service level of the client whose conversion started last, before that conversion
+        self._virtual_time = 0.0
+        self.rejected = 0
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @property
+    def is_full(self) -> bool:
+        """Whether a new conversion would be rejected by the overall queue limit"""
+        return self._running >= self.capacity and self._waiting >= self.max_waiting
+
+    def retry_after(self, key: str) -> float:
+        """Seconds until the client may start another conversion, 0 if it may now"""
+        client = self._clients.get(key)
+        if self.rate <= 0 or client is None:
+            return 0.0
+        self._refill(client)
+        return max(0.0, (1 - client.tokens) / self.rate)
+
+    def _client(self, key: str) -> _Client:
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = _Client(
+                weight=max(float(self.weights.get(key, 1.0)), 1e-6),
+                tokens=float(self.burst),
+                refilled=time.monotonic(),
+            )
+        return client
+
+    def _forget_idle(self, key: str) -> None:
+        """Drop a client's state once it holds nothing the defaults would not restore"""
+        client = self._clients.get(key)
+        if client is None or client.running or client.waiting:
+            return
+        if self.rate > 0:
+            self._refill(client)
+            if client.tokens < self.burst:
+                return
+        del self._clients[key]
+
+    def _refill(self, client: _Client) -> None:
+        now = time.monotonic()
+        client.tokens = min(float(self.burst), client.tokens + (now - client.refilled) * self.rate)
+        client.refilled = now
+
+    def _take_token(self, client: _Client) -> None:
+        if self.rate <= 0:
+            return
+        self._refill(client)
+        if client.tokens < 1:
+            raise RateLimitedError(
+                f"Rate limit of {self.rate:g} conversions per second exceeded",
+                retry_after=(1 - client.tokens) / self.rate,
+            )
+        client.tokens -= 1
+
+    def _aged_cost(self, waiter: _Waiter, now: float) -> float:
+        waited = now - waiter.ticket.enqueued
+        return waiter.ticket.cost / (1 + waited / self.aging_seconds)
+
+    def _dispatch(self) -> None:
+        """Start waiting conversions while there is capacity"""
+        while self._running < self.capacity and self._waiting:
+            now = time.time()
+            backlogged = [client for client in self._clients.values() if client.waiting]
+            client = min(backlogged, key=lambda c: (c.service, min(w.order for w in c.waiting)))
+            waiter = min(client.waiting, key=lambda w: (self._aged_cost(w, now), w.order))
+            client.waiting.remove(waiter)
+            self._waiting -= 1
+            if waiter.future.done():
+                # Cancelled, but its task has not run to leave the queue yet
+                continue
+            self._start(client, waiter.ticket)
+            waiter.future.set_result(None)
+
+    def _start(self, client: _Client, ticket: Ticket) -> None:
+        self._virtual_time = max(self._virtual_time, client.service)
+        client.service += ticket.cost / client.weight
+        client.running += 1
+        self._running += 1
+
+    def _finish(self, ticket: Ticket) -> None:
+        client = self._clients[ticket.client]
+        client.running -= 1
+        self._running -= 1
+        self._forget_idle(ticket.client)
+        self._dispatch()
+
+    async def _acquire(self, ticket: Ticket) -> None:
+        client = self._client(ticket.client)
+        idle = not client.running and not client.waiting
+        can_start = self._running < self.capacity and not self._waiting
+        try:
+            if not can_start and self._waiting >= self.max_waiting:
+                raise ExecutorBusyError("Conversion queue is full")
+            self._take_token(client)
+        except ExecutorBusyError:
+            self.rejected += 1
+            self._forget_idle(ticket.client)
+            raise
+
+        ticket.enqueued = time.time()
+        if idle:
+            # Returning from idle: no credit for the time away
+            client.service = max(client.service, self._virtual_time)
+
+        if can_start:
+            self._start(client, ticket)
+            return
+
+        waiter = _Waiter(ticket, asyncio.get_running_loop().create_future(), next(self._order))
+        client.waiting.append(waiter)
+        self._waiting += 1
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Started just as the caller gave up
+                self._finish(ticket)
+            else:
+                if waiter in client.waiting:
+                    client.waiting.remove(waiter)
+                    self._waiting -= 1
+                self._forget_idle(ticket.client)
+            raise
+
+    @asynccontextmanager
+    async def turn(self, ticket: Ticket) -> AsyncIterator[None]:
+        """
+        Wait for the ticket's turn and hold a running slot while the block runs
+
+        Raises:
+            RateLimitedError: If the client is over its rate limit
+            ExecutorBusyError: If the queues are full
+        """
+        await self._acquire(ticket)
+        try:
+            yield
+        finally:
+            self._finish(ticket)
@@ -0,0 +1,91 @@
+"""
+Production launcher: several server workers sharing one machine.
+
+Settings describe the whole server. Each worker runs its own conversion
+executor, memory budget and cache, so their limits are divided among the
+workers before they start; the workers read the shares from the
+environment. Decoder backends are benchmarked once here instead of in every
+worker. One worker is elected cleanup leader through settings.CLEANUP_LOCK_PATH
+(see leader.py).
+
+On SIGTERM the workers stop accepting connections, finish open requests and
+running jobs for up to SHUTDOWN_DRAIN_SECONDS, then exit.
+
+Usage:
+    python serve.py [--workers N] [--host HOST] [--port PORT]
+"""
+
+import argparse
+import json
+import logging
+import os
+from typing import Dict
+
+import uvicorn
+
+import decoders
+from config import settings
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger("serve")
+
+
+def worker_environment(workers: int) -> Dict[str, str]:
+    """Settings each worker needs so that together they stay within the server's limits"""
+    environment = {
+        "CONVERSION_WORKERS": str(max(1, settings.CONVERSION_WORKERS // workers)),
+        "CONVERSION_QUEUE_SIZE": str(max(1, settings.CONVERSION_QUEUE_SIZE // workers)),
+        "MEMORY_BUDGET_BYTES": str(settings.MEMORY_BUDGET_BYTES // workers),
+        "CACHE_MAX_BYTES": str(settings.CACHE_MAX_BYTES // workers),
+        # Every worker evicts only the files it wrote
+        "TEMP_DIR_MAX_BYTES": str(settings.TEMP_DIR_MAX_BYTES // workers),
+    }
+
+    # A job can be polled through any worker, so they must share its state
+    if workers > 1 and settings.JOB_STORE == "memory":
+        logger.warning("The in-memory job store is per worker; using the sqlite job store instead")
+        environment["JOB_STORE"] = "sqlite"
+
+    # Benchmark once and hand every worker the result
+    decoders.registry.configure(settings.DECODER_BACKENDS, settings.DECODER_PREFERENCES)
+    if settings.DECODER_BENCHMARK and decoders.registry.initialize():
+        samples = decoders.load_samples(settings.DECODER_BENCHMARK_DIR)
+        if samples:
+            decoders.registry.benchmark(samples)
+            logger.info(f"Decoder preferences: {decoders.registry.preferences}")
+        else:
+            logger.warning(f"No decoder benchmark samples in {settings.DECODER_BENCHMARK_DIR}")
+    environment["DECODER_PREFERENCES"] = json.dumps(decoders.registry.preferences)
+    environment["DECODER_BENCHMARK"] = "false"
+
+    return environment
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=f"Run {settings.PROJECT_NAME} with several workers")
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    environment = worker_environment(workers)
+    os.environ.update(environment)
+    logger.info(
+        f"Starting {workers} workers with {environment['CONVERSION_WORKERS']} conversion processes each"
+    )
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        timeout_graceful_shutdown=settings.SHUTDOWN_DRAIN_SECONDS,
+    )
+
+
+if __name__ == "__main__":
+    main()
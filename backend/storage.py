@@ -0,0 +1,387 @@
+"""
+Storage backends for converted files.
+
+Converted files are stored by name through a `Storage` backend instead of
+being written straight into one flat directory:
+
+- LocalStorage spreads files over a hash-sharded directory tree, so no
+  directory grows large enough to slow down lookups and listings.
+- ObjectStorage keeps files in an S3-compatible bucket, so every server
+  can serve downloads no matter which one did the conversion. It talks to
+  any client with the boto3 S3 interface; DirectoryObjectClient is a
+  stand-in backed by a local directory, for tests and development.
+
+Backends are picklable so conversion workers can write their outputs
+directly.
+"""
+
+import hashlib
+import io
+import os
+import stat
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, Union
+
+# S3 clients are expensive to create, so each process keeps one per endpoint
+_object_clients: Dict[Optional[str], Any] = {}
+
+
+@dataclass
+class StoredObject:
+    """A stored file"""
+    name: str
+    size: int
+    modified: float
+    # Local file holding the contents, when the backend has one
+    path: Optional[Path] = None
+
+
+def write_atomic(path: Path, data: Union[bytes, Iterable[bytes]]) -> int:
+    """
+    Write a file under a hidden temporary name and move it into place
+
+    Readers never see a partly written file, which matters once the name
+    promises fixed contents.
+
+    Args:
+        path: File to write
+        data: Contents, or chunks of them written as they are produced
+
+    Returns:
+        Number of bytes written
+    """
+    temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            size = temp_path.write_bytes(data)
+        else:
+            size = 0
+            with open(temp_path, "wb") as f:
+                for chunk in data:
+                    size += f.write(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return size
+
+
+class Storage:
+    """Interface for storing converted files by name"""
+
+    def put(self, name: str, data: bytes) -> StoredObject:
+        raise NotImplementedError
+
+    def get(self, name: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+        """
+        Read a stored file, or length bytes of it from offset
+
+        Raises:
+            FileNotFoundError: If there is no such file
+        """
+        raise NotImplementedError
+
+    def stat(self, name: str) -> StoredObject:
+        """
+        Raises:
+            FileNotFoundError: If there is no such file
+        """
+        raise NotImplementedError
+
+    def delete(self, name: str) -> None:
+        """Delete a file; deleting a missing file is not an error"""
+        raise NotImplementedError
+
+    def iterate(self) -> Iterator[StoredObject]:
+        """Every stored file, in no particular order"""
+        raise NotImplementedError
+
+    def iter_expired(self, cutoff: float) -> Iterator[StoredObject]:
+        """Stored files last modified before cutoff"""
+        return (obj for obj in self.iterate() if obj.modified < cutoff)
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.stat(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+
+class LocalStorage(Storage):
+    """
+    Files in a directory tree sharded by a hash of their names
+
+    With the default depth of 2, "photo.jpg" is stored as
+    <root>/ab/cd/photo.jpg where abcd... is the SHA-256 of the name.
+
+    Args:
+        root: Directory to store files under
+        shard_depth: Levels of shard directories, 256 directories each
+    """
+
+    def __init__(self, root: Path, shard_depth: int = 2):
+        self.root = Path(root)
+        self.shard_depth = shard_depth
+
+    def path(self, name: str) -> Path:
+        """
+        Location of a file, whether or not it exists
+
+        Raises:
+            FileNotFoundError: If the name cannot be a stored file
+        """
+        if not name or name.startswith(".") or "/" in name or "\\" in name:
+            raise FileNotFoundError(name)
+        digest = hashlib.sha256(name.encode()).hexdigest()
+        shards = [digest[2 * level:2 * level + 2] for level in range(self.shard_depth)]
+        return self.root.joinpath(*shards, name)
+
+    def prepare(self, name: str) -> Path:
+        """Location of a file, with its shard directory created, for writers that stream into it"""
+        path = self.path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def put(self, name: str, data: bytes) -> StoredObject:
+        path = self.prepare(name)
+        write_atomic(path, data)
+        return StoredObject(name, len(data), path.stat().st_mtime, path)
+
+    def get(self, name: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+        with open(self.path(name), "rb") as f:
+            f.seek(offset)
+            return f.read() if length is None else f.read(length)
+
+    def stat(self, name: str) -> StoredObject:
+        path = self.path(name)
+        stat_result = path.stat()
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise FileNotFoundError(name)
+        return StoredObject(name, stat_result.st_size, stat_result.st_mtime, path)
+
+    def delete(self, name: str) -> None:
+        try:
+            self.path(name).unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
+
+    def iterate(self) -> Iterator[StoredObject]:
+        for directory, subdirectories, filenames in os.walk(self.root):
+            # Skip hidden directories and the temporary files of writes in progress
+            subdirectories[:] = [name for name in subdirectories if not name.startswith(".")]
+            for name in filenames:
+                if name.startswith("."):
+                    continue
+                path = Path(directory) / name
+                try:
+                    stat_result = path.stat()
+                except OSError:
+                    continue
+                yield StoredObject(name, stat_result.st_size, stat_result.st_mtime, path)
+
+
+def _is_missing(error: Exception) -> bool:
+    """Whether an object store error means the object does not exist"""
+    if isinstance(error, FileNotFoundError):
+        return True
+    code = getattr(error, "response", {}).get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+class ObjectStorage(Storage):
+    """
+    Files in an S3-compatible object store
+
+    Args:
+        bucket: Bucket to store files in
+        prefix: Prefix of every object key
+        endpoint_url: Endpoint of a store other than AWS S3
+        client: Client with the boto3 S3 interface; a boto3 client is
+            created when not given
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        client: Optional[Any] = None,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self._client = client
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        # boto3 clients cannot be pickled; workers create their own
+        if self._client is not None and self._client is _object_clients.get(self.endpoint_url):
+            state["_client"] = None
+        return state
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            client = _object_clients.get(self.endpoint_url)
+            if client is None:
+                try:
+                    import boto3
+                except ImportError:
+                    raise RuntimeError("The object storage backend needs boto3 installed")
+                client = boto3.client("s3", endpoint_url=self.endpoint_url)
+                _object_clients[self.endpoint_url] = client
+            self._client = client
+        return self._client
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}{name}"
+
+    def put(self, name: str, data: bytes) -> StoredObject:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(name), Body=data)
+        return StoredObject(name, len(data), datetime.now(timezone.utc).timestamp())
+
+    def get(self, name: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+        arguments = {"Bucket": self.bucket, "Key": self._key(name)}
+        if offset or length is not None:
+            end = "" if length is None else offset + length - 1
+            arguments["Range"] = f"bytes={offset}-{end}"
+        try:
+            response = self.client.get_object(**arguments)
+        except Exception as e:
+            if _is_missing(e):
+                raise FileNotFoundError(name) from e
+            raise
+        return response["Body"].read()
+
+    def stat(self, name: str) -> StoredObject:
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except Exception as e:
+            if _is_missing(e):
+                raise FileNotFoundError(name) from e
+            raise
+        return StoredObject(name, response["ContentLength"], response["LastModified"].timestamp())
+
+    def delete(self, name: str) -> None:
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+        except Exception as e:
+            if not _is_missing(e):
+                raise
+
+    def iterate(self) -> Iterator[StoredObject]:
+        arguments = {"Bucket": self.bucket, "Prefix": self.prefix}
+        while True:
+            response = self.client.list_objects_v2(**arguments)
+            for item in response.get("Contents", []):
+                name = item["Key"][len(self.prefix):]
+                if name and "/" not in name:
+                    yield StoredObject(name, item["Size"], item["LastModified"].timestamp())
+            if not response.get("IsTruncated"):
+                break
+            arguments["ContinuationToken"] = response["NextContinuationToken"]
+
+
+class DirectoryObjectClient:
+    """
+    Stand-in for a boto3 S3 client that keeps objects in a local directory
+
+    Implements only the calls ObjectStorage makes. Objects live at
+    <root>/<bucket>/<key>, so separate processes see the same objects.
+    """
+
+    page_size = 1000
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def _path(self, bucket: str, key: str) -> Path:
+        path = self.root / bucket / key
+        if ".." in Path(key).parts:
+            raise FileNotFoundError(key)
+        return path
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs: Any) -> Dict[str, Any]:
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(path, Body)
+        return {}
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, **kwargs: Any) -> Dict[str, Any]:
+        with open(self._path(Bucket, Key), "rb") as f:
+            if Range is None:
+                data = f.read()
+            else:
+                first, _, last = Range.partition("=")[2].partition("-")
+                f.seek(int(first))
+                data = f.read() if not last else f.read(int(last) - int(first) + 1)
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs: Any) -> Dict[str, Any]:
+        stat_result = self._path(Bucket, Key).stat()
+        return {
+            "ContentLength": stat_result.st_size,
+            "LastModified": datetime.fromtimestamp(stat_result.st_mtime, timezone.utc),
+        }
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs: Any) -> Dict[str, Any]:
+        self._path(Bucket, Key).unlink(missing_ok=True)
+        return {}
+
+    def list_objects_v2(
+        self,
+        Bucket: str,
+        Prefix: str = "",
+        ContinuationToken: Optional[str] = None,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        bucket_root = self.root / Bucket
+        keys = sorted(
+            path.relative_to(bucket_root).as_posix()
+            for path in bucket_root.rglob("*")
+            if path.is_file() and not path.name.startswith(".")
+        )
+        keys = [key for key in keys if key.startswith(Prefix) and (ContinuationToken is None or key > ContinuationToken)]
+        page = keys[:self.page_size]
+        contents = []
+        for key in page:
+            stat_result = (bucket_root / key).stat()
+            contents.append({
+                "Key": key,
+                "Size": stat_result.st_size,
+                "LastModified": datetime.fromtimestamp(stat_result.st_mtime, timezone.utc),
+            })
+        response: Dict[str, Any] = {"Contents": contents, "IsTruncated": len(keys) > len(page)}
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+
+def create_storage(
+    kind: str,
+    directory: Path,
+    shard_depth: int = 2,
+    bucket: str = "",
+    prefix: str = "",
+    endpoint_url: Optional[str] = None,
+) -> Storage:
+    """
+    Create the storage backend selected in settings
+
+    Args:
+        kind: "local", "object" for an S3-compatible store, or
+            "object-local" for the object store code path backed by
+            DirectoryObjectClient in directory
+        directory: Root of the local backend or of the stand-in client
+    """
+    if kind == "local":
+        return LocalStorage(directory, shard_depth)
+    if kind == "object":
+        return ObjectStorage(bucket, prefix, endpoint_url)
+    if kind == "object-local":
+        return ObjectStorage(bucket or "converted", prefix, client=DirectoryObjectClient(directory))
+    raise ValueError(f"Unknown storage backend '{kind}'")
@@ -0,0 +1,217 @@
+"""
+Tile-streamed JPEG conversion of large grid images.
+
+Large HEIF photos are stored as a grid of separately coded tiles. When the
+output is a full-size JPEG with no transforms, the whole image never has
+to be in memory: tiles are decoded one row at a time, and each band of
+rows is encoded as soon as it is complete.
+
+Each band is encoded by Pillow as a separate baseline JPEG with the same
+settings, so every band has the same quantization and Huffman tables. The
+bands' entropy-coded data are joined with restart markers into a single
+JPEG; a restart marker resets the DC predictors, so the segments decode
+independently. Every segment but the last must hold the same number of
+MCUs, so bands are cut to one fixed height, a multiple of the MCU height,
+from the decoded tile rows. The result decodes to the same pixels as
+encoding the full image at once.
+"""
+
+import io
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+from PIL import Image
+
+from config import settings
+from decoders import decode
+from heif_container import HeifFormatError, HeifGrid, HeifHeader, extract_image, read_grid
+from transforms import plan_transforms
+
+Source = Union[Path, bytes]
+
+# Height and width of an MCU with 4:2:0 chroma subsampling
+MCU_SIZE = 16
+
+# Largest restart interval, in MCUs, that the DRI marker can hold
+MAX_RESTART_INTERVAL = 0xFFFF
+
+# Properties of the grid image that transform the composed image
+_TRANSFORM_PROPERTIES = ("irot", "imir", "clap")
+
+
+def band_height(header: HeifHeader) -> Optional[int]:
+    """
+    Rows per encoded band of a grid image, or None if it cannot be streamed
+
+    Bands are as tall as a tile row, rounded down to whole MCUs, unless that
+    makes a restart interval too long for very wide images.
+    """
+    primary = header.primary_item
+    tile_ids = primary.references.get("dimg", [])
+    if not tile_ids or any(tile_id not in header.items for tile_id in tile_ids):
+        return None
+    tile_sizes = {header.items[tile_id].size for tile_id in tile_ids}
+    if len(tile_sizes) != 1 or None in tile_sizes:
+        return None
+    _, tile_height = tile_sizes.pop()
+
+    width, _ = header.size
+    mcus_per_row = -(-width // MCU_SIZE)
+    if mcus_per_row > MAX_RESTART_INTERVAL:
+        return None
+    mcu_rows = min(max(1, tile_height // MCU_SIZE), MAX_RESTART_INTERVAL // mcus_per_row)
+    return mcu_rows * MCU_SIZE
+
+
+def can_stream(
+    header: HeifHeader,
+    formats: Sequence[str] = ("jpeg",),
+    resize: bool = False,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    maintain_aspect_ratio: bool = True,
+    rotate: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> bool:
+    """
+    Whether a conversion can be streamed tile row by tile row
+
+    Only large grid images converted to a single JPEG qualify, and only
+    when no transform needs the whole image: no resize, rotation or
+    container transform, and no max_bytes, which needs repeated encodes.
+    Images with alpha take the regular path, which flattens the alpha
+    plane; the tiles alone do not carry it.
+    """
+    if not settings.GRID_STREAMING_MIN_PIXELS or not header.is_grid or header.has_alpha:
+        return False
+    if header.pixel_count < settings.GRID_STREAMING_MIN_PIXELS:
+        return False
+    if list(formats) != ["jpeg"] or max_bytes is not None:
+        return False
+    if any(header.primary_item.get_property(box_type) for box_type in _TRANSFORM_PROPERTIES):
+        return False
+    if not plan_transforms(header.size, rotate, resize, width, height, maintain_aspect_ratio).is_identity:
+        return False
+    return band_height(header) is not None
+
+
+def _decode_tile(source: Source, header: HeifHeader, tile_id: int) -> Image.Image:
+    tile = decode(extract_image(source, header, tile_id))
+    if tile.mode != "RGB":
+        tile = tile.convert("RGB")
+    return tile
+
+
+def _tile_rows(source: Source, header: HeifHeader, grid: HeifGrid) -> Iterator[Image.Image]:
+    """Rows of tiles composed into bands of the full width, cropped to the grid size"""
+    tile_width, tile_height = header.items[grid.tile_ids[0]].size
+    for row in range(grid.rows):
+        top = row * tile_height
+        if top >= grid.height:
+            break
+        band = Image.new("RGB", (grid.width, min(tile_height, grid.height - top)))
+        for column in range(grid.columns):
+            if column * tile_width >= grid.width:
+                break
+            # Pasting clips tiles that overhang the right and bottom edges
+            band.paste(_decode_tile(source, header, grid.tile_ids[row * grid.columns + column]), (column * tile_width, 0))
+        yield band
+
+
+def _bands(rows: Iterator[Image.Image], height: int) -> Iterator[Image.Image]:
+    """Cut a stream of row bands of any height into bands of exactly `height` rows, except the last"""
+    pending: Optional[Image.Image] = None
+    for rows_image in rows:
+        if pending is None:
+            pending = rows_image
+        else:
+            joined = Image.new("RGB", (pending.width, pending.height + rows_image.height))
+            joined.paste(pending, (0, 0))
+            joined.paste(rows_image, (0, pending.height))
+            pending = joined
+
+        while pending is not None and pending.height >= height:
+            if pending.height == height:
+                yield pending
+                pending = None
+            else:
+                yield pending.crop((0, 0, pending.width, height))
+                pending = pending.crop((0, height, pending.width, pending.height))
+
+    if pending is not None:
+        yield pending
+
+
+def _split_jpeg(data: bytes) -> Tuple[List[bytes], bytes, bytes]:
+    """
+    Split a baseline JPEG into its header segments, SOS segment and entropy-coded data
+
+    Raises:
+        HeifFormatError: If the encoder output has an unexpected layout
+    """
+    if data[:2] != b"\xff\xd8" or data[-2:] != b"\xff\xd9":
+        raise HeifFormatError("Unexpected JPEG encoder output")
+    segments = []
+    position = 2
+    while position + 4 <= len(data) and data[position] == 0xFF:
+        marker = data[position + 1]
+        end = position + 2 + int.from_bytes(data[position + 2:position + 4], "big")
+        if marker == 0xDA:
+            return segments, data[position:end], data[end:-2]
+        segments.append(data[position:end])
+        position = end
+    raise HeifFormatError("Unexpected JPEG encoder output")
+
+
+def encode_bands(bands: Iterator[Image.Image], size: Tuple[int, int], height: int, quality: int) -> Iterator[bytes]:
+    """
+    Encode bands of an image into one JPEG, yielding it a band at a time
+
+    Args:
+        bands: Bands of the full width, each `height` rows except the last
+        size: Width and height of the whole image
+        height: Rows per band, a multiple of MCU_SIZE
+        quality: JPEG quality (1-100)
+    """
+    width, total_height = size
+    restart_interval = -(-width // MCU_SIZE) * (height // MCU_SIZE)
+
+    for index, band in enumerate(bands):
+        buffer = io.BytesIO()
+        # Fixed 4:2:0 subsampling and standard Huffman tables keep the bands compatible
+        band.save(buffer, format="JPEG", quality=quality, subsampling=2, optimize=False, progressive=False)
+        segments, sos, entropy = _split_jpeg(buffer.getvalue())
+
+        if index == 0:
+            header = [b"\xff\xd8"]
+            for segment in segments:
+                if segment[1] == 0xC0:
+                    # SOF0: the frame is the whole image, not this band
+                    segment = segment[:5] + total_height.to_bytes(2, "big") + segment[7:]
+                header.append(segment)
+            header.append(b"\xff\xdd\x00\x04" + restart_interval.to_bytes(2, "big"))
+            yield b"".join(header) + sos + entropy
+        else:
+            yield bytes([0xFF, 0xD0 + (index - 1) % 8]) + entropy
+
+    yield b"\xff\xd9"
+
+
+def stream_grid_jpeg(source: Source, header: HeifHeader, quality: int) -> Iterator[bytes]:
+    """
+    Convert a grid image to JPEG a tile row at a time
+
+    Peak memory is a few tile rows, whatever the size of the image. Check
+    can_stream() first.
+
+    Args:
+        source: Path to the HEIC file or its contents
+        header: Parsed header of the file
+        quality: JPEG quality (1-100)
+
+    Returns:
+        The JPEG, in chunks of about one band each
+    """
+    grid = read_grid(source, header)
+    height = band_height(header)
+    return encode_bands(_bands(_tile_rows(source, header, grid), height), (grid.width, grid.height), height, quality)
@@ -0,0 +1,73 @@
+"""
+Shared fixtures.
+
+HEIF files are built in memory with the container writer in
+heif_container, so most tests need no HEVC codec: the parser never looks
+at the coded image data. Tests that decode real pixels use the
+`heic_bytes` fixture, which is skipped when pillow-heif is not installed.
+"""
+
+import io
+import struct
+from typing import Callable, List, Optional, Tuple
+
+import pytest
+from PIL import ExifTags, Image
+
+from heif_container import HeifProperty, _build_heif, build_grid_heif, build_single_image_heif
+
+
+def ispe(width: int, height: int) -> HeifProperty:
+    return HeifProperty("ispe", b"\x00" * 4 + struct.pack(">II", width, height))
+
+
+def exif_block(**tags: str) -> bytes:
+    """A minimal EXIF block with IFD0 string tags, e.g. Make="Acme" """
+    exif = Image.Exif()
+    for name, value in tags.items():
+        exif[getattr(ExifTags.Base, name)] = value
+    return exif.tobytes()
+
+
+@pytest.fixture
+def make_heif() -> Callable[..., bytes]:
+    """Factory for a single-image HEIF file with placeholder coded data"""
+
+    def make(
+        width: int = 64,
+        height: int = 48,
+        data: bytes = b"\x00" * 256,
+        exif: Optional[bytes] = None,
+        properties: Optional[List[HeifProperty]] = None,
+    ) -> bytes:
+        properties = [ispe(width, height), *(properties or [])]
+        if exif is None:
+            return build_single_image_heif("hvc1", properties, data)
+        items = [
+            (1, "hvc1", False, properties, data),
+            (2, "Exif", True, [], b"\x00\x00\x00\x00" + exif),
+        ]
+        return _build_heif(b"heic", 1, items, [("cdsc", 2, [1])])
+
+    return make
+
+
+@pytest.fixture
+def make_grid() -> Callable[..., bytes]:
+    """Factory for a grid HEIF file with placeholder tiles"""
+
+    def make(rows: int = 2, columns: int = 3, tile: Tuple[int, int] = (64, 64), size: Optional[Tuple[int, int]] = None) -> bytes:
+        tiles = [("hvc1", [ispe(*tile)], bytes([index]) * 32) for index in range(rows * columns)]
+        return build_grid_heif(tiles, rows, columns, size or (columns * tile[0], rows * tile[1]))
+
+    return make
+
+
+@pytest.fixture(scope="session")
+def heic_bytes() -> bytes:
+    """A real 96x64 HEIC photo, with a gradient so encoders have detail to work with"""
+    pillow_heif = pytest.importorskip("pillow_heif")
+    image = Image.linear_gradient("L").resize((96, 64)).convert("RGB")
+    buffer = io.BytesIO()
+    pillow_heif.from_pillow(image).save(buffer, quality=90)
+    return buffer.getvalue()
@@ -0,0 +1,122 @@
+import json
+import os
+
+import pytest
+
+import bulk
+from bulk import Manifest, SourceFile, has_namesake, namesakes, options_hash, output_path_for, walk_sources
+
+DIGEST = options_hash({"quality": 90})
+
+
+def entry(path: str, size: int = 100, mtime_ns: int = 1, options: str = DIGEST) -> dict:
+    return {"path": path, "size": size, "mtime_ns": mtime_ns, "options": options, "output": path.replace(".heic", ".jpg")}
+
+
+@pytest.fixture
+def destination(tmp_path):
+    directory = tmp_path / "out"
+    directory.mkdir()
+    for name in ("a.jpg", "b.jpg"):
+        (directory / name).write_bytes(b"jpeg")
+    return directory
+
+
+def test_resume_from_recorded_entries(destination):
+    manifest = Manifest(destination / "manifest.jsonl")
+    manifest.load()
+    manifest.record(entry("a.heic"))
+    manifest.record(entry("b.heic"))
+    manifest.close()
+
+    resumed = Manifest(destination / "manifest.jsonl")
+    resumed.load()
+    assert resumed.is_current(SourceFile("a.heic", 100, 1), DIGEST, destination)
+    assert resumed.is_current(SourceFile("b.heic", 100, 1), DIGEST, destination)
+    # Changed source, different options or a missing output all mean converting again
+    assert not resumed.is_current(SourceFile("a.heic", 101, 1), DIGEST, destination)
+    assert not resumed.is_current(SourceFile("a.heic", 100, 2), DIGEST, destination)
+    assert not resumed.is_current(SourceFile("a.heic", 100, 1), options_hash({"quality": 80}), destination)
+    assert not resumed.is_current(SourceFile("c.heic", 100, 1), DIGEST, destination)
+    (destination / "b.jpg").unlink()
+    assert not resumed.is_current(SourceFile("b.heic", 100, 1), DIGEST, destination)
+
+
+def test_line_cut_short_by_a_crash_is_ignored(destination):
+    path = destination / "manifest.jsonl"
+    path.write_text(json.dumps(entry("a.heic")) + "\n" + json.dumps(entry("b.heic"))[:20])
+
+    manifest = Manifest(path)
+    manifest.load()
+    assert list(manifest.entries) == ["a.heic"]
+
+
+def test_later_lines_win_and_superseded_lines_are_compacted(destination):
+    path = destination / "manifest.jsonl"
+    path.write_text("".join(json.dumps(entry("a.heic", mtime_ns=n)) + "\n" for n in range(1500)))
+
+    manifest = Manifest(path)
+    manifest.load()
+    assert manifest.entries["a.heic"]["mtime_ns"] == 1499
+    assert len(path.read_text().splitlines()) == 1
+
+
+def test_walk_sources_skips_hidden_and_other_files(tmp_path):
+    for name in ("a.heic", "b.HEIF", "c.jpg", ".hidden.heic", "sub/d.heic", ".cache/e.heic"):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b"x")
+    assert sorted(source.path for source in walk_sources(tmp_path)) == ["a.heic", "b.HEIF", "sub/d.heic"]
+
+
+def test_run_resumes(tmp_path, heic_bytes, capsys):
+    source, destination = tmp_path / "in", tmp_path / "out"
+    (source / "sub").mkdir(parents=True)
+    for name in ("a.heic", "sub/b.heic"):
+        (source / name).write_bytes(heic_bytes)
+    (source / "broken.heic").write_bytes(b"not a heic file")
+
+    assert bulk.run(source, destination, {"quality": 80}, workers=1) == 1
+    assert (destination / "a.jpg").is_file() and (destination / "sub/b.jpg").is_file()
+    converted = (destination / "a.jpg").stat().st_mtime_ns
+
+    # Only the file that failed is tried again
+    assert bulk.run(source, destination, {"quality": 80}, workers=1) == 1
+    assert "1 files to convert, 2 up to date" in capsys.readouterr().err
+    assert (destination / "a.jpg").stat().st_mtime_ns == converted
+
+    # A changed source is converted again
+    os.utime(source / "a.heic", ns=(converted, converted + 10 ** 9))
+    (source / "broken.heic").unlink()
+    assert bulk.run(source, destination, {"quality": 80}, workers=1) == 0
+    assert "1 files to convert, 1 up to date" in capsys.readouterr().err
+
+    # So is everything, when the options change
+    assert bulk.run(source, destination, {"quality": 70}, workers=1) == 0
+    assert "2 files to convert, 0 up to date" in capsys.readouterr().err
+
+
+def test_namesakes_keep_their_extension(tmp_path):
+    paths = ["IMG_1.heic", "IMG_1.HEIF", "img_2.heic", "sub/IMG_1.heic", "sub/img_2.HEIC"]
+    assert namesakes(paths) == {"IMG_1.heic", "IMG_1.HEIF"}
+    assert output_path_for("IMG_1.HEIF") == "IMG_1.jpg"
+    assert output_path_for("IMG_1.HEIF", keep_extension=True) == "IMG_1.HEIF.jpg"
+
+    for name in ("IMG_1.heic", "img_1.heif", "IMG_2.heic", "IMG_2.jpg"):
+        (tmp_path / name).write_bytes(b"x")
+    assert has_namesake(tmp_path, "IMG_1.heic") and has_namesake(tmp_path, "img_1.heif")
+    # Only other HEIC/HEIF files count
+    assert not has_namesake(tmp_path, "IMG_2.heic")
+
+
+def test_run_keeps_namesakes_apart(tmp_path, heic_bytes):
+    source, destination = tmp_path / "in", tmp_path / "out"
+    source.mkdir()
+    for name in ("IMG_1.heic", "IMG_1.HEIF", "IMG_2.heic"):
+        (source / name).write_bytes(heic_bytes)
+
+    assert bulk.run(source, destination, {"quality": 80}, workers=1) == 0
+    assert sorted(path.name for path in destination.glob("*.jpg")) == ["IMG_1.HEIF.jpg", "IMG_1.heic.jpg", "IMG_2.jpg"]
+
+    manifest = Manifest(destination / bulk.MANIFEST_NAME)
+    manifest.load()
+    assert {entry["output"] for entry in manifest.entries.values()} == {"IMG_1.heic.jpg", "IMG_1.HEIF.jpg", "IMG_2.jpg"}
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+
+from cache import CachedOutput, CacheEntry, ConversionCache
+from storage import LocalStorage
+
+
+class Conversions:
+    """Factories that write one output of a given size, optionally held until released"""
+
+    def __init__(self, storage: LocalStorage):
+        self.storage = storage
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    def factory(self, name: str, size: int = 100):
+        async def convert() -> CacheEntry:
+            self.calls += 1
+            await self.release.wait()
+            self.storage.put(name, b"x" * size)
+            return CacheEntry([CachedOutput("jpeg", name, size)], original_size=size, conversion_time=0.1)
+        return convert
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(tmp_path)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine())
+
+
+async def settle() -> None:
+    """Let done callbacks and executor deletions finish"""
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+
+
+def test_concurrent_duplicates_share_one_conversion(storage):
+    async def scenario():
+        cache = ConversionCache(storage, max_bytes=10 ** 6, ttl_seconds=60)
+        conversions = Conversions(storage)
+        conversions.release.clear()
+
+        first = asyncio.create_task(cache.get_or_create("k", conversions.factory("a.jpg")))
+        second = asyncio.create_task(cache.get_or_create("k", conversions.factory("b.jpg")))
+        await settle()
+        conversions.release.set()
+
+        (entry, cached), (shared, shared_cached) = await asyncio.gather(first, second)
+        assert conversions.calls == 1
+        assert shared is entry
+        assert (cached, shared_cached) == (False, True)
+        assert (cache.misses, cache.coalesced) == (1, 1)
+
+        # Finished conversions are hits from then on
+        assert await cache.get_or_create("k", conversions.factory("c.jpg")) == (entry, True)
+        assert conversions.calls == 1
+
+    run(scenario)
+
+
+def test_cancelled_caller_does_not_cancel_the_conversion(storage):
+    async def scenario():
+        cache = ConversionCache(storage, max_bytes=10 ** 6, ttl_seconds=60)
+        conversions = Conversions(storage)
+        conversions.release.clear()
+
+        first = asyncio.create_task(cache.get_or_create("k", conversions.factory("a.jpg")))
+        await settle()
+        second = asyncio.create_task(cache.get_or_create("k", conversions.factory("b.jpg")))
+        await settle()
+
+        # The client that started the conversion disconnects
+        first.cancel()
+        await settle()
+        conversions.release.set()
+
+        entry, cached = await second
+        assert first.cancelled()
+        assert (entry.output_filename, cached) == ("a.jpg", True)
+        assert conversions.calls == 1
+        assert len(cache) == 1
+
+    run(scenario)
+
+
+def test_least_recently_used_is_evicted_over_the_byte_limit(storage):
+    async def scenario():
+        deleted = []
+        cache = ConversionCache(storage, max_bytes=250, ttl_seconds=60, on_delete=deleted.append)
+        conversions = Conversions(storage)
+
+        await cache.get_or_create("a", conversions.factory("a.jpg"))
+        await cache.get_or_create("b", conversions.factory("b.jpg"))
+        await settle()
+        # A hit makes "a" the most recently used
+        assert (await cache.get_or_create("a", conversions.factory("a.jpg")))[1]
+
+        await cache.get_or_create("c", conversions.factory("c.jpg"))
+        await settle()
+
+        assert (len(cache), cache.total_bytes, cache.evictions) == (2, 200, 1)
+        assert deleted == ["b.jpg"]
+        assert not storage.exists("b.jpg")
+        assert storage.exists("a.jpg") and storage.exists("c.jpg")
+
+    run(scenario)
+
+
+def test_expired_and_missing_outputs_are_converted_again(storage):
+    async def scenario():
+        cache = ConversionCache(storage, max_bytes=10 ** 6, ttl_seconds=60)
+        conversions = Conversions(storage)
+
+        await cache.get_or_create("k", conversions.factory("a.jpg"))
+        await settle()
+        # Removed behind the cache's back, e.g. by the temp file cleanup
+        storage.delete("a.jpg")
+        assert (await cache.get_or_create("k", conversions.factory("b.jpg")))[1] is False
+        await settle()
+
+        cache.ttl_seconds = 0
+        assert (await cache.get_or_create("k", conversions.factory("c.jpg")))[1] is False
+        await settle()
+        assert not storage.exists("b.jpg")
+        assert (conversions.calls, cache.misses, cache.hits) == (3, 3, 0)
+
+    run(scenario)
@@ -0,0 +1,146 @@
+import asyncio
+from email.utils import formatdate
+
+import pytest
+from starlette.datastructures import Headers
+
+from downloads import DownloadResponse, content_disposition, parse_range, stat_and_etag
+from storage import LocalStorage
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", [(0, 99)]),
+        ("bytes=100-", [(100, 1023)]),
+        ("bytes=-24", [(1000, 1023)]),
+        ("bytes=-5000", [(0, 1023)]),
+        ("bytes=1000-5000", [(1000, 1023)]),
+        ("bytes=0-0, 10-19", [(0, 0), (10, 19)]),
+        # Unsatisfiable ranges are dropped
+        ("bytes=2000-", []),
+        ("bytes=-0", []),
+        ("bytes=2000-, 0-9", [(0, 9)]),
+        # Malformed or in another unit: ignored
+        ("bytes=9-0", None),
+        ("bytes=abc-", None),
+        ("bytes=10", None),
+        ("bytes=", None),
+        ("items=0-9", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, len(CONTENT)) == expected
+
+
+@pytest.fixture
+def download(tmp_path):
+    storage = LocalStorage(tmp_path)
+    storage.put("photo.jpg", CONTENT)
+    stored, etag = stat_and_etag(storage, "photo.jpg")
+    return DownloadResponse(storage, stored, etag, "image/jpeg", filename="photo.jpg")
+
+
+def evaluate(download, **headers):
+    return download._evaluate(Headers({name.replace("_", "-"): value for name, value in headers.items()}))
+
+
+def test_etag_is_strong_and_stable(tmp_path, download):
+    etag = download.headers["etag"]
+    assert etag.startswith('"') and not etag.startswith("W/")
+    assert stat_and_etag(download.storage, "photo.jpg")[1] == etag
+
+
+def test_conditional_get(download):
+    etag = download.headers["etag"]
+    modified = formatdate(download.stored.modified + 1, usegmt=True)
+    earlier = formatdate(download.stored.modified - 3600, usegmt=True)
+
+    assert evaluate(download) == (200, None)
+    assert evaluate(download, if_none_match=etag) == (304, None)
+    assert evaluate(download, if_none_match=f'"other", {etag}') == (304, None)
+    assert evaluate(download, if_none_match="*") == (304, None)
+    assert evaluate(download, if_none_match='"other"') == (200, None)
+    assert evaluate(download, if_modified_since=modified) == (304, None)
+    assert evaluate(download, if_modified_since=earlier) == (200, None)
+    # If-None-Match takes precedence over If-Modified-Since
+    assert evaluate(download, if_none_match='"other"', if_modified_since=modified) == (200, None)
+
+
+def test_ranges(download):
+    etag = download.headers["etag"]
+    earlier = formatdate(download.stored.modified - 3600, usegmt=True)
+
+    assert evaluate(download, range="bytes=10-19") == (206, (10, 19))
+    assert evaluate(download, range="bytes=5000-") == (416, None)
+    # Several ranges or a malformed header get the whole file
+    assert evaluate(download, range="bytes=0-1,5-6") == (200, None)
+    assert evaluate(download, range="lines=1-2") == (200, None)
+    # If-Range: the range only applies while the client's copy is current
+    assert evaluate(download, range="bytes=10-19", if_range=etag) == (206, (10, 19))
+    assert evaluate(download, range="bytes=10-19", if_range='"stale"') == (200, None)
+    assert evaluate(download, range="bytes=10-19", if_range=earlier) == (200, None)
+
+
+def send_request(download, method="GET", **headers):
+    scope = {
+        "type": "http",
+        "method": method,
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(download(scope, receive, send))
+    start = messages[0]
+    return start["status"], Headers(raw=start["headers"]), b"".join(m.get("body", b"") for m in messages[1:])
+
+
+def test_response_bodies(download):
+    status, headers, body = send_request(download, range="bytes=-16")
+    assert status == 206
+    assert headers["content-range"] == "bytes 1008-1023/1024"
+    assert body == CONTENT[-16:]
+    assert download.sent_bytes == 16
+
+
+def test_full_and_head_responses(download):
+    status, headers, body = send_request(download)
+    assert (status, body) == (200, CONTENT)
+    assert headers["accept-ranges"] == "bytes"
+    assert headers["content-disposition"] == 'attachment; filename="photo.jpg"'
+
+    status, headers, body = send_request(download, method="HEAD")
+    assert (status, headers["content-length"], body) == (200, "1024", b"")
+
+
+def test_not_modified_and_unsatisfiable(download):
+    status, headers, body = send_request(download, if_none_match=download.headers["etag"])
+    assert (status, body) == (304, b"")
+    assert "content-type" not in headers
+
+    status, headers, body = send_request(download, range="bytes=4096-")
+    assert (status, headers["content-range"], body) == (416, "bytes */1024", b"")
+
+
+@pytest.mark.parametrize(
+    "filename, expected",
+    [
+        ("photo.jpg", 'inline; filename="photo.jpg"'),
+        ("写真.jpg", "inline; filename=\"__.jpg\"; filename*=utf-8''%E5%86%99%E7%9C%9F.jpg"),
+        ('say "cheese".jpg', "inline; filename=\"say _cheese_.jpg\"; filename*=utf-8''say%20%22cheese%22.jpg"),
+        ("a\r\nb.jpg", "inline; filename=\"a__b.jpg\"; filename*=utf-8''a%0D%0Ab.jpg"),
+    ],
+)
+def test_content_disposition(filename, expected):
+    value = content_disposition("inline", filename)
+    assert value == expected
+    # Header values must be latin-1 encodable
+    value.encode("latin-1")
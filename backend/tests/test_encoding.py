@@ -0,0 +1,64 @@
+import io
+
+import pytest
+from PIL import Image
+
+from formats import FORMATS, encode_image
+from utils import TargetSizeError, encode_to_size, encode_with_options
+
+
+@pytest.fixture(scope="module")
+def photo() -> Image.Image:
+    """A deterministic image with enough detail that size falls steadily with quality"""
+    size = (320, 240)
+    fractal = Image.effect_mandelbrot(size, (-2.0, -1.2, 1.0, 1.2), 64)
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (fractal, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+
+def test_fits_at_requested_quality(photo):
+    data, quality, passes = encode_to_size(photo, 10 ** 7, quality=90)
+    assert (quality, passes) == (90, 1)
+    assert data == encode_image(photo, "jpeg", 90)
+
+
+@pytest.mark.parametrize("fraction", [0.8, 0.5, 0.3, 0.15])
+def test_best_quality_within_budget(photo, fraction):
+    max_bytes = int(len(encode_image(photo, "jpeg", 95)) * fraction)
+    data, quality, passes = encode_to_size(photo, max_bytes, quality=95, max_passes=100)
+
+    assert len(data) <= max_bytes
+    assert data == encode_image(photo, "jpeg", quality)
+    # With passes to spare the search ends on neighbouring qualities
+    assert len(encode_image(photo, "jpeg", quality + 1)) > max_bytes
+
+
+def test_pass_limit(photo):
+    max_bytes = len(encode_image(photo, "jpeg", 95)) // 3
+    data, quality, passes = encode_to_size(photo, max_bytes, quality=95, max_passes=3)
+    assert passes <= 3
+    assert len(data) <= max_bytes
+    assert Image.open(io.BytesIO(data)).size == photo.size
+
+
+def test_does_not_fit(photo):
+    with pytest.raises(TargetSizeError):
+        encode_to_size(photo, 100, quality=95, min_quality=10)
+
+
+def test_other_lossy_formats(photo):
+    if not FORMATS["webp"].supported:
+        pytest.skip("Pillow was built without WebP")
+    max_bytes = len(encode_image(photo, "webp", 90)) // 2
+    data, quality, _ = encode_to_size(photo, max_bytes, quality=90, output_format="webp")
+    assert len(data) <= max_bytes
+    assert Image.open(io.BytesIO(data)).format == "WEBP"
+
+
+def test_lossless_formats_are_encoded_once(photo):
+    data, quality, passes = encode_with_options(photo, "png")
+    assert (quality, passes) == (None, 1)
+    assert Image.open(io.BytesIO(data)).format == "PNG"
+
+    with pytest.raises(TargetSizeError):
+        encode_with_options(photo, "png", max_bytes=100)
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+import pytest
+
+from executor import ConversionExecutor, WorkerCrashedError
+
+
+def run(coroutine):
+    return asyncio.run(coroutine())
+
+
+def make_executor(workers: int = 1) -> ConversionExecutor:
+    return ConversionExecutor(max_workers=workers, max_queue_size=4, job_timeout=30)
+
+
+def test_runs_jobs_in_workers():
+    async def scenario():
+        executor = make_executor()
+        try:
+            assert await asyncio.gather(executor.run(pow, 2, 10), executor.run(pow, 3, 2)) == [1024, 9]
+            assert executor.pending == 0
+        finally:
+            executor.shutdown()
+
+    run(scenario)
+
+
+def test_shutdown_while_jobs_run():
+    async def scenario():
+        executor = make_executor(workers=2)
+        crashed = asyncio.create_task(executor.run(time.sleep, 30))
+        cancelled = asyncio.create_task(executor.run(time.sleep, 30))
+        await asyncio.sleep(0.5)
+        workers = list(executor._workers)
+
+        # As on app shutdown: running requests are cancelled and the workers stopped
+        cancelled.cancel()
+        executor.shutdown()
+        # Jobs in flight end without touching the stopped executor's state
+        with pytest.raises(WorkerCrashedError):
+            await crashed
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert (executor.pending, executor._workers) == (0, [])
+        # No replacement workers are started for the interrupted jobs
+        await asyncio.sleep(0.1)
+        assert not any(worker.process.is_alive() for worker in workers)
+
+        # The executor starts again on its next job
+        assert await executor.run(pow, 2, 3) == 8
+        executor.shutdown()
+
+    run(scenario)
@@ -0,0 +1,63 @@
+import io
+
+import pytest
+from PIL import Image
+
+from formats import FORMATS, encode_image, flatten
+from utils import convert_heic_bytes
+
+
+def half_transparent() -> Image.Image:
+    """Red on the left, fully transparent on the right"""
+    image = Image.new("RGBA", (64, 32), (255, 0, 0, 255))
+    image.paste((0, 0, 255, 0), (32, 0, 64, 32))
+    return image
+
+
+def decoded(data: bytes) -> Image.Image:
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image
+
+
+def test_flatten():
+    flat = flatten(half_transparent())
+    assert flat.mode == "RGB"
+    assert flat.getpixel((0, 0)) == (255, 0, 0)
+    # Transparent areas take the background, not the colour hidden under them
+    assert flat.getpixel((63, 0)) == (255, 255, 255)
+
+    rgb = Image.new("RGB", (4, 4))
+    assert flatten(rgb) is rgb
+    assert flatten(Image.new("L", (4, 4))).mode == "RGB"
+
+
+@pytest.mark.parametrize("name", [name for name, fmt in FORMATS.items() if fmt.alpha])
+def test_alpha_formats_keep_transparency(name):
+    if not FORMATS[name].supported:
+        pytest.skip(f"{name} is not available")
+    image = decoded(encode_image(half_transparent(), name))
+    assert image.mode == "RGBA"
+    assert image.getpixel((63, 0))[3] == 0
+    assert image.getpixel((0, 0))[3] == 255
+
+
+def test_jpeg_flattens_onto_background():
+    image = decoded(encode_image(half_transparent(), "jpeg", 95))
+    assert image.mode == "RGB"
+    assert all(channel > 240 for channel in image.getpixel((60, 16)))
+
+
+@pytest.fixture(scope="module")
+def alpha_heic() -> bytes:
+    pillow_heif = pytest.importorskip("pillow_heif")
+    buffer = io.BytesIO()
+    pillow_heif.from_pillow(half_transparent()).save(buffer, quality=90)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("name, mode", [("png", "RGBA"), ("jpeg", "RGB")])
+def test_alpha_survives_transforms(alpha_heic, name, mode):
+    outputs, _ = convert_heic_bytes(alpha_heic, formats=[name], rotate=90, resize=True, width=16)
+    image = decoded(outputs[0]["data"])
+    assert (image.mode, image.size) == (mode, (16, 32))
@@ -0,0 +1,116 @@
+import io
+
+import pytest
+
+from heif_container import HeifFormatError, read_exif, read_grid, read_heif_header, read_item_data, validate_heif_header
+from metadata import parse_exif
+from utils import probe_heic_file
+
+from conftest import exif_block
+
+
+def test_valid_file(make_heif):
+    data = make_heif(640, 480, data=b"coded")
+    header = read_heif_header(data)
+    validate_heif_header(header)
+
+    assert header.size == (640, 480)
+    assert header.major_brand == "heic"
+    assert not header.is_grid
+    assert header.bit_depth == 8
+    assert len(header.images) == 1
+    assert read_item_data(data, header, header.primary_item) == b"coded"
+
+
+def test_sources_agree(make_heif, tmp_path):
+    data = make_heif(123, 45)
+    path = tmp_path / "image.heic"
+    path.write_bytes(data)
+
+    for source in (data, path, str(path), io.BytesIO(data)):
+        assert read_heif_header(source).size == (123, 45)
+
+
+def test_grid(make_grid):
+    data = make_grid(rows=2, columns=3, tile=(64, 64), size=(180, 100))
+    header = read_heif_header(data)
+    validate_heif_header(header)
+
+    assert header.is_grid
+    assert header.size == (180, 100)
+    # Tiles are parts of the grid, not images of their own
+    assert len(header.images) == 1
+
+    grid = read_grid(data, header)
+    assert (grid.rows, grid.columns, grid.width, grid.height) == (2, 3, 180, 100)
+    assert [read_item_data(data, header, header.items[tile_id])[:1] for tile_id in grid.tile_ids] == [
+        bytes([index]) for index in range(6)
+    ]
+
+
+def test_exif(make_heif):
+    data = make_heif(exif=exif_block(Make="Acme", Model="Pocket 3"))
+    header = read_heif_header(data)
+
+    assert parse_exif(read_exif(data, header)) == {"make": "Acme", "model": "Pocket 3"}
+    assert read_exif(make_heif(), read_heif_header(make_heif())) is None
+
+
+@pytest.mark.parametrize("end", [4, 11, 24, 40, 100, -200, -1])
+def test_truncated(make_heif, end):
+    data = make_heif(data=b"\x00" * 256)
+    assert probe_heic_file(data[:end]) is None
+
+
+def test_truncated_grid_tile(make_grid):
+    data = make_grid()
+    header = read_heif_header(data[:-10])
+    with pytest.raises(HeifFormatError, match="truncated"):
+        validate_heif_header(header)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"not an image at all",
+        # JPEG and PNG signatures with a .heic name
+        b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + b"\x00" * 64,
+        b"\x89PNG\r\n\x1a\n" + b"\x00" * 64,
+        # An MP4 file: an ftyp box, but no HEIF brand
+        b"\x00\x00\x00\x18ftypisom\x00\x00\x02\x00isomiso2" + b"\x00" * 64,
+    ],
+    ids=["empty", "text", "jpeg", "png", "mp4"],
+)
+def test_spoofed(data):
+    with pytest.raises(HeifFormatError):
+        read_heif_header(data)
+    assert probe_heic_file(data) is None
+
+
+def test_missing_meta(make_heif):
+    data = make_heif()
+    ftyp_size = int.from_bytes(data[:4], "big")
+    with pytest.raises(HeifFormatError, match="meta"):
+        read_heif_header(data[:ftyp_size])
+
+
+def test_box_larger_than_file(make_heif):
+    data = bytearray(make_heif())
+    meta = int.from_bytes(data[:4], "big")
+    data[meta:meta + 4] = (len(data) * 2).to_bytes(4, "big")
+    with pytest.raises(HeifFormatError, match="Truncated 'meta'"):
+        read_heif_header(bytes(data))
+
+
+def test_no_dimensions(make_heif):
+    header = read_heif_header(make_heif(0, 0))
+    with pytest.raises(HeifFormatError, match="no dimensions"):
+        validate_heif_header(header)
+
+
+def test_real_file(heic_bytes):
+    header = probe_heic_file(heic_bytes)
+    assert header is not None
+    assert header.size == (96, 64)
+    assert probe_heic_file(heic_bytes[:-1]) is None
@@ -0,0 +1,76 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+from jobs import JOB_DONE, JOB_ENCODING, JOB_FAILED, JOB_QUEUED, STALE_JOB_ERROR, Job, create_job_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    store = create_job_store(request.param, tmp_path / "jobs.sqlite3")
+    yield store
+    store.close()
+
+
+def test_progress_and_timings(store):
+    job = Job.new("photo.jpg")
+    store.create(job)
+    store.update(job.id, status=JOB_ENCODING, stage_time=job.created_at + 2)
+    store.update(job.id, status=JOB_DONE, stage_time=job.created_at + 3, converted_size=10)
+
+    saved = store.get(job.id)
+    assert (saved.status, saved.converted_size) == (JOB_DONE, 10)
+    assert saved.timings == {JOB_QUEUED: 2, JOB_ENCODING: 1}
+    assert store.update("missing", status=JOB_DONE) is None
+
+
+def test_jobs_without_a_heartbeat_fail(store):
+    running, beating, done = Job.new("a.jpg"), Job.new("b.jpg"), Job.new("c.jpg")
+    for job in (running, beating, done):
+        store.create(job)
+    store.update(running.id, status=JOB_ENCODING)
+    store.update(done.id, status=JOB_DONE)
+
+    cutoff = time.time() + 0.001
+    time.sleep(0.01)
+    store.heartbeat([beating.id])
+
+    assert store.fail_stale(cutoff) == 1
+    failed = store.get(running.id)
+    assert (failed.status, failed.error) == (JOB_FAILED, STALE_JOB_ERROR)
+    assert store.get(beating.id).status == JOB_QUEUED
+    assert store.get(done.id).status == JOB_DONE
+    # Finished jobs are never failed later
+    assert store.fail_stale(time.time() + 60) == 1
+    assert store.get(done.id).status == JOB_DONE
+
+
+def test_restarted_worker_fails_jobs_left_running(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    crashed = create_job_store("sqlite", path)
+    job = Job.new("a.jpg")
+    crashed.create(job)
+    crashed.update(job.id, status=JOB_ENCODING)
+    # The worker dies without closing the store or finishing the job
+
+    restarted = create_job_store("sqlite", path)
+    assert restarted.fail_stale(time.time() + 1) == 1
+    assert restarted.get(job.id).status == JOB_FAILED
+    restarted.close()
+
+
+def test_database_from_before_heartbeats(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    job = Job.new("a.jpg")
+    db = sqlite3.connect(str(path))
+    db.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, updated_at REAL NOT NULL, data TEXT NOT NULL)")
+    db.execute("INSERT INTO jobs VALUES (?, ?, ?)", (job.id, job.updated_at, json.dumps(job.to_dict())))
+    db.commit()
+    db.close()
+
+    store = create_job_store("sqlite", path)
+    assert store.fail_stale(time.time() + 1) == 1
+    assert store.get(job.id).status == JOB_FAILED
+    store.close()
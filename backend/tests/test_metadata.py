@@ -0,0 +1,101 @@
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from PIL.ExifTags import GPS, IFD, Base
+from PIL.TiffImagePlugin import IFDRational
+
+from conftest import exif_block
+from heif_container import read_heif_header
+from metadata import describe_heif, parse_exif
+
+
+def gps_block(latitude_ref="N", longitude_ref="E", altitude_ref=0) -> bytes:
+    exif = Image.Exif()
+    exif[Base.Make] = "Acme"
+    exif[IFD.GPSInfo] = {
+        GPS.GPSLatitudeRef: latitude_ref,
+        GPS.GPSLatitude: (IFDRational(33), IFDRational(51), IFDRational(3456, 100)),
+        GPS.GPSLongitudeRef: longitude_ref,
+        GPS.GPSLongitude: (151.0, 12.0, 36.0),
+        GPS.GPSAltitudeRef: bytes([altitude_ref]),
+        GPS.GPSAltitude: IFDRational(125, 10),
+    }
+    return exif.tobytes()
+
+
+def test_parse_exif_fields():
+    summary = parse_exif(exif_block(Make="Acme", Model="Phone\x00", Software=""))
+    # Padding is stripped and empty strings are left out
+    assert summary == {"make": "Acme", "model": "Phone"}
+
+
+def test_gps_north_east_above_sea_level():
+    summary = parse_exif(gps_block())
+    assert (summary["latitude"], summary["longitude"], summary["altitude"]) == (33.8596, 151.21, 12.5)
+
+
+def test_gps_south_west_below_sea_level():
+    summary = parse_exif(gps_block("S", "W", altitude_ref=1))
+    assert (summary["latitude"], summary["longitude"], summary["altitude"]) == (-33.8596, -151.21, -12.5)
+
+
+def test_describe_heif(make_heif):
+    data = make_heif(64, 48, exif=exif_block(Make="Acme", Orientation=6))
+    info = describe_heif(data, read_heif_header(data))
+    assert (info["width"], info["height"], info["image_count"]) == (64, 48, 1)
+    assert info["exif"]["make"] == "Acme"
+
+
+@pytest.mark.filterwarnings("ignore:Corrupt EXIF data")
+@pytest.mark.parametrize("exif", [b"garbage", b"II*\x00\xff\xff\xff\xff"])
+def test_malformed_exif_is_left_out(make_heif, exif):
+    data = make_heif(64, 48, exif=exif)
+    info = describe_heif(data, read_heif_header(data))
+    assert (info["width"], info["exif"], info["orientation"]) == (64, {}, None)
+
+
+@pytest.fixture(scope="module")
+def client():
+    import main
+    # Probing never touches the executor, so the app is not started
+    return TestClient(main.app)
+
+
+def test_probe(client, make_heif):
+    data = make_heif(640, 480, exif=gps_block("S", "W", altitude_ref=1))
+    response = client.post("/api/v1/probe", files={"file": ("photo.heic", data, "image/heic")})
+
+    assert response.status_code == 200
+    info = response.json()
+    assert (info["filename"], info["width"], info["height"]) == ("photo.heic", 640, 480)
+    assert info["exif"]["latitude"] == -33.8596
+
+
+def test_probe_rejects_invalid_files(client):
+    response = client.post("/api/v1/probe", files={"file": ("photo.heic", b"not a heif", "image/heic")})
+    assert response.status_code == 400
+    response = client.post("/api/v1/probe", files={"file": ("photo.png", b"\x89PNG", "image/png")})
+    assert response.status_code == 415
+
+
+def test_probe_batch_reports_errors_per_file(client, make_heif):
+    files = [
+        ("files", ("good.heic", make_heif(64, 48), "image/heic")),
+        ("files", ("broken.heic", b"not a heif", "image/heic")),
+        ("files", ("photo.png", b"\x89PNG", "image/png")),
+        ("files", ("bad-exif.heic", make_heif(32, 32, exif=b"garbage"), "image/heic")),
+    ]
+    response = client.post("/api/v1/probe/batch", files=files)
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [(result["index"], result["filename"], result["status"]) for result in results] == [
+        (0, "good.heic", "ok"),
+        (1, "broken.heic", "error"),
+        (2, "photo.png", "error"),
+        (3, "bad-exif.heic", "ok"),
+    ]
+    assert results[0]["info"]["width"] == 64
+    assert results[1]["detail"] == "Invalid HEIC/HEIF file format"
+    assert results[2]["detail"].startswith("Unsupported file format")
+    assert results[3]["info"]["exif"] == {}
@@ -0,0 +1,197 @@
+import asyncio
+import types
+
+import pytest
+
+import scheduler
+from executor import ExecutorBusyError
+from scheduler import FairScheduler, RateLimitedError, Ticket
+
+
+class Jobs:
+    """Conversions that record the order they start in and run until released"""
+
+    def __init__(self, fair: FairScheduler):
+        self.fair = fair
+        self.started = []
+        self.release = {}
+        self.tasks = {}
+
+    def submit(self, name: str, client: str, cost: float = 1.0) -> None:
+        self.release[name] = asyncio.Event()
+        self.tasks[name] = asyncio.create_task(self._run(name, Ticket(client, cost)))
+
+    async def _run(self, name: str, ticket: Ticket) -> None:
+        async with self.fair.turn(ticket):
+            self.started.append(name)
+            await self.release[name].wait()
+
+    async def finish(self, name: str) -> None:
+        self.release[name].set()
+        await self.tasks[name]
+        await asyncio.sleep(0)
+
+    async def settle(self) -> None:
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    async def drain(self) -> None:
+        """Let every job run to completion, one at a time in the order they start"""
+        finished = 0
+        while finished < len(self.tasks):
+            await self.settle()
+            await self.finish(self.started[finished])
+            finished += 1
+
+
+def run(coroutine):
+    return asyncio.run(coroutine())
+
+
+def test_idle_client_goes_before_a_busy_one():
+    async def scenario():
+        jobs = Jobs(FairScheduler(capacity=1, max_waiting=10))
+        jobs.submit("a1", "a")
+        jobs.submit("a2", "a")
+        jobs.submit("a3", "a")
+        await jobs.settle()
+        jobs.submit("b1", "b")
+        await jobs.drain()
+        return jobs.started
+
+    assert run(scenario) == ["a1", "b1", "a2", "a3"]
+
+
+def test_cheapest_first_within_a_client():
+    async def scenario():
+        jobs = Jobs(FairScheduler(capacity=1, max_waiting=10))
+        jobs.submit("first", "a")
+        jobs.submit("large", "a", cost=50)
+        jobs.submit("medium", "a", cost=5)
+        jobs.submit("small", "a", cost=1)
+        await jobs.drain()
+        return jobs.started
+
+    assert run(scenario) == ["first", "small", "medium", "large"]
+
+
+def test_weights_share_the_workers():
+    async def scenario():
+        jobs = Jobs(FairScheduler(capacity=1, max_waiting=100, weights={"partner": 3}))
+        jobs.submit("blocker", "other")
+        await jobs.settle()
+        for index in range(12):
+            jobs.submit(f"partner{index}", "partner")
+            jobs.submit(f"free{index}", "free")
+        await jobs.drain()
+        return jobs.started[1:13]
+
+    first = run(scenario)
+    assert sum(name.startswith("partner") for name in first) == 9
+
+
+def test_large_jobs_age_past_new_small_ones(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    clock.time = lambda: clock.now
+    clock.monotonic = lambda: clock.now
+    monkeypatch.setattr(scheduler, "time", clock)
+
+    async def scenario():
+        jobs = Jobs(FairScheduler(capacity=1, max_waiting=10, aging_seconds=10))
+        jobs.submit("running", "a")
+        jobs.submit("large", "a", cost=10)
+        await jobs.settle()
+        # After 100s the large job counts as 10 / (1 + 100 / 10), less than a new small one
+        clock.now += 100
+        jobs.submit("small", "a", cost=1)
+        await jobs.drain()
+        return jobs.started
+
+    assert run(scenario) == ["running", "large", "small"]
+
+
+def test_queue_limit():
+    async def scenario():
+        fair = FairScheduler(capacity=1, max_waiting=1)
+        jobs = Jobs(fair)
+        jobs.submit("running", "a")
+        jobs.submit("waiting", "b")
+        await jobs.settle()
+        assert fair.is_full
+        with pytest.raises(ExecutorBusyError) as error:
+            async with fair.turn(Ticket("c", 1)):
+                pass
+        assert not isinstance(error.value, RateLimitedError)
+        assert fair.rejected == 1
+        await jobs.drain()
+        assert (fair.running, fair.waiting, fair.is_full) == (0, 0, False)
+
+    run(scenario)
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        fair = FairScheduler(capacity=1, max_waiting=5)
+        jobs = Jobs(fair)
+        jobs.submit("running", "a")
+        jobs.submit("cancelled", "b")
+        jobs.submit("next", "c")
+        await jobs.settle()
+        assert fair.waiting == 2
+
+        jobs.tasks["cancelled"].cancel()
+        await jobs.settle()
+        assert fair.waiting == 1
+
+        await jobs.finish("running")
+        await jobs.settle()
+        assert jobs.started == ["running", "next"]
+        await jobs.finish("next")
+        assert (fair.running, fair.waiting) == (0, 0)
+
+        # Cancelled in the same tick as the running conversion finishes
+        jobs.submit("holder", "a")
+        jobs.submit("raced", "b")
+        await jobs.settle()
+        jobs.release["holder"].set()
+        jobs.tasks["raced"].cancel()
+        await jobs.tasks["holder"]
+        with pytest.raises(asyncio.CancelledError):
+            await jobs.tasks["raced"]
+        assert (fair.running, fair.waiting) == (0, 0)
+        assert "raced" not in jobs.started
+
+    run(scenario)
+
+
+def test_rate_limit(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    clock.time = lambda: clock.now
+    clock.monotonic = lambda: clock.now
+    monkeypatch.setattr(scheduler, "time", clock)
+
+    async def scenario():
+        fair = FairScheduler(capacity=10, max_waiting=10, rate=2.0, burst=3)
+
+        async def convert(client: str) -> None:
+            async with fair.turn(Ticket(client, 1)):
+                pass
+
+        for _ in range(3):
+            await convert("a")
+        with pytest.raises(RateLimitedError) as error:
+            await convert("a")
+        assert error.value.retry_after == pytest.approx(0.5)
+        assert fair.retry_after("a") == pytest.approx(0.5)
+
+        # Other clients have their own buckets
+        await convert("b")
+
+        clock.now += 0.5
+        assert fair.retry_after("a") == 0
+        await convert("a")
+        with pytest.raises(RateLimitedError):
+            await convert("a")
+        assert fair.rejected == 2
+
+    run(scenario)
@@ -0,0 +1,87 @@
+import io
+
+import pytest
+from PIL import Image
+
+from config import settings
+from formats import encode_image
+from heif_container import read_heif_header
+from streaming import _bands, band_height, can_stream, encode_bands
+from utils import convert_heic_bytes
+
+
+def pixels(data: bytes) -> bytes:
+    return Image.open(io.BytesIO(data)).convert("RGB").tobytes()
+
+
+@pytest.fixture(scope="module")
+def photo() -> Image.Image:
+    # Neither dimension is a multiple of the MCU size
+    size = (200, 131)
+    fractal = Image.effect_mandelbrot(size, (-2.0, -1.2, 1.0, 1.2), 64)
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (fractal, gradient, gradient.transpose(Image.Transpose.ROTATE_180)))
+
+
+def row_bands(image: Image.Image, heights):
+    """Cut an image into horizontal strips of the given heights, as tile rows would arrive"""
+    top = 0
+    for height in heights:
+        yield image.crop((0, top, image.width, min(top + height, image.height)))
+        top += height
+
+
+def test_bands_have_fixed_height(photo):
+    bands = list(_bands(row_bands(photo, [50, 20, 61]), 32))
+    assert [band.height for band in bands] == [32, 32, 32, 32, 3]
+    joined = Image.new("RGB", photo.size)
+    for index, band in enumerate(bands):
+        joined.paste(band, (0, index * 32))
+    assert joined.tobytes() == photo.tobytes()
+
+
+@pytest.mark.parametrize("height", [16, 32, 112])
+def test_banded_jpeg_matches_single_encode(photo, height):
+    streamed = b"".join(encode_bands(_bands(row_bands(photo, [45, 45, 41]), height), photo.size, height, 85))
+
+    image = Image.open(io.BytesIO(streamed))
+    assert image.size == photo.size
+    # Restart markers make the bands decode exactly like one encode of the whole image
+    assert pixels(streamed) == pixels(encode_image(photo, "jpeg", 85))
+
+
+def test_band_height(make_grid):
+    assert band_height(read_heif_header(make_grid(tile=(512, 512)))) == 512
+    # Rounded down to whole MCUs
+    assert band_height(read_heif_header(make_grid(tile=(100, 100)))) == 96
+
+
+def test_can_stream(make_grid, make_heif, monkeypatch):
+    monkeypatch.setattr(settings, "GRID_STREAMING_MIN_PIXELS", 1000)
+    grid = read_heif_header(make_grid())
+
+    assert can_stream(grid)
+    assert not can_stream(read_heif_header(make_heif()))
+    assert not can_stream(grid, ["png"])
+    assert not can_stream(grid, ["jpeg", "webp"])
+    assert not can_stream(grid, max_bytes=10_000)
+    assert not can_stream(grid, rotate=90)
+    assert not can_stream(grid, resize=True, width=32)
+
+    monkeypatch.setattr(settings, "GRID_STREAMING_MIN_PIXELS", 10 ** 9)
+    assert not can_stream(grid)
+
+
+def test_streamed_conversion_matches_full_decode(monkeypatch):
+    pytest.importorskip("pillow_heif")
+    from benchmarks.corpus import CorpusImage, generate_image
+
+    data = generate_image(CorpusImage("grid", 300, 200, tile_size=128))
+
+    monkeypatch.setattr(settings, "GRID_STREAMING_MIN_PIXELS", 0)
+    full, _ = convert_heic_bytes(data, quality=90)
+    monkeypatch.setattr(settings, "GRID_STREAMING_MIN_PIXELS", 1)
+    streamed, _ = convert_heic_bytes(data, quality=90)
+
+    assert streamed[0]["data"] != full[0]["data"]
+    assert pixels(streamed[0]["data"]) == pixels(full[0]["data"])
@@ -0,0 +1,105 @@
+import pytest
+from PIL import Image, ImageChops, ImageStat
+
+from transforms import EXIF_ORIENTATION_TRANSPOSES, apply_plan, compute_resize_size, plan_transforms
+from utils import transform_image
+
+
+@pytest.fixture(scope="module")
+def photo() -> Image.Image:
+    """Smooth gradients, so different resampling filters agree closely"""
+    size = (400, 300)
+    horizontal = Image.linear_gradient("L").rotate(90).resize(size)
+    vertical = Image.linear_gradient("L").resize(size)
+    radial = Image.radial_gradient("L").resize(size)
+    return Image.merge("RGB", (horizontal, vertical, radial))
+
+
+def naive(image, rotate=None, width=None, height=None, fit_within=True, orientation=1):
+    """Orient, rotate the full image, then resize: what the plan must reproduce"""
+    if EXIF_ORIENTATION_TRANSPOSES[orientation] is not None:
+        image = image.transpose(EXIF_ORIENTATION_TRANSPOSES[orientation])
+    if rotate:
+        image = image.rotate(rotate, expand=True, resample=Image.BICUBIC)
+    if width or height:
+        image = image.resize(compute_resize_size(image.size, width, height, True, fit_within), Image.LANCZOS)
+    return image
+
+
+def difference(a: Image.Image, b: Image.Image) -> float:
+    stat = ImageStat.Stat(ImageChops.difference(a, b))
+    return sum(stat.mean) / len(stat.mean)
+
+
+def steps(plan):
+    return [step.op for step in plan.steps]
+
+
+def test_compute_resize_size():
+    assert compute_resize_size((400, 300), 200) == (200, 150)
+    assert compute_resize_size((400, 300), None, 150) == (200, 150)
+    assert compute_resize_size((400, 300), 200, 200) == (200, 150)
+    assert compute_resize_size((400, 300), 200, 200, fit_within=False) == (200, 200)
+    assert compute_resize_size((400, 300), 200, None, maintain_aspect_ratio=False) == (200, 300)
+
+
+@pytest.mark.parametrize("fit_within", [True, False])
+@pytest.mark.parametrize("rotate", [0, 90, 180, 270])
+def test_right_angles_match_rotate_then_resize(photo, rotate, fit_within):
+    plan = plan_transforms(photo.size, rotate, True, 150, 120, fit_within=fit_within)
+    expected = naive(photo, rotate, 150, 120, fit_within)
+
+    # Lossless: resize the unrotated image, then one transpose
+    assert steps(plan) == (["resize", "transpose"] if rotate else ["resize"])
+    result = apply_plan(photo, plan)
+    assert result.size == plan.output_size == expected.size
+    assert difference(result, expected) < 1
+
+
+@pytest.mark.parametrize("fit_within", [True, False])
+@pytest.mark.parametrize("rotate", [30, 135])
+def test_arbitrary_angles_match_rotate_then_resize(photo, rotate, fit_within):
+    plan = plan_transforms(photo.size, rotate, True, 150, 120, fit_within=fit_within)
+    expected = naive(photo, rotate, 150, 120, fit_within)
+
+    # Shrink first, then rotate and scale in a single affine pass
+    assert steps(plan) == ["resize", "affine"]
+    result = apply_plan(photo, plan)
+    assert result.size == plan.output_size == expected.size
+    assert difference(result, expected) < 3
+
+
+def test_rotate_without_resize_is_a_plain_rotate(photo):
+    plan = plan_transforms(photo.size, 30)
+    assert steps(plan) == ["rotate"]
+    assert apply_plan(photo, plan).size == plan.output_size == naive(photo, 30).size
+
+
+@pytest.mark.parametrize("orientation", [3, 6, 8])
+@pytest.mark.parametrize("rotate", [90, 30])
+def test_orientation_is_folded_in(photo, orientation, rotate):
+    plan = plan_transforms(photo.size, rotate, True, 150, None, orientation=orientation)
+    expected = naive(photo, rotate, 150, orientation=orientation)
+
+    result = apply_plan(photo, plan)
+    assert result.size == plan.output_size == expected.size
+    assert difference(result, expected) < 3
+    if rotate % 90 == 0:
+        # Orientation and rotation compose into one transpose
+        assert steps(plan).count("transpose") <= 1
+
+
+def test_identity():
+    assert plan_transforms((400, 300)).is_identity
+    assert plan_transforms((400, 300), 360, True, 400, 300).is_identity
+
+
+def test_thumbnail_produces_the_full_decode_size(photo):
+    thumbnail = photo.resize((160, 120), Image.LANCZOS)
+    full = transform_image(photo, True, 100, None, True, 90)
+    stand_in = transform_image(thumbnail, True, 100, None, True, 90, reference_size=photo.size)
+
+    assert stand_in.size == full.size
+    assert difference(stand_in, full) < 2
+    # The plan's first resize is what a thumbnail has to cover
+    assert plan_transforms(photo.size, 90, True, 100).resize_size == (133, 100)
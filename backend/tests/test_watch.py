@@ -0,0 +1,171 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pytest
+
+import watch
+from watch import Watcher
+
+
+@pytest.fixture
+def folders(tmp_path):
+    source, destination = tmp_path / "in", tmp_path / "out"
+    source.mkdir()
+    return source, destination
+
+
+def make_watcher(folders, tmp_path, max_pending=100):
+    watcher = Watcher([folders], {"quality": 80}, workers=1, status_path=tmp_path / "status.json")
+    watcher.folders[0].manifest.load()
+    watcher.max_pending = max_pending
+    watcher.debounce = 0
+    return watcher
+
+
+def add(source, name, content=b"heic"):
+    (source / name).write_bytes(content)
+
+
+def drain_scans(watcher, rounds=20):
+    """Feed running scans into the pending set, emptying it each time as conversions would"""
+    seen = set()
+    for _ in range(rounds):
+        watcher._feed_rescans()
+        seen.update(path for _, path in watcher._pending)
+        watcher._pending.clear()
+        watcher._due.clear()
+    return seen
+
+
+def test_bounded_queue_defers_to_later_scans(folders, tmp_path):
+    source, _ = folders
+    for index in range(7):
+        add(source, f"{index}.heic")
+    watcher = make_watcher(folders, tmp_path, max_pending=2)
+
+    watcher._rescan(0)
+    watcher._feed_rescans()
+    assert len(watcher._pending) == 2
+    # An event while the queue is full is left to a scan, not dropped
+    add(source, "new.heic")
+    watcher._observe(0, "new.heic")
+    assert (0, "new.heic") not in watcher._pending
+
+    assert drain_scans(watcher) | {"0.heic", "1.heic"} == {f"{index}.heic" for index in range(7)} | {"new.heic"}
+    assert not watcher._rescans
+
+
+def test_file_arriving_during_a_scan_is_not_lost(folders, tmp_path):
+    source, _ = folders
+    for name in ("a.heic", "b.heic", "c.heic"):
+        add(source, name)
+    watcher = make_watcher(folders, tmp_path, max_pending=1)
+
+    watcher._rescan(0)
+    watcher._feed_rescans()
+    # The running scan has already listed the directory when z arrives with the queue full
+    add(source, "z.heic")
+    watcher._observe(0, "z.heic")
+
+    seen = {path for _, path in watcher._pending} | drain_scans(watcher)
+    assert seen == {"a.heic", "b.heic", "c.heic", "z.heic"}
+    assert not watcher._rescans and not watcher._rescan_again
+
+
+def run_due(watcher):
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        watcher._submit_due(pool)
+        wait(list(watcher._running))
+        for future in list(watcher._running):
+            watcher._finish(future)
+
+
+def test_converted_files_are_recorded_and_skipped(folders, tmp_path, monkeypatch):
+    source, destination = folders
+    converted = []
+
+    def convert_one(source_path, output_path, options):
+        converted.append(os.path.basename(source_path))
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, "wb") as f:
+            f.write(b"jpeg")
+        return 4, 4, 0.01, options["quality"], 1
+
+    monkeypatch.setattr(watch, "convert_one", convert_one)
+    add(source, "a.heic")
+    watcher = make_watcher(folders, tmp_path)
+
+    watcher._observe(0, "a.heic")
+    run_due(watcher)
+    assert converted == ["a.heic"] and watcher.converted == 1
+    assert (destination / "a.jpg").is_file()
+
+    # Unchanged: nothing to do
+    watcher._observe(0, "a.heic")
+    assert not watcher._pending
+
+    # Rewritten: converted again
+    add(source, "a.heic", b"heic, edited")
+    watcher._observe(0, "a.heic")
+    run_due(watcher)
+    assert converted == ["a.heic", "a.heic"]
+
+
+def test_namesake_gets_its_own_output(folders, tmp_path, monkeypatch):
+    source, destination = folders
+    outputs = []
+
+    def convert_one(source_path, output_path, options):
+        outputs.append(os.path.relpath(output_path, destination))
+        return 4, 4, 0.01, options["quality"], 1
+
+    monkeypatch.setattr(watch, "convert_one", convert_one)
+    add(source, "IMG_1.heic")
+    add(source, "IMG_1.HEIF")
+    watcher = make_watcher(folders, tmp_path)
+
+    watcher._observe(0, "IMG_1.heic")
+    watcher._observe(0, "IMG_1.HEIF")
+    run_due(watcher)
+    assert sorted(outputs) == ["IMG_1.HEIF.jpg", "IMG_1.heic.jpg"]
+    assert sorted(entry["output"] for entry in watcher.folders[0].manifest.entries.values()) == sorted(outputs)
+
+
+def test_file_still_being_written_waits(folders, tmp_path, monkeypatch):
+    source, _ = folders
+    monkeypatch.setattr(watch, "convert_one", lambda *args: pytest.fail("converted a partial file"))
+    add(source, "a.heic", b"hei")
+    watcher = make_watcher(folders, tmp_path)
+    watcher.debounce = 60
+
+    watcher._observe(0, "a.heic")
+    # The debounce period ends, but the file has grown since it was seen
+    watcher._pending[(0, "a.heic")].due = 0
+    watcher._due = [(0, 0, "a.heic")]
+    add(source, "a.heic", b"heic, more of it")
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        watcher._submit_due(pool)
+    assert not watcher._running
+    assert watcher._pending[(0, "a.heic")].size == len(b"heic, more of it")
+    assert watcher._pending[(0, "a.heic")].due > 0
+
+
+def test_failed_files_wait_for_a_change(folders, tmp_path, monkeypatch):
+    source, _ = folders
+
+    def convert_one(*args):
+        raise ValueError("Invalid HEIC/HEIF file")
+
+    monkeypatch.setattr(watch, "convert_one", convert_one)
+    add(source, "bad.heic")
+    watcher = make_watcher(folders, tmp_path)
+
+    watcher._observe(0, "bad.heic")
+    run_due(watcher)
+    assert watcher.failed == 1 and "Invalid" in watcher.last_error["error"]
+
+    watcher._observe(0, "bad.heic")
+    assert not watcher._pending
+    add(source, "bad.heic", b"fixed")
+    watcher._observe(0, "bad.heic")
+    assert (0, "bad.heic") in watcher._pending
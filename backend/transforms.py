@@ -0,0 +1,307 @@
+"""
+Geometric transform planner shared by all servers.
+
+Turns the requested rotation, EXIF orientation and resize options into the
+cheapest sequence of image operations that produces the same output size as
+rotating the full-resolution image with `Image.rotate(expand=True)` and then
+resizing it:
+
+- right-angle rotations and orientations are folded into a single lossless
+  transpose, applied after the resize so it moves fewer pixels
+- arbitrary angles shrink the source first, then rotate and scale to the
+  final size in a single affine pass
+"""
+
+import math
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+try:
+    Transpose = Image.Transpose
+    Resampling = Image.Resampling
+    AFFINE = Image.Transform.AFFINE
+except AttributeError:
+    # Pillow < 9.1
+    Transpose = Image
+    Resampling = Image
+    AFFINE = Image.AFFINE
+
+# How each transpose moves pixel coordinates (x, y), with y pointing down
+_TRANSPOSE_MATRICES = {
+    None: (1, 0, 0, 1),
+    Transpose.FLIP_LEFT_RIGHT: (-1, 0, 0, 1),
+    Transpose.FLIP_TOP_BOTTOM: (1, 0, 0, -1),
+    Transpose.ROTATE_90: (0, 1, -1, 0),
+    Transpose.ROTATE_180: (-1, 0, 0, -1),
+    Transpose.ROTATE_270: (0, -1, 1, 0),
+    Transpose.TRANSPOSE: (0, 1, 1, 0),
+    Transpose.TRANSVERSE: (0, -1, -1, 0),
+}
+_MATRIX_TRANSPOSES = {matrix: method for method, matrix in _TRANSPOSE_MATRICES.items()}
+
+# EXIF orientation tag values and the transpose that displays them upright
+EXIF_ORIENTATION_TRANSPOSES = {
+    1: None,
+    2: Transpose.FLIP_LEFT_RIGHT,
+    3: Transpose.ROTATE_180,
+    4: Transpose.FLIP_TOP_BOTTOM,
+    5: Transpose.TRANSPOSE,
+    6: Transpose.ROTATE_270,
+    7: Transpose.TRANSVERSE,
+    8: Transpose.ROTATE_90,
+}
+
+# Counter-clockwise right-angle rotations
+_ROTATION_TRANSPOSES = {
+    0: None,
+    90: Transpose.ROTATE_90,
+    180: Transpose.ROTATE_180,
+    270: Transpose.ROTATE_270,
+}
+
+
+def _compose(first, second):
+    """Transpose equivalent to applying first, then second"""
+    a = _TRANSPOSE_MATRICES[first]
+    b = _TRANSPOSE_MATRICES[second]
+    product = (
+        b[0] * a[0] + b[1] * a[2], b[0] * a[1] + b[1] * a[3],
+        b[2] * a[0] + b[3] * a[2], b[2] * a[1] + b[3] * a[3],
+    )
+    return _MATRIX_TRANSPOSES[product]
+
+
+def _swaps_axes(method) -> bool:
+    return _TRANSPOSE_MATRICES[method][0] == 0
+
+
+def compute_resize_size(
+    size: Tuple[int, int],
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    maintain_aspect_ratio: bool = True,
+    fit_within: bool = True
+) -> Tuple[int, int]:
+    """
+    Calculate the output size of a resize request for an image of the given size
+
+    Args:
+        size: Width and height of the image being resized
+        width: Target width in pixels
+        height: Target height in pixels
+        maintain_aspect_ratio: Maintain aspect ratio when only one of
+            width and height is given
+        fit_within: When both are given, fit inside the box instead of
+            stretching to it
+    """
+    orig_width, orig_height = size
+    if maintain_aspect_ratio:
+        # Calculate dimensions while maintaining aspect ratio
+        if width and height:
+            if not fit_within:
+                return width, height
+            # Use the smaller scale to ensure the image fits within the bounds
+            width_ratio = width / orig_width
+            height_ratio = height / orig_height
+            ratio = min(width_ratio, height_ratio)
+            return int(orig_width * ratio), int(orig_height * ratio)
+        elif width:
+            # Resize by width, maintain aspect ratio
+            ratio = width / orig_width
+            return width, int(orig_height * ratio)
+        elif height:
+            # Resize by height, maintain aspect ratio
+            ratio = height / orig_height
+            return int(orig_width * ratio), height
+
+    # Resize without maintaining aspect ratio
+    return width or orig_width, height or orig_height
+
+
+def _rotation_matrix(size: Tuple[int, int], angle: float) -> Tuple[List[float], Tuple[int, int]]:
+    """
+    Output-to-input affine matrix and expanded size of Image.rotate(angle, expand=True)
+
+    Mirrors Pillow's own calculation so output sizes match it exactly.
+    """
+    w, h = size
+    center_x, center_y = w / 2.0, h / 2.0
+    radians = -math.radians(angle)
+    matrix = [
+        round(math.cos(radians), 15), round(math.sin(radians), 15), 0.0,
+        round(-math.sin(radians), 15), round(math.cos(radians), 15), 0.0,
+    ]
+
+    def apply(x, y):
+        a, b, c, d, e, f = matrix
+        return a * x + b * y + c, d * x + e * y + f
+
+    matrix[2], matrix[5] = apply(-center_x, -center_y)
+    matrix[2] += center_x
+    matrix[5] += center_y
+
+    xs, ys = [], []
+    for x, y in ((0, 0), (w, 0), (w, h), (0, h)):
+        x, y = apply(x, y)
+        xs.append(x)
+        ys.append(y)
+    new_w = math.ceil(max(xs)) - math.floor(min(xs))
+    new_h = math.ceil(max(ys)) - math.floor(min(ys))
+
+    matrix[2], matrix[5] = apply(-(new_w - w) / 2.0, -(new_h - h) / 2.0)
+    return matrix, (new_w, new_h)
+
+
+@dataclass
+class TransformStep:
+    """A single image operation"""
+    op: str  # "resize", "transpose", "rotate" or "affine"
+    size: Optional[Tuple[int, int]] = None
+    method: Optional[int] = None
+    angle: float = 0.0
+    matrix: Optional[List[float]] = None
+
+
+@dataclass
+class TransformPlan:
+    """Ordered operations and the size they produce"""
+    input_size: Tuple[int, int]
+    output_size: Tuple[int, int]
+    steps: List[TransformStep] = field(default_factory=list)
+
+    @property
+    def is_identity(self) -> bool:
+        return not self.steps
+
+    @property
+    def resize_size(self) -> Optional[Tuple[int, int]]:
+        """Size of the first resize, which is what a reduced decode must cover"""
+        for step in self.steps:
+            if step.op == "resize":
+                return step.size
+        return None
+
+    def step_sizes(self) -> List[Tuple[int, int]]:
+        """Size of the image after each step, starting from input_size"""
+        sizes = []
+        size = self.input_size
+        for step in self.steps:
+            if step.op == "transpose":
+                if _swaps_axes(step.method):
+                    size = (size[1], size[0])
+            else:
+                size = step.size
+            sizes.append(size)
+        return sizes
+
+
+def plan_transforms(
+    size: Tuple[int, int],
+    rotate: Optional[float] = None,
+    resize: bool = False,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    maintain_aspect_ratio: bool = True,
+    orientation: int = 1,
+    fit_within: bool = True
+) -> TransformPlan:
+    """
+    Plan the cheapest operations for the requested transforms
+
+    The output size equals that of applying the EXIF orientation, then
+    `Image.rotate(rotate, expand=True)`, then resizing to
+    compute_resize_size() of the rotated size.
+
+    Args:
+        size: Width and height of the decoded image
+        rotate: Counter-clockwise rotation in degrees
+        resize: Whether to resize the image
+        width: Target width in pixels
+        height: Target height in pixels
+        maintain_aspect_ratio: Maintain aspect ratio when resizing
+        orientation: EXIF orientation still to be applied to the decoded
+            pixels (1 when the decoder already applied it)
+        fit_within: See compute_resize_size()
+    """
+    plan = TransformPlan(input_size=size, output_size=size)
+    resizing = bool(resize and (width or height))
+
+    orient = EXIF_ORIENTATION_TRANSPOSES.get(orientation)
+    oriented_size = (size[1], size[0]) if _swaps_axes(orient) else size
+    angle = (rotate or 0) % 360
+
+    if angle % 90 == 0:
+        # Lossless path: one transpose, after any resize
+        transpose = _compose(orient, _ROTATION_TRANSPOSES[int(angle)])
+        swap = _swaps_axes(transpose)
+        rotated_size = (size[1], size[0]) if swap else size
+        output_size = rotated_size
+        if resizing:
+            output_size = compute_resize_size(rotated_size, width, height, maintain_aspect_ratio, fit_within)
+            resize_size = (output_size[1], output_size[0]) if swap else output_size
+            if resize_size != size:
+                plan.steps.append(TransformStep("resize", size=resize_size))
+        if transpose is not None:
+            plan.steps.append(TransformStep("transpose", method=transpose))
+        plan.output_size = output_size
+        return plan
+
+    rotation, rotated_size = _rotation_matrix(oriented_size, angle)
+
+    if not resizing:
+        # A plain rotate is already a single resampling pass
+        if orient is not None:
+            plan.steps.append(TransformStep("transpose", method=orient))
+        plan.steps.append(TransformStep("rotate", size=rotated_size, angle=angle))
+        plan.output_size = rotated_size
+        return plan
+
+    output_size = compute_resize_size(rotated_size, width, height, maintain_aspect_ratio, fit_within)
+    scale_x = rotated_size[0] / output_size[0]
+    scale_y = rotated_size[1] / output_size[1]
+
+    # Shrink the source first so the affine pass works on as few pixels as possible
+    shrink = min(1.0, max(1 / scale_x, 1 / scale_y))
+    shrunk = (max(1, round(size[0] * shrink)), max(1, round(size[1] * shrink)))
+    if shrunk != size:
+        plan.steps.append(TransformStep("resize", size=shrunk))
+    if orient is not None:
+        plan.steps.append(TransformStep("transpose", method=orient))
+    shrunk_oriented = (shrunk[1], shrunk[0]) if _swaps_axes(orient) else shrunk
+
+    # Output pixel -> rotated canvas -> oriented source -> shrunk source
+    a, b, c, d, e, f = rotation
+    to_shrunk_x = shrunk_oriented[0] / oriented_size[0]
+    to_shrunk_y = shrunk_oriented[1] / oriented_size[1]
+    matrix = [
+        a * scale_x * to_shrunk_x, b * scale_y * to_shrunk_x, c * to_shrunk_x,
+        d * scale_x * to_shrunk_y, e * scale_y * to_shrunk_y, f * to_shrunk_y,
+    ]
+    plan.steps.append(TransformStep("affine", size=output_size, matrix=matrix))
+    plan.output_size = output_size
+    return plan
+
+
+def apply_plan(image: Image.Image, plan: TransformPlan, reducing_gap: Optional[float] = None) -> Image.Image:
+    """
+    Run a transform plan on an image
+
+    The image may be smaller than plan.input_size (for example an embedded
+    thumbnail) as long as the plan only resizes and transposes.
+
+    Args:
+        reducing_gap: Passed to Image.resize to integer-reduce large downscales first
+    """
+    for step in plan.steps:
+        if step.op == "resize":
+            if image.size != step.size:
+                image = image.resize(step.size, Resampling.LANCZOS, reducing_gap=reducing_gap)
+        elif step.op == "transpose":
+            image = image.transpose(step.method)
+        elif step.op == "rotate":
+            image = image.rotate(step.angle, expand=True)
+        elif step.op == "affine":
+            image = image.transform(step.size, AFFINE, step.matrix, resample=Resampling.BICUBIC)
+    return image
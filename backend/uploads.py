@@ -0,0 +1,142 @@
+"""
+Helpers for receiving uploads without buffering whole request bodies in memory.
+"""
+
+import asyncio
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional
+
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+
+
+def too_large_detail(max_size: int) -> str:
+    """Error message for uploads over the size limit"""
+    return f"File too large. Maximum size is {max_size / (1024 * 1024):.1f} MB"
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject oversized request bodies before they are parsed
+
+    Requests with a Content-Length over the limit are answered with 413
+    before any of the body is read. Requests without one (chunked uploads)
+    are counted while streaming and aborted as soon as they cross the limit.
+
+    Args:
+        app: The wrapped ASGI application
+        limits: Maximum body size in bytes, keyed by request path
+        file_limits: File size limit reported in the error message, keyed by request path
+    """
+
+    def __init__(self, app: ASGIApp, limits: Dict[str, int], file_limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+        self.file_limits = file_limits
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.limits:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limits[scope["path"]]
+        detail = too_large_detail(self.file_limits.get(scope["path"], limit))
+
+        # Reject early based on the declared length
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    break
+                if declared > limit:
+                    response = JSONResponse({"detail": detail}, status_code=413)
+                    await response(scope, receive, send)
+                    return
+                break
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _copy_limited(source: BinaryIO, destination: Path, max_size: int, chunk_size: int, hasher) -> int:
+    size = 0
+    # The upload may already have been read, e.g. to validate it
+    source.seek(0)
+    with open(destination, "wb") as buffer:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLargeError(too_large_detail(max_size))
+            if hasher is not None:
+                hasher.update(chunk)
+            buffer.write(chunk)
+    return size
+
+
+async def spool_upload(
+    upload: UploadFile,
+    destination: Path,
+    max_size: int,
+    chunk_size: int = 1024 * 1024,
+    hasher: Optional[Any] = None,
+) -> int:
+    """
+    Stream an upload to disk one chunk at a time
+
+    Args:
+        upload: The uploaded file
+        destination: Path to write the upload to
+        max_size: Maximum allowed size in bytes
+        chunk_size: Read size in bytes
+        hasher: Optional hashlib object updated with each chunk
+
+    Returns:
+        Number of bytes written
+
+    Raises:
+        UploadTooLargeError: If the upload exceeds max_size. The partial
+            file is removed.
+    """
+    try:
+        return await asyncio.to_thread(_copy_limited, upload.file, destination, max_size, chunk_size, hasher)
+    except BaseException:
+        destination.unlink(missing_ok=True)
+        raise
+
+
+def _read_limited(source: BinaryIO, max_size: int) -> bytes:
+    source.seek(0, 2)
+    size = source.tell()
+    if size > max_size:
+        raise UploadTooLargeError(too_large_detail(max_size))
+    source.seek(0)
+    return source.read(size)
+
+
+async def read_upload(upload: UploadFile, max_size: int) -> bytes:
+    """
+    Read an upload into memory with a single allocation of its exact size
+
+    Raises:
+        UploadTooLargeError: If the upload exceeds max_size
+    """
+    return await asyncio.to_thread(_read_limited, upload.file, max_size)
@@ -1,21 +1,424 @@
 import os
+import hashlib
 import uuid
 import time
-import pyheif
 from PIL import Image, ImageOps
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import Any, BinaryIO, Dict, Iterator, List, Sequence, Tuple, Optional, Union
 from datetime import datetime, timedelta
 from config import settings
+from heif_container import (
+    HeifFormatError,
+    HeifHeader,
+    extract_image,
+    find_thumbnails,
+    read_heif_header,
+    validate_heif_header,
+)
+from decoders import decode
+from executor import report_progress
+from formats import FORMATS, default_quality, encode_image, flatten
+from storage import Storage, write_atomic
+from streaming import can_stream, stream_grid_jpeg
+from transforms import apply_plan, plan_transforms
 
-def is_valid_heic_file(file_path: Path) -> bool:
-    """Check if the file is a valid HEIC/HEIF file"""
+def probe_heic_file(file_path: Union[Path, bytes, BinaryIO]) -> Optional[HeifHeader]:
+    """
+    Read and validate the container metadata of a HEIC/HEIF file
+
+    Only the `ftyp` and `meta` boxes are read, so a seekable stream such as
+    an upload's spooled file is probed without reading it into memory.
+
+    Returns:
+        The parsed header, or None if the file is not a valid HEIC/HEIF file
+    """
     try:
-        # Try to read the file with pyheif
-        pyheif.read(str(file_path))
-        return True
-    except Exception:
-        return False
+        header = read_heif_header(file_path)
+        validate_heif_header(header)
+        return header
+    except (HeifFormatError, OSError):
+        return None
+
+def decode_heic(source: Union[Path, bytes], kind: Optional[str] = None) -> Image.Image:
+    """
+    Decode a HEIC/HEIF image into a PIL Image
+
+    Args:
+        source: Path to the HEIC file or its contents
+        kind: Input kind from decoders.input_kind(), if already known
+    """
+    return decode(source, kind)
+
+def decode_thumbnail(source: Union[Path, bytes], min_size: Tuple[int, int]) -> Optional[Image.Image]:
+    """
+    Decode the smallest embedded thumbnail that covers min_size
+
+    Args:
+        source: Path to the HEIC file or its contents
+        min_size: Minimum displayed width and height the thumbnail must have
+
+    Returns:
+        The decoded thumbnail, or None if no thumbnail is large enough
+    """
+    header = read_heif_header(source)
+    full_width, full_height = header.size
+
+    for item in find_thumbnails(header):
+        thumb_width, thumb_height = item.display_size
+        if thumb_width < min_size[0] or thumb_height < min_size[1]:
+            continue
+
+        image = decode_heic(extract_image(source, header, item.item_id))
+
+        # Only trust thumbnails with the same framing as the primary image
+        if abs(image.width / image.height - full_width / full_height) > 0.01:
+            return None
+        return image
+
+    return None
+
+def transform_image(
+    image: Image.Image,
+    resize: bool = False,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    maintain_aspect_ratio: bool = True,
+    rotate: Optional[int] = None,
+    reference_size: Optional[Tuple[int, int]] = None
+) -> Image.Image:
+    """
+    Apply the requested rotation and resize to a decoded image
+
+    Args:
+        reference_size: Size of the full-resolution image when `image` is a
+            smaller stand-in such as an embedded thumbnail. Output sizes are
+            computed from it so they match a full decode.
+    """
+    plan = plan_transforms(
+        reference_size or image.size, rotate, resize, width, height, maintain_aspect_ratio
+    )
+    return apply_plan(image, plan, reducing_gap=settings.RESIZE_REDUCING_GAP)
+
+def decode_for_transform(
+    source: Union[Path, bytes],
+    resize: bool = False,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    maintain_aspect_ratio: bool = True,
+    rotate: Optional[int] = None
+) -> Tuple[Image.Image, Optional[Tuple[int, int]]]:
+    """
+    Decode only as much of the image as the requested transforms need
+
+    When the output is a downscale and an embedded thumbnail already covers
+    the output size, the thumbnail is decoded instead of the full image.
+
+    Returns:
+        Tuple of (image, reference_size) where reference_size is the
+        full-resolution size if a thumbnail was used, otherwise None
+    """
+    right_angle = rotate is None or rotate % 90 == 0
+    if settings.USE_EMBEDDED_THUMBNAILS and resize and (width or height) and right_angle:
+        try:
+            header = read_heif_header(source)
+            full_size = header.size
+
+            # The plan resizes before transposing, so this is the size to cover
+            needed = plan_transforms(
+                full_size, rotate, resize, width, height, maintain_aspect_ratio
+            ).resize_size
+
+            if needed is not None:
+                image = decode_thumbnail(source, needed)
+                if image is not None:
+                    return image, full_size
+        except Exception:
+            # Fall back to a full decode
+            pass
+
+    return decode_heic(source), None
+
+class TargetSizeError(ValueError):
+    """Raised when an image does not fit the byte budget even at the minimum quality"""
+
+# Typical JPEG size at each quality, relative to quality 100. The shape of
+# this curve varies little between photos, so one trial encode is enough
+# to scale it into a size estimate for the image at hand. WebP and AVIF
+# follow it loosely, which the refitting below makes up for.
+_JPEG_SIZE_CURVE = (
+    (1, 0.045), (5, 0.047), (10, 0.052), (20, 0.068), (30, 0.083), (40, 0.096),
+    (50, 0.112), (60, 0.130), (70, 0.155), (75, 0.171), (80, 0.196), (85, 0.227),
+    (90, 0.287), (95, 0.448), (100, 1.0),
+)
+
+def _relative_jpeg_size(quality: int) -> float:
+    for (q0, r0), (q1, r1) in zip(_JPEG_SIZE_CURVE, _JPEG_SIZE_CURVE[1:]):
+        if quality <= q1:
+            return r0 + (r1 - r0) * (quality - q0) / (q1 - q0)
+    return 1.0
+
+def _predict_size(trials: Dict[int, bytes], fits: int, too_big: int, quality: int) -> float:
+    """Size at `quality` from the curve, scaled to match the trials bracketing it"""
+    high = len(trials[too_big]) / _relative_jpeg_size(too_big)
+    if fits not in trials:
+        return high * _relative_jpeg_size(quality)
+    low = len(trials[fits]) / _relative_jpeg_size(fits)
+    position = (quality - fits) / (too_big - fits)
+    return (low + (high - low) * position) * _relative_jpeg_size(quality)
+
+def encode_to_size(
+    image: Image.Image,
+    max_bytes: int,
+    quality: int = 95,
+    output_format: str = "jpeg",
+    min_quality: Optional[int] = None,
+    max_passes: Optional[int] = None
+) -> Tuple[bytes, int, int]:
+    """
+    Encode at the highest quality, up to `quality`, whose output fits in max_bytes
+
+    The first trial encodes at `quality`. If that is too large, its size
+    scales a typical size-versus-quality curve into a model of this image,
+    and each further trial encodes the highest quality the model predicts
+    to fit, inside the range not yet ruled out. The model is refitted to
+    the trials bracketing that range after every pass, so the search
+    usually ends within three or four passes.
+
+    Args:
+        image: Decoded and transformed image; it is only encoded, never modified
+        max_bytes: Largest acceptable output size in bytes
+        quality: Highest quality to use
+        output_format: Name of a lossy format from formats.FORMATS
+        min_quality: Lowest quality to try (settings.JPEG_MIN_QUALITY by default)
+        max_passes: Most encodes to run (settings.JPEG_SIZE_SEARCH_PASSES by default)
+
+    Returns:
+        Tuple of (encoded_bytes, quality, encode_passes)
+
+    Raises:
+        TargetSizeError: If the image does not fit even at min_quality
+    """
+    min_quality = min(quality, min_quality or settings.JPEG_MIN_QUALITY)
+    max_passes = max(2, max_passes or settings.JPEG_SIZE_SEARCH_PASSES)
+    trials: Dict[int, bytes] = {}
+    if not FORMATS[output_format].alpha:
+        # Flatten once rather than on every trial encode
+        image = flatten(image)
+
+    def trial(q: int) -> bytes:
+        trials[q] = encode_image(image, output_format, q)
+        return trials[q]
+
+    if len(trial(quality)) <= max_bytes:
+        return trials[quality], quality, 1
+
+    # Qualities strictly between `fits` and `too_big` are still candidates
+    fits = min_quality - 1
+    too_big = quality
+    guess = quality
+    while too_big - fits > 1 and len(trials) < max_passes:
+        if len(trials) == max_passes - 1 and fits < min_quality:
+            # Last pass without a fit: settle for the minimum quality
+            guess = min_quality
+        else:
+            guess = fits + 1
+            for q in range(too_big - 1, fits, -1):
+                if _predict_size(trials, fits, too_big, q) <= max_bytes:
+                    guess = q
+                    break
+
+        if len(trial(guess)) <= max_bytes:
+            fits = guess
+        else:
+            too_big = guess
+
+    if fits < min_quality:
+        raise TargetSizeError(
+            f"Image does not fit in {max_bytes} bytes, even at quality {min_quality}"
+        )
+    return trials[fits], fits, len(trials)
+
+def encode_with_options(
+    image: Image.Image,
+    output_format: str = "jpeg",
+    quality: Optional[int] = None,
+    max_bytes: Optional[int] = None
+) -> Tuple[bytes, Optional[int], int]:
+    """
+    Encode at `quality`, or at the best quality within max_bytes if given
+
+    Args:
+        output_format: Name of a format from formats.FORMATS
+        quality: Quality for lossy formats; the format's default if not given
+
+    Returns:
+        Tuple of (encoded_bytes, quality, encode_passes); quality is None
+        for lossless formats
+    """
+    if not FORMATS[output_format].lossy:
+        data = encode_image(image, output_format)
+        if max_bytes is not None and len(data) > max_bytes:
+            raise TargetSizeError(f"Lossless {output_format} output does not fit in {max_bytes} bytes")
+        return data, None, 1
+
+    quality = quality or default_quality(output_format)
+    if max_bytes is None:
+        return encode_image(image, output_format, quality), quality, 1
+    return encode_to_size(image, max_bytes, quality, output_format)
+
+def decode_and_transform(
+    source: Union[Path, bytes],
+    resize: bool = False,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    maintain_aspect_ratio: bool = True,
+    rotate: Optional[int] = None
+) -> Image.Image:
+    """Decode a HEIC/HEIF image and apply the requested rotation and resize"""
+    report_progress("decoding")
+    image, reference_size = decode_for_transform(
+        source, resize, width, height, maintain_aspect_ratio, rotate
+    )
+
+    report_progress("transforming")
+    return transform_image(
+        image, resize, width, height, maintain_aspect_ratio, rotate, reference_size
+    )
+
+def stream_jpeg(
+    source: Union[Path, bytes],
+    formats: Sequence[str] = ("jpeg",),
+    quality: Optional[int] = None,
+    resize: bool = False,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    maintain_aspect_ratio: bool = True,
+    rotate: Optional[int] = None,
+    max_bytes: Optional[int] = None
+) -> Optional[Iterator[bytes]]:
+    """
+    Convert a large grid image to JPEG a tile row at a time, when the options allow it
+
+    Decoding and encoding are interleaved, so they are reported as a single
+    decoding stage.
+
+    Returns:
+        The JPEG in chunks, or None when the conversion needs the whole
+        image and must take the regular path
+    """
+    try:
+        header = read_heif_header(source)
+    except (HeifFormatError, OSError):
+        return None
+    if not can_stream(header, formats, resize, width, height, maintain_aspect_ratio, rotate, max_bytes):
+        return None
+
+    report_progress("decoding")
+    return stream_grid_jpeg(source, header, quality or default_quality("jpeg"))
+
+def convert_heic(
+    input_path: Path,
+    storage: Storage,
+    formats: Sequence[str] = ("jpeg",),
+    quality: Optional[int] = None,
+    resize: bool = False,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    maintain_aspect_ratio: bool = True,
+    rotate: Optional[int] = None,
+    max_bytes: Optional[int] = None
+) -> Tuple[int, float, List[Dict[str, Any]]]:
+    """
+    Convert a HEIC/HEIF file to one or more formats
+
+    The image is decoded and transformed once, then encoded in each format.
+
+    Args:
+        input_path: Path to input HEIC file
+        storage: Storage to write the outputs to, named after their contents
+        formats: Names of formats from formats.FORMATS
+        quality: Quality for lossy formats; each format's default if not given
+        max_bytes: Largest acceptable size of each output; quality is lowered to fit
+
+    Returns:
+        Tuple of (original_size, conversion_time, outputs) where each output
+        has the format, filename, size, quality and encode_passes
+    """
+    start_time = time.time()
+    original_size = input_path.stat().st_size
+
+    chunks = stream_jpeg(input_path, formats, quality, resize, width, height, maintain_aspect_ratio, rotate, max_bytes)
+    if chunks is not None:
+        encoded = [("jpeg", b"".join(chunks), quality or default_quality("jpeg"), 1)]
+    else:
+        image = decode_and_transform(input_path, resize, width, height, maintain_aspect_ratio, rotate)
+
+        # Encode everything in memory first so encoding and disk writes are timed separately
+        report_progress("encoding")
+        encoded = [
+            (output_format, *encode_with_options(image, output_format, quality, max_bytes))
+            for output_format in formats
+        ]
+
+    report_progress("persisting")
+    outputs = []
+    for output_format, data, used_quality, encode_passes in encoded:
+        filename = content_addressed_filename(data, FORMATS[output_format].extension)
+        storage.put(filename, data)
+        outputs.append({
+            "format": output_format,
+            "filename": filename,
+            "size": len(data),
+            "quality": used_quality,
+            "encode_passes": encode_passes,
+        })
+
+    return original_size, time.time() - start_time, outputs
+
+def convert_heic_bytes(
+    content: bytes,
+    formats: Sequence[str] = ("jpeg",),
+    quality: Optional[int] = None,
+    resize: bool = False,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    maintain_aspect_ratio: bool = True,
+    rotate: Optional[int] = None,
+    max_bytes: Optional[int] = None
+) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Convert HEIC/HEIF contents to one or more formats entirely in memory
+
+    Returns:
+        Tuple of (outputs, conversion_time) where each output has the
+        format, data, quality and encode_passes
+    """
+    start_time = time.time()
+
+    chunks = stream_jpeg(content, formats, quality, resize, width, height, maintain_aspect_ratio, rotate, max_bytes)
+    if chunks is not None:
+        output = {
+            "format": "jpeg",
+            "data": b"".join(chunks),
+            "quality": quality or default_quality("jpeg"),
+            "encode_passes": 1,
+        }
+        return [output], time.time() - start_time
+
+    image = decode_and_transform(content, resize, width, height, maintain_aspect_ratio, rotate)
+
+    report_progress("encoding")
+    outputs = []
+    for output_format in formats:
+        data, used_quality, encode_passes = encode_with_options(image, output_format, quality, max_bytes)
+        outputs.append({
+            "format": output_format,
+            "data": data,
+            "quality": used_quality,
+            "encode_passes": encode_passes,
+        })
+
+    return outputs, time.time() - start_time
 
 def convert_heic_to_jpg(
     input_path: Path, 
@@ -25,8 +428,9 @@ def convert_heic_to_jpg(
     width: Optional[int] = None,
     height: Optional[int] = None,
     maintain_aspect_ratio: bool = True,
-    rotate: Optional[int] = None
-) -> Tuple[int, int, float]:
+    rotate: Optional[int] = None,
+    max_bytes: Optional[int] = None
+) -> Tuple[int, int, float, int, int]:
     """
     Convert HEIC/HEIF file to JPG
     
@@ -39,83 +443,56 @@ def convert_heic_to_jpg(
         height: Target height in pixels
         maintain_aspect_ratio: Maintain aspect ratio when resizing
         rotate: Rotation angle in degrees
+        max_bytes: Largest acceptable JPEG size; quality is lowered to fit
         
     Returns:
-        Tuple of (original_size, converted_size, conversion_time)
+        Tuple of (original_size, converted_size, conversion_time, quality, encode_passes)
     """
     start_time = time.time()
     
     # Get original file size
     original_size = input_path.stat().st_size
     
-    # Read HEIC file
-    heif_file = pyheif.read(str(input_path))
-    
-    # Convert to PIL Image
-    image = Image.frombytes(
-        heif_file.mode, 
-        heif_file.size, 
-        heif_file.data,
-        "raw",
-        heif_file.mode,
-        heif_file.stride,
-    )
-    
-    # Apply rotation if specified
-    if rotate is not None:
-        image = image.rotate(rotate, expand=True)
-    
-    # Resize if requested
-    if resize and (width or height):
-        if maintain_aspect_ratio:
-            # Calculate dimensions while maintaining aspect ratio
-            if width and height:
-                # Use the smaller scale to ensure the image fits within the bounds
-                orig_width, orig_height = image.size
-                width_ratio = width / orig_width
-                height_ratio = height / orig_height
-                ratio = min(width_ratio, height_ratio)
-                new_width = int(orig_width * ratio)
-                new_height = int(orig_height * ratio)
-                image = image.resize((new_width, new_height), Image.LANCZOS)
-            elif width:
-                # Resize by width, maintain aspect ratio
-                orig_width, orig_height = image.size
-                ratio = width / orig_width
-                new_height = int(orig_height * ratio)
-                image = image.resize((width, new_height), Image.LANCZOS)
-            elif height:
-                # Resize by height, maintain aspect ratio
-                orig_width, orig_height = image.size
-                ratio = height / orig_height
-                new_width = int(orig_width * ratio)
-                image = image.resize((new_width, height), Image.LANCZOS)
-        else:
-            # Resize without maintaining aspect ratio
-            target_width = width if width else image.width
-            target_height = height if height else image.height
-            image = image.resize((target_width, target_height), Image.LANCZOS)
+    chunks = stream_jpeg(input_path, ("jpeg",), quality, resize, width, height, maintain_aspect_ratio, rotate, max_bytes)
+    if chunks is not None:
+        # Written band by band, so not even the JPEG is held whole
+        converted_size = write_atomic(output_path, chunks)
+        return original_size, converted_size, time.time() - start_time, quality, 1
+
+    image = decode_and_transform(input_path, resize, width, height, maintain_aspect_ratio, rotate)
     
-    # Save as JPG
-    image.save(output_path, format="JPEG", quality=quality)
+    # Encode in memory so encoding and disk write are timed separately
+    report_progress("encoding")
+    jpeg, quality, encode_passes = encode_with_options(image, "jpeg", quality, max_bytes)
     
-    # Get converted file size
-    converted_size = output_path.stat().st_size
+    # Save as JPG, never leaving a partly written file behind
+    report_progress("persisting")
+    converted_size = write_atomic(output_path, jpeg)
     
     # Calculate conversion time
     conversion_time = time.time() - start_time
     
-    return original_size, converted_size, conversion_time
+    return original_size, converted_size, conversion_time, quality, encode_passes
 
 def generate_unique_filename(extension: str = ".jpg") -> str:
     """Generate a unique filename with the given extension"""
     return f"{uuid.uuid4()}{extension}"
 
-def clean_temp_files(retention_minutes: int = 30) -> int:
+def content_addressed_filename(data: bytes, extension: str) -> str:
+    """
+    Name a converted file after the SHA-256 of its contents
+
+    The same name always refers to the same bytes, so downloads can be
+    cached as immutable and the digest serves as their ETag.
+    """
+    return f"{hashlib.sha256(data).hexdigest()}{extension}"
+
+def clean_temp_files(storage: Storage, retention_minutes: int = 30) -> int:
     """
-    Clean up temporary files older than the specified retention period
+    Clean up stored files older than the specified retention period
     
     Args:
+        storage: Storage backend holding the files
         retention_minutes: File retention period in minutes
         
     Returns:
@@ -124,15 +501,11 @@ def clean_temp_files(retention_minutes: int = 30) -> int:
     deleted_count = 0
     cutoff_time = datetime.now() - timedelta(minutes=retention_minutes)
     
-    for file_path in settings.TEMP_DIR.glob("*"):
-        if file_path.is_file() and not file_path.name.startswith('.'):
-            # Check file modification time
-            mod_time = datetime.fromtimestamp(file_path.stat().st_mtime)
-            if mod_time < cutoff_time:
-                try:
-                    file_path.unlink()
-                    deleted_count += 1
-                except Exception:
-                    pass
+    for stored in list(storage.iter_expired(cutoff_time.timestamp())):
+        try:
+            storage.delete(stored.name)
+            deleted_count += 1
+        except Exception:
+            pass
     
     return deleted_count
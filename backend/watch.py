@@ -0,0 +1,526 @@
+"""
+Watch folders and convert HEIC/HEIF files as they arrive.
+
+Each watched source directory is mirrored to a destination directory, like
+bulk.py does for a one-off run, and shares its manifest format: files that
+are already converted are skipped after a restart.
+
+On Linux, changes are reported by inotify. Elsewhere, or with --poll (for
+network shares, whose remote writers inotify does not see), folders are
+scanned every WATCH_POLL_INTERVAL_SECONDS.
+
+A new or changed file is converted once its size and modification time
+have stayed the same for WATCH_DEBOUNCE_SECONDS, so files still being
+copied are left alone. At most WATCH_MAX_PENDING files are tracked at a
+time; when more arrive at once, the rest are found by rescanning the
+folder as the backlog drains. Conversions in flight are bounded by the
+number of workers.
+
+Progress is written to a JSON status file every few seconds.
+
+Usage:
+    python watch.py SOURCE DESTINATION [SOURCE DESTINATION ...] [--poll] [--workers 4]
+    python watch.py   # folders from settings.WATCH_FOLDERS
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import heapq
+import json
+import logging
+import os
+import select
+import signal
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+import decoders
+from bulk import (
+    MANIFEST_NAME,
+    PENDING_PER_WORKER,
+    Manifest,
+    SourceFile,
+    add_conversion_arguments,
+    conversion_options,
+    convert_one,
+    has_namesake,
+    is_source_name,
+    options_hash,
+    output_path_for,
+    walk_sources,
+)
+from config import settings
+from storage import write_atomic
+
+logger = logging.getLogger("watch")
+
+STATUS_INTERVAL_SECONDS = 5.0
+
+# Files taken from a rescan per loop iteration, so events are still handled during long scans
+RESCAN_BATCH = 1000
+
+# inotify event flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify binding through ctypes; Linux only"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def add_watch(self, path: Path, mask: int = WATCH_MASK) -> int:
+        wd = self._add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), str(path))
+        return wd
+
+    def read(self) -> List[Tuple[int, int, str]]:
+        """Pending events as (watch descriptor, mask, name)"""
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+@dataclass
+class WatchedFolder:
+    source: Path
+    destination: Path
+    manifest: Manifest
+
+
+@dataclass
+class PendingFile:
+    """A file waiting to stay unchanged for the debounce period"""
+    size: int
+    mtime_ns: int
+    due: float
+
+
+class Watcher:
+    """
+    Converts files arriving in watched folders
+
+    Args:
+        folders: (source, destination) directory pairs
+        options: convert_heic_to_jpg arguments
+        workers: Conversion processes
+        poll: Scan folders periodically instead of using inotify
+        status_path: Where to write the status file
+    """
+
+    def __init__(
+        self,
+        folders: List[Tuple[Path, Path]],
+        options: Dict[str, Any],
+        workers: int,
+        poll: bool = False,
+        status_path: Optional[Path] = None,
+    ):
+        self.folders = [
+            WatchedFolder(Path(source), Path(destination), Manifest(Path(destination) / MANIFEST_NAME))
+            for source, destination in folders
+        ]
+        self.options = options
+        self.digest = options_hash(options)
+        self.workers = workers
+        self.status_path = status_path or settings.WATCH_STATUS_PATH
+        self.debounce = settings.WATCH_DEBOUNCE_SECONDS
+        self.max_pending = settings.WATCH_MAX_PENDING
+
+        self.inotify: Optional[Inotify] = None
+        self.poll = poll
+        self._watches: Dict[int, Tuple[int, Path]] = {}
+
+        # Files waiting out the debounce period, with a min-heap of their due times
+        self._pending: Dict[Tuple[int, str], PendingFile] = {}
+        self._due: List[Tuple[float, int, str]] = []
+        # Folder scans in progress, consumed as the backlog allows
+        self._rescans: Deque[Tuple[int, Iterator[SourceFile]]] = deque()
+        self._rescanning: Dict[int, bool] = {}
+        # Folders to scan again once their current scan ends, which may have passed new files by
+        self._rescan_again: Set[int] = set()
+        # Conversions in progress, with the output path each one writes
+        self._running: Dict[Future, Tuple[int, SourceFile, str]] = {}
+        # Files that failed, skipped until they change
+        self._failed: Dict[Tuple[int, str], Tuple[int, int]] = {}
+
+        self._stopping = False
+        self.started_at = time.time()
+        self.converted = 0
+        self.failed = 0
+        self.last_converted: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[Dict[str, Any]] = None
+
+    # Discovery
+
+    def _watch_tree(self, index: int, directory: Path) -> None:
+        """Watch a directory and every directory below it"""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            wd = self.inotify.add_watch(current)
+            self._watches[wd] = (index, current)
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if not entry.name.startswith(".") and entry.is_dir(follow_symlinks=False):
+                            stack.append(Path(entry.path))
+            except OSError:
+                continue
+
+    def _start_inotify(self) -> None:
+        try:
+            self.inotify = Inotify()
+            for index, folder in enumerate(self.folders):
+                self._watch_tree(index, folder.source)
+        except (OSError, AttributeError) as e:
+            # No inotify here, or out of watches (see fs.inotify.max_user_watches)
+            logger.warning(f"inotify unavailable ({str(e)}); polling every {settings.WATCH_POLL_INTERVAL_SECONDS}s")
+            if self.inotify is not None:
+                self.inotify.close()
+                self.inotify = None
+            self._watches.clear()
+            self.poll = True
+
+    def _rescan(self, index: int, directory: Optional[Path] = None) -> None:
+        """Queue a scan of a folder, or of one directory in it"""
+        if directory is None:
+            if self._rescanning.get(index):
+                self._rescan_again.add(index)
+                return
+            self._rescanning[index] = True
+        self._rescans.append((index, walk_sources(self.folders[index].source, directory)))
+
+    def _feed_rescans(self) -> None:
+        """Take files from running scans while there is room to track them"""
+        budget = RESCAN_BATCH
+        while self._rescans and budget > 0 and len(self._pending) < self.max_pending:
+            index, files = self._rescans[0]
+            source_file = next(files, None)
+            if source_file is None:
+                self._rescans.popleft()
+                if not any(other == index for other, _ in self._rescans):
+                    self._rescanning[index] = False
+                    if index in self._rescan_again:
+                        self._rescan_again.discard(index)
+                        self._rescan(index)
+                continue
+            budget -= 1
+            self._observe(index, source_file.path, source_file)
+
+    def _observe(self, index: int, relative_path: str, source_file: Optional[SourceFile] = None) -> None:
+        """Start or restart the debounce period of a new or changed file"""
+        folder = self.folders[index]
+        if source_file is None:
+            try:
+                stat = (folder.source / relative_path).stat()
+            except OSError:
+                return
+            source_file = SourceFile(relative_path, stat.st_size, stat.st_mtime_ns)
+
+        key = (index, relative_path)
+        if folder.manifest.is_current(source_file, self.digest, folder.destination):
+            return
+        if self._failed.get(key) == (source_file.size, source_file.mtime_ns):
+            return
+
+        if key not in self._pending and len(self._pending) >= self.max_pending:
+            # Too many at once; a scan finds this file once the backlog drains
+            self._rescan(index)
+            return
+
+        due = time.monotonic() + self.debounce
+        self._pending[key] = PendingFile(source_file.size, source_file.mtime_ns, due)
+        heapq.heappush(self._due, (due, index, relative_path))
+        # Drop stale heap entries once they dominate the heap
+        if len(self._due) > 2 * len(self._pending) + 64:
+            self._due = [(pending.due, *key) for key, pending in self._pending.items()]
+            heapq.heapify(self._due)
+
+    def _handle_events(self) -> None:
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed; rescanning all folders")
+                for index in range(len(self.folders)):
+                    self._rescan(index)
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            watched = self._watches.get(wd)
+            if watched is None or not name or name.startswith("."):
+                continue
+            index, directory = watched
+            path = directory / name
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files can land in a new directory before it is watched
+                    try:
+                        self._watch_tree(index, path)
+                    except OSError as e:
+                        logger.warning(f"Cannot watch {path}: {str(e)}")
+                    self._rescan(index, path)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and is_source_name(name):
+                relative_path = path.relative_to(self.folders[index].source).as_posix()
+                self._observe(index, relative_path)
+
+    # Conversion
+
+    def _submit_due(self, pool: ProcessPoolExecutor) -> None:
+        now = time.monotonic()
+        capacity = self.workers * PENDING_PER_WORKER
+        busy = {(index, source_file.path) for index, source_file, _ in self._running.values()}
+        while self._due and self._due[0][0] <= now and len(self._running) < capacity:
+            due, index, relative_path = heapq.heappop(self._due)
+            key = (index, relative_path)
+            pending = self._pending.get(key)
+            # Skip heap entries left behind by a restarted debounce period
+            if pending is None or pending.due != due:
+                continue
+
+            folder = self.folders[index]
+            try:
+                stat = (folder.source / relative_path).stat()
+            except OSError:
+                del self._pending[key]
+                continue
+
+            if (stat.st_size, stat.st_mtime_ns) != (pending.size, pending.mtime_ns) or key in busy:
+                # Still being written, or the previous version is still converting
+                pending.size, pending.mtime_ns = stat.st_size, stat.st_mtime_ns
+                pending.due = now + self.debounce
+                heapq.heappush(self._due, (pending.due, index, relative_path))
+                continue
+
+            del self._pending[key]
+            source_file = SourceFile(relative_path, stat.st_size, stat.st_mtime_ns)
+            output = output_path_for(relative_path, has_namesake(folder.source, relative_path))
+            future = pool.submit(
+                convert_one,
+                str(folder.source / relative_path),
+                str(folder.destination / output),
+                self.options,
+            )
+            self._running[future] = (index, source_file, output)
+            busy.add(key)
+
+    def _finish(self, future: Future) -> None:
+        index, source_file, output = self._running.pop(future)
+        folder = self.folders[index]
+        key = (index, source_file.path)
+        try:
+            _, converted_size, conversion_time, quality, _ = future.result()
+        except Exception as e:
+            logger.error(f"Failed to convert {folder.source / source_file.path}: {str(e)}")
+            self.failed += 1
+            self._failed[key] = (source_file.size, source_file.mtime_ns)
+            self.last_error = {"path": str(folder.source / source_file.path), "error": str(e), "at": time.time()}
+            return
+
+        self._failed.pop(key, None)
+        folder.manifest.record({
+            "path": source_file.path,
+            "size": source_file.size,
+            "mtime_ns": source_file.mtime_ns,
+            "options": self.digest,
+            "output": output,
+            "converted_size": converted_size,
+            "quality": quality,
+            "conversion_time": round(conversion_time, 4),
+        })
+        self.converted += 1
+        self.last_converted = {"path": str(folder.source / source_file.path), "at": time.time()}
+
+    # Status
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "pid": os.getpid(),
+            "mode": "polling" if self.poll else "inotify",
+            "started_at": self.started_at,
+            "updated_at": now,
+            "folders": [
+                {"source": str(folder.source), "destination": str(folder.destination)}
+                for folder in self.folders
+            ],
+            "pending": len(self._pending),
+            "converting": len(self._running),
+            "scanning": bool(self._rescans),
+            "converted": self.converted,
+            "failed": self.failed,
+            "files_per_second": round(self.converted / max(now - self.started_at, 1e-9), 3),
+            "last_converted": self.last_converted,
+            "last_error": self.last_error,
+            "stopping": self._stopping,
+        }
+
+    def write_status(self) -> None:
+        try:
+            self.status_path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomic(self.status_path, json.dumps(self.status(), indent=2).encode())
+        except OSError as e:
+            logger.error(f"Cannot write status file {self.status_path}: {str(e)}")
+
+    # Main loop
+
+    def stop(self, *_: Any) -> None:
+        self._stopping = True
+
+    def _timeout(self, next_poll: float, next_status: float) -> float:
+        now = time.monotonic()
+        deadlines = [next_status]
+        if self.poll:
+            deadlines.append(next_poll)
+        if self._due:
+            deadlines.append(self._due[0][0])
+        timeout = min(deadlines) - now
+        if self._running or self._rescans:
+            # Collect results and keep scans moving
+            timeout = min(timeout, 0.1)
+        return max(0.0, min(timeout, 1.0))
+
+    def run(self) -> None:
+        for folder in self.folders:
+            folder.source.mkdir(parents=True, exist_ok=True)
+            folder.manifest.load()
+
+        if not self.poll:
+            self._start_inotify()
+        # Pick up whatever arrived while the daemon was not running
+        for index in range(len(self.folders)):
+            self._rescan(index)
+
+        decoders.registry.configure(settings.DECODER_BACKENDS, settings.DECODER_PREFERENCES)
+        next_poll = time.monotonic() + settings.WATCH_POLL_INTERVAL_SECONDS
+        next_status = time.monotonic()
+        logger.info(
+            f"Watching {len(self.folders)} folders ({'polling' if self.poll else 'inotify'}) "
+            f"with {self.workers} workers"
+        )
+
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=decoders.configure,
+                initargs=(decoders.registry.order, decoders.registry.preferences),
+            ) as pool:
+                while not self._stopping:
+                    timeout = self._timeout(next_poll, next_status)
+                    if self.inotify is not None:
+                        try:
+                            readable, _, _ = select.select([self.inotify], [], [], timeout)
+                        except InterruptedError:
+                            readable = []
+                        if readable:
+                            self._handle_events()
+                    elif timeout > 0:
+                        time.sleep(timeout)
+
+                    now = time.monotonic()
+                    if self.poll and now >= next_poll:
+                        for index in range(len(self.folders)):
+                            self._rescan(index)
+                        next_poll = now + settings.WATCH_POLL_INTERVAL_SECONDS
+
+                    self._feed_rescans()
+                    self._submit_due(pool)
+
+                    if self._running:
+                        done, _ = wait(self._running, timeout=0, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._finish(future)
+
+                    if now >= next_status:
+                        self.write_status()
+                        next_status = now + STATUS_INTERVAL_SECONDS
+
+                # Let conversions in flight finish so their outputs are recorded
+                logger.info(f"Stopping; waiting for {len(self._running)} conversions")
+                for future in list(self._running):
+                    future.exception()
+                    self._finish(future)
+        finally:
+            for folder in self.folders:
+                folder.manifest.close()
+            if self.inotify is not None:
+                self.inotify.close()
+            self.write_status()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Convert HEIC/HEIF files as they arrive in watched folders")
+    parser.add_argument("folders", nargs="*", type=Path, metavar="SOURCE DESTINATION")
+    add_conversion_arguments(parser)
+    parser.add_argument("--workers", type=int, default=settings.CONVERSION_WORKERS)
+    parser.add_argument("--poll", action="store_true", help="Scan periodically instead of using inotify")
+    parser.add_argument("--status", type=Path, default=settings.WATCH_STATUS_PATH, help="Status file to write")
+    args = parser.parse_args()
+
+    if args.folders:
+        if len(args.folders) % 2:
+            parser.error("folders must be given as SOURCE DESTINATION pairs")
+        folders = list(zip(args.folders[::2], args.folders[1::2]))
+    else:
+        folders = [(Path(source), Path(destination)) for source, destination in settings.WATCH_FOLDERS.items()]
+    if not folders:
+        parser.error("no folders to watch; pass SOURCE DESTINATION or set WATCH_FOLDERS")
+
+    watcher = Watcher(folders, conversion_options(args), max(1, args.workers), args.poll, args.status)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    signal.signal(signal.SIGINT, watcher.stop)
+    watcher.run()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
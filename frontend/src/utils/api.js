@@ -47,6 +47,14 @@ export const convertImage = async (file, options = {}) => {
     formData.append('rotate', options.rotate);
   }
   
+  if (options.max_bytes) {
+    formData.append('max_bytes', options.max_bytes);
+  }
+  
+  if (options.format) {
+    formData.append('format', options.format);
+  }
+  
   try {
     const response = await api.post(`${API_V1}/convert`, formData);
     return response.data;